@@ -16,6 +16,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'corsheaders',  # Added for CORS
+    'handleDataset',
 ]
 
 MIDDLEWARE = [
@@ -85,3 +86,35 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # CORS Configuration
 CORS_ALLOW_ALL_ORIGINS = True  # Allow all origins for development
+
+# Recommender data
+RECOMMENDER_DATA_DIR = BASE_DIR / 'handleDataset' / 'data'
+RECOMMENDER_MODEL_DIR = RECOMMENDER_DATA_DIR / 'model'  # generations published by `manage.py recommender_model build`
+RECOMMENDER_MODEL_KEEP_GENERATIONS = 3  # published generations kept on disk
+RECOMMENDER_MODEL_FIT_IN_PROCESS = True  # False: serve a stale published model rather than fit one per worker
+RECOMMENDER_COLUMNAR_DIR = RECOMMENDER_DATA_DIR / 'columnar'  # built by `manage.py convert_data`
+RECOMMENDER_REFRESH_IN_BACKGROUND = True  # serve the current snapshot while a changed one is rebuilt
+RECOMMENDER_PURCHASE_LOG = None  # purchases ingested through the API, shared by workers; None: data dir/purchases.log
+RECOMMENDER_ITEM_NEIGHBOURS = 100  # top-M similar products kept per product
+RECOMMENDER_USER_NEIGHBOURS = 50  # top-K similar users kept per PersonID
+RECOMMENDER_USER_NEIGHBOURS_APPROXIMATE = False  # capped-postings candidate search for very large user bases
+RECOMMENDER_CACHE_SIZE = 10000  # recommendation lists kept per process
+RECOMMENDER_CACHE_TTL = 300  # seconds
+RECOMMENDER_CACHE_ALIAS = None  # optional CACHES alias shared between processes
+RECOMMENDER_COLD_START_SIZE = 50  # precomputed recommendations per segment / category for new shoppers
+RECOMMENDER_METRICS = True  # per-stage timers served at /metrics/
+RECOMMENDER_DEBUG_REQUESTS = DEBUG  # allow ?debug=timings and ?debug=profile on api/data/
+RECOMMENDER_PROFILER = 'handleDataset.services.metrics.SamplingProfiler'  # used by ?debug=profile
+RECOMMENDER_WARM_UP = 'background'  # load the snapshot at startup: 'background', 'blocking' (preforking servers) or None
+RECOMMENDER_ENGINE = {
+    'BACKEND': 'handleDataset.services.engines.CosineEngine',  # or handleDataset.services.engines.ALSEngine
+    'OPTIONS': {},  # ALSEngine: factors, regularization, alpha, iterations, cg_steps, ...
+}
+
+# Recipe generation
+RECIPE_LLM_BACKEND = {
+    'BACKEND': 'handleDataset.services.llm.GeminiBackend',  # or handleDataset.services.llm.EchoBackend offline
+    'OPTIONS': {'model_name': 'gemini-1.5-flash'},
+}
+RECIPE_CACHE_SIZE = 1000  # generated recipes kept per process
+RECIPE_CACHE_SIMILARITY = None  # e.g. 0.8 to reuse recipes for ingredient sets this similar (Jaccard)
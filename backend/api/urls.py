@@ -1,10 +1,14 @@
 from django.contrib import admin
 from django.urls import path
-from handleDataset.views import DataApi, PurchaseDetailsApi,generate_recipe  # Import your views
+from handleDataset.views import DataApi, BatchDataApi, MetricsApi, PurchaseDetailsApi, PurchasesApi, ReadinessApi, generate_recipe  # Import your views
 
 urlpatterns = [
     path('admin/', admin.site.urls),  # Admin panel
     path('api/data/', DataApi, name='data_api'),  # DataApi endpoint for recommendations
+    path('api/data/batch/', BatchDataApi, name='batch_data_api'),  # Recommendations for many personIds in one POST
+    path('api/purchases/', PurchasesApi, name='purchases_api'),  # Ingest new purchases without a refit
     path('api/purchase-details/', PurchaseDetailsApi, name='purchase_details_api'),  # New endpoint for purchase details
+    path('metrics/', MetricsApi, name='metrics'),  # Prometheus scrape endpoint
+    path('ready/', ReadinessApi, name='ready'),  # Readiness probe: 503 until the recommender has warmed up
     path('generate-recipe/', generate_recipe, name='generate_recipe'),
 ]
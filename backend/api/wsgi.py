@@ -12,5 +12,6 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
+os.environ.setdefault('RECOMMENDER_SERVING', '1')  # warm up the recommender (RECOMMENDER_WARM_UP)
 
 application = get_wsgi_application()
@@ -1,6 +1,29 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
+# Whether this process is about to serve requests: a server that loaded
+# api.wsgi or api.asgi (they set RECOMMENDER_SERVING=1), or runserver, but
+# not its autoreloader parent. Scripts, tests, workers and other management
+# commands do not warm up.
+def _serving():
+    if os.environ.get('RECOMMENDER_SERVING') is not None:
+        return os.environ['RECOMMENDER_SERVING'] == '1'
+    if os.path.basename(sys.argv[0]) not in ('manage.py', 'django-admin'):
+        return False
+    if len(sys.argv) < 2 or sys.argv[1] != 'runserver':
+        return False
+    return '--noreload' in sys.argv or os.environ.get('RUN_MAIN') == 'true'
+
+
 class HandledatasetConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'handleDataset'
+
+    def ready(self):
+        # Load the recommender snapshot before the first request (RECOMMENDER_WARM_UP)
+        if _serving():
+            from .services.warmup import start_warm_up
+            start_warm_up()
@@ -0,0 +1,313 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+
+from handleDataset.services.cache import reset_cache
+from handleDataset.services.data_processing import (
+    compute_item_similarity,
+    create_user_item_matrix,
+    get_data_dir,
+    get_recommendations_for_person,
+    load_purchases,
+    recommend_products_for_user,
+    recommend_similarity_products,
+)
+from handleDataset.services.llm import reset_llm_backend
+from handleDataset.services.model import item_neighbour_limit
+from handleDataset.services.pools import NameSet
+from handleDataset.services.recipes import reset_recipe_cache
+from handleDataset.services.snapshot import PURCHASES_FILE, get_snapshot, reset_snapshot
+from handleDataset.services.synthetic import write_dataset
+
+FORMAT_VERSION = 1
+
+VIEWS = {
+    'data_api': '/api/data/',
+    'purchase_details_api': '/api/purchase-details/',
+    'generate_recipe': '/generate-recipe/',
+}
+
+# A fresh server process (it loads api.wsgi like a WSGI server): time from
+# interpreter start to a loaded URLconf, then one DataApi request. argv:
+# JSON settings overrides, PersonID.
+STARTUP_SCRIPT = '''
+import json, os, sys, time
+started = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
+from django.conf import settings
+for name, value in json.loads(sys.argv[1]).items():
+    setattr(settings, name, value)
+import api.wsgi
+import api.urls
+from django.test import Client
+booted = time.perf_counter()
+response = Client().get('/api/data/', {'personId': sys.argv[2]})
+print(json.dumps({'startup': booted - started, 'first_request': time.perf_counter() - booted,
+                  'status': response.status_code}))
+'''
+
+# RECOMMENDER_WARM_UP values compared by the startup measurement
+STARTUP_MODES = {'lazy': None, 'blocking': 'blocking'}
+
+
+# Latency statistics in milliseconds
+def summarize(seconds):
+    ms = np.asarray(seconds) * 1000.0
+    return {
+        'n': len(ms),
+        'min_ms': float(ms.min()),
+        'median_ms': float(np.median(ms)),
+        'mean_ms': float(ms.mean()),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
+
+
+# Wall time of each of repeat calls to fn
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Time the recommender stages and HTTP views on a dataset and record the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-dir', default=None, help='Directory with products.csv and purchases.csv.')
+        parser.add_argument('--users', type=int, default=None, help='Benchmark a synthetic dataset of this many people.')
+        parser.add_argument('--products', type=int, default=1000, help='Products in the synthetic dataset.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of each model-level step.')
+        parser.add_argument('--people', type=int, default=200, help='People sampled for per-person timings.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per view.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Client threads per view.')
+        parser.add_argument('--with-cache', action='store_true', help='Keep the recommendation cache on for the views.')
+        parser.add_argument('--skip-views', action='store_true')
+        parser.add_argument('--startup-runs', type=int, default=3,
+                            help='Fresh processes started per warm-up mode to time startup (0 to skip).')
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--compare', default=None, help='Earlier results to compare medians against.')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown reported as a regression.')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        work_dir = tempfile.mkdtemp(prefix='recommender-benchmark-')
+        try:
+            data_dir = options['data_dir'] or str(get_data_dir())
+            if options['users'] is not None:
+                data_dir = os.path.join(work_dir, 'data')
+                write_dataset(
+                    data_dir, options['users'], options['products'], seed_dir=str(get_data_dir()),
+                    random_seed=options['seed'],
+                )
+
+            # Private model and columnar dirs: the benchmark always measures an in-process fit
+            overrides = {
+                'RECOMMENDER_DATA_DIR': data_dir,
+                'RECOMMENDER_MODEL_DIR': os.path.join(work_dir, 'model'),
+                'RECOMMENDER_COLUMNAR_DIR': os.path.join(work_dir, 'columnar'),
+                'RECIPE_LLM_BACKEND': {'BACKEND': 'handleDataset.services.llm.EchoBackend', 'OPTIONS': {}},
+            }
+            if not options['with_cache']:
+                overrides['RECOMMENDER_CACHE_SIZE'] = 0
+            with override_settings(**overrides):
+                self._reset()
+                try:
+                    results = self.run(options)
+                finally:
+                    self._reset()
+                results['startup'] = self.measure_startup(overrides, options['startup_runs'])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        results['source'] = {'data_dir': options['data_dir'], 'users': options['users'], 'products': options['products'],
+                             'seed': options['seed']}
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['compare']:
+            regressions = self.compare(options['compare'], results, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+
+    def _reset(self):
+        reset_snapshot()
+        reset_cache()
+        reset_llm_backend()
+        reset_recipe_cache()
+
+    def run(self, options):
+        repeat = options['repeat']
+        timings = {}
+
+        purchases_df = load_purchases(PURCHASES_FILE)
+        timings['create_user_item_matrix'] = summarize(measure(lambda: create_user_item_matrix(purchases_df), repeat))
+        user_item_matrix = create_user_item_matrix(purchases_df)
+        timings['compute_item_similarity'] = summarize(measure(
+            lambda: compute_item_similarity(user_item_matrix, top_m=item_neighbour_limit()), repeat
+        ))
+
+        started = time.perf_counter()
+        snapshot = get_snapshot()
+        timings['build_snapshot'] = summarize([time.perf_counter() - started])
+        self.stdout.write(f"Snapshot built in {timings['build_snapshot']['median_ms']:.0f} ms")
+
+        rng = np.random.default_rng(options['seed'])
+        person_ids = snapshot.user_item_matrix.person_ids
+        people = rng.choice(person_ids, size=min(options['people'], len(person_ids)), replace=False).tolist()
+
+        per_person = {
+            'recommend_products_for_user': lambda p: recommend_products_for_user(
+                p, snapshot.user_item_matrix, snapshot.item_neighbours
+            ),
+            'recommend_similarity_products': lambda p: recommend_similarity_products(
+                p, snapshot.user_item_matrix, snapshot.catalogue, snapshot.pools,
+                NameSet(len(snapshot.catalogue.names)), snapshot.model_product_codes,
+                user_neighbours=snapshot.user_neighbours,
+            ),
+            'get_recommendations_for_person': lambda p: get_recommendations_for_person(p, snapshot=snapshot),
+        }
+        for name, fn in per_person.items():
+            samples = []
+            for person_id in people:
+                started = time.perf_counter()
+                fn(person_id)
+                samples.append(time.perf_counter() - started)
+            timings[name] = summarize(samples)
+
+        views = {}
+        if not options['skip_views']:
+            for name, url in VIEWS.items():
+                views[name] = self.load_test(url, people, options['requests'], options['concurrency'])
+
+        for name, stats in {**timings, **views}.items():
+            self.stdout.write(f"{name:<32} median {stats['median_ms']:9.3f} ms   p95 {stats['p95_ms']:9.3f} ms")
+
+        n_users, n_products = snapshot.user_item_matrix.shape
+        return {
+            'format_version': FORMAT_VERSION,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_revision': _git_revision(),
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'scipy': scipy.__version__,
+                'cpus': os.cpu_count(),
+            },
+            'dataset': {
+                'users': n_users,
+                'products': n_products,
+                'catalogue_products': len(snapshot.catalogue),
+                'purchases': len(snapshot.purchases_df),
+                'user_item_nnz': int(snapshot.user_item_matrix.matrix.nnz),
+            },
+            'timings': timings,
+            'views': views,
+        }
+
+    # Startup and first-request latency of fresh server processes, per
+    # warm-up mode: lazy startup pays for the snapshot on the first request,
+    # blocking startup before it
+    def measure_startup(self, overrides, runs):
+        if not runs:
+            return {}
+        person_id = int(pd.read_csv(os.path.join(overrides['RECOMMENDER_DATA_DIR'], 'purchases.csv'), nrows=1)['PersonID'][0])
+
+        results = {}
+        for mode, warm_up in STARTUP_MODES.items():
+            samples = {'startup': [], 'first_request': []}
+            for _ in range(runs):
+                settings_json = json.dumps({**overrides, 'RECOMMENDER_WARM_UP': warm_up})
+                completed = subprocess.run(
+                    [sys.executable, '-c', STARTUP_SCRIPT, settings_json, str(person_id)],
+                    capture_output=True, text=True, cwd=str(settings.BASE_DIR), check=True,
+                )
+                run = json.loads(completed.stdout.strip().splitlines()[-1])
+                if run['status'] != 200:
+                    raise CommandError(f"First request after {mode} startup answered {run['status']}")
+                samples['startup'].append(run['startup'])
+                samples['first_request'].append(run['first_request'])
+            for name, seconds in samples.items():
+                results[f'{name}_{mode}'] = summarize(seconds)
+
+        for name, stats in results.items():
+            self.stdout.write(f"{name:<32} median {stats['median_ms']:9.3f} ms")
+        return results
+
+    # Latency and throughput of n_requests GETs of url from concurrency threads
+    def load_test(self, url, people, n_requests, concurrency):
+        local = threading.local()
+        errors = []
+
+        def request(i):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            started = time.perf_counter()
+            response = local.client.get(url, {'personId': people[i % len(people)]})
+            elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                errors.append(response.status_code)
+            return elapsed
+
+        request(0)  # warm-up, outside the measurement
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(request, range(n_requests)))
+        wall = time.perf_counter() - started
+
+        stats = summarize(samples)
+        stats.update(concurrency=concurrency, throughput_rps=n_requests / wall, errors=len(errors))
+        return stats
+
+    # Print median ratios against an earlier results file, returning the regressed names
+    def compare(self, path, results, threshold):
+        with open(path) as f:
+            baseline = json.load(f)
+
+        regressions = []
+        self.stdout.write(f"Compared with {path} ({baseline.get('git_revision') or 'unknown revision'}):")
+        for section in ('timings', 'views', 'startup'):
+            for name, stats in results[section].items():
+                before = baseline.get(section, {}).get(name)
+                if not before:
+                    continue
+                ratio = stats['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+                flag = ''
+                if ratio > 1 + threshold:
+                    flag = '  REGRESSION'
+                    regressions.append(name)
+                self.stdout.write(
+                    f"  {name:<32} {before['median_ms']:9.3f} -> {stats['median_ms']:9.3f} ms  x{ratio:.2f}{flag}"
+                )
+        return regressions
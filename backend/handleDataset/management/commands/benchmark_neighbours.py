@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from handleDataset.services.data_processing import create_user_item_matrix, get_data_dir, load_purchases
+from handleDataset.services.model import item_neighbour_limit, user_neighbour_limit
+from handleDataset.services.neighbours import build_item_neighbours, build_user_neighbours
+from handleDataset.services.snapshot import PURCHASES_FILE
+from handleDataset.services.synthetic import write_dataset
+
+
+# (seconds, peak traced MiB, result) of fn()
+def timed(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2 ** 20, result
+
+
+# How much of the exact neighbour lists of sample rows approximate found:
+# shared entries, and the share of the exact similarity weight it kept
+def neighbour_recall(exact, approximate):
+    found = approximate.multiply(exact > 0)
+    return {
+        'recall': found.nnz / max(exact.nnz, 1),
+        'weight': float(approximate.sum() / max(exact.sum(), 1e-12)),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Time the user and item neighbour builds on a synthetic Zipf dataset (10^6 people by default) and '
+            'measure the approximate user neighbours against exact ones for a sample of people.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000)
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--max-postings', type=int, default=200)
+        parser.add_argument('--max-candidates', type=int, default=500)
+        parser.add_argument('--exact', action='store_true',
+                            help='Also time the exact user neighbour build (quadratic in people).')
+        parser.add_argument('--sample', type=int, default=1000, help='People whose exact neighbours are compared.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='neighbours.json')
+
+    def handle(self, *args, **options):
+        work_dir = tempfile.mkdtemp(prefix='recommender-neighbours-')
+        try:
+            data_dir = os.path.join(work_dir, 'data')
+            write_dataset(
+                data_dir, options['users'], options['products'], seed_dir=str(get_data_dir()),
+                random_seed=options['seed'],
+            )
+            with override_settings(RECOMMENDER_DATA_DIR=data_dir,
+                                   RECOMMENDER_COLUMNAR_DIR=os.path.join(work_dir, 'columnar')):
+                user_item = create_user_item_matrix(load_purchases(PURCHASES_FILE)).matrix
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        self.stdout.write(f'{user_item.shape[0]} people x {user_item.shape[1]} products, {user_item.nnz} purchases')
+
+        k = user_neighbour_limit()
+        results = {}
+        builds = {
+            'item_neighbours': lambda: build_item_neighbours(user_item, m=item_neighbour_limit()),
+            'user_neighbours_approximate': lambda: build_user_neighbours(
+                user_item, k=k, approximate=True, max_postings=options['max_postings'],
+                max_candidates=options['max_candidates'],
+            ),
+        }
+        if options['exact']:
+            builds['user_neighbours_exact'] = lambda: build_user_neighbours(user_item, k=k)
+
+        approximate = None
+        for name, build in builds.items():
+            seconds, peak_mib, neighbours = timed(build)
+            results[name] = {'seconds': seconds, 'peak_mib': peak_mib, 'nnz': int(neighbours.nnz)}
+            if name == 'user_neighbours_approximate':
+                approximate = neighbours
+            self.stdout.write(f'{name:<28} {seconds:9.1f} s   peak {peak_mib:9.1f} MiB')
+
+        rng = np.random.default_rng(options['seed'])
+        sample = np.sort(rng.choice(user_item.shape[0], size=min(options['sample'], user_item.shape[0]), replace=False))
+        # Small blocks: an exact row pairs with a large share of all people
+        exact = build_user_neighbours(user_item, k=k, rows=sample, block_size=32)
+        results['user_neighbours_approximate'].update(neighbour_recall(exact, approximate[sample]))
+        self.stdout.write(
+            f"approximate recall {results['user_neighbours_approximate']['recall']:.3f}   "
+            f"weight kept {results['user_neighbours_approximate']['weight']:.3f}"
+        )
+
+        output = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'dataset': {'users': user_item.shape[0], 'products': user_item.shape[1], 'user_item_nnz': int(user_item.nnz),
+                        'seed': options['seed']},
+            'options': {'k': k, 'm': item_neighbour_limit(), 'max_postings': options['max_postings'],
+                        'max_candidates': options['max_candidates'], 'sample': len(sample)},
+            'builds': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(output, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
@@ -0,0 +1,187 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from dataclasses import fields
+
+import numpy as np
+import scipy.sparse as sp
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from handleDataset.management.commands.benchmark import summarize
+from handleDataset.services.data_processing import (
+    compute_item_similarity,
+    create_user_item_matrix,
+    get_data_dir,
+    load_purchases,
+)
+from handleDataset.services.engines import create_engine
+from handleDataset.services.model import item_neighbour_limit
+from handleDataset.services.snapshot import PURCHASES_FILE
+from handleDataset.services.synthetic import write_dataset
+
+ENGINES = {
+    'cosine': {'BACKEND': 'handleDataset.services.engines.CosineEngine', 'OPTIONS': {}},
+    'als': {'BACKEND': 'handleDataset.services.engines.ALSEngine', 'OPTIONS': {}},
+}
+
+
+# (train purchases, {PersonID: held-out product names}): for every person
+# with at least min_products distinct products, all purchases of a random
+# fraction of them (at least one) are held out
+def holdout_split(purchases_df, fraction, min_products, seed):
+    pairs = purchases_df[['PersonID', 'ProductName']].drop_duplicates()
+    rng = np.random.default_rng(seed)
+    pairs = pairs.assign(key=rng.random(len(pairs))).sort_values(['PersonID', 'key'])
+    counts = pairs.groupby('PersonID')['ProductName'].transform('size').to_numpy()
+    rank = pairs.groupby('PersonID').cumcount().to_numpy()
+    held = (counts >= min_products) & (rank < np.maximum(1, np.floor(counts * fraction)))
+
+    held_pairs = pairs[held]
+    test = held_pairs.groupby('PersonID')['ProductName'].agg(set).to_dict()
+    is_held = purchases_df.set_index(['PersonID', 'ProductName']).index.isin(
+        held_pairs.set_index(['PersonID', 'ProductName']).index
+    )
+    return purchases_df[~is_held], test
+
+
+# Bytes held by the arrays and sparse matrices of an engine state
+def state_bytes(state):
+    total = 0
+    for f in fields(state):
+        value = getattr(state, f.name)
+        if sp.issparse(value):
+            total += value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+        elif isinstance(value, np.ndarray):
+            total += value.nbytes
+    return total
+
+
+class Command(BaseCommand):
+    help = ('Compare recommendation engines on a held-out split of purchases.csv: fit time and memory, '
+            'scoring latency, and hit rate / recall of the held-out products in the top N.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-dir', default=None, help='Directory with products.csv and purchases.csv.')
+        parser.add_argument('--users', type=int, default=None, help='Compare on a synthetic dataset of this many people.')
+        parser.add_argument('--products', type=int, default=1000, help='Products in the synthetic dataset.')
+        parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+        parser.add_argument('--options', default='{}',
+                            help='JSON engine options by engine name, e.g. \'{"als": {"factors": 64}}\'.')
+        parser.add_argument('--holdout', type=float, default=0.2, help='Share of each person\'s products held out.')
+        parser.add_argument('--min-products', type=int, default=2, help='Distinct products needed to hold any out.')
+        parser.add_argument('--top-n', type=int, default=20)
+        parser.add_argument('--people', type=int, default=200, help='People sampled for per-person latency.')
+        parser.add_argument('--batch-size', type=int, default=1024)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='engines.json')
+
+    def handle(self, *args, **options):
+        try:
+            engine_options = json.loads(options['options'])
+        except ValueError as e:
+            raise CommandError(f'--options is not valid JSON: {e}')
+
+        work_dir = tempfile.mkdtemp(prefix='recommender-engines-')
+        try:
+            data_dir = options['data_dir'] or str(get_data_dir())
+            if options['users'] is not None:
+                data_dir = os.path.join(work_dir, 'data')
+                write_dataset(
+                    data_dir, options['users'], options['products'], seed_dir=str(get_data_dir()),
+                    random_seed=options['seed'],
+                )
+            with override_settings(RECOMMENDER_DATA_DIR=data_dir,
+                                   RECOMMENDER_COLUMNAR_DIR=os.path.join(work_dir, 'columnar')):
+                purchases_df = load_purchases(PURCHASES_FILE)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        train_df, test = holdout_split(purchases_df, options['holdout'], options['min_products'], options['seed'])
+        user_item_matrix = create_user_item_matrix(train_df)
+        test = {p: names for p, names in test.items() if p in user_item_matrix}
+        test_people = sorted(test)
+        self.stdout.write(
+            f'{len(train_df)} training purchases, {sum(map(len, test.values()))} held-out products '
+            f'of {len(test_people)} people'
+        )
+
+        rng = np.random.default_rng(options['seed'])
+        sample = rng.choice(test_people, size=min(options['people'], len(test_people)), replace=False).tolist()
+
+        results = {}
+        for name in options['engines']:
+            config = dict(ENGINES[name], OPTIONS={**ENGINES[name]['OPTIONS'], **engine_options.get(name, {})})
+            results[name] = self.evaluate(
+                create_engine(config), user_item_matrix, test, test_people, sample, options
+            )
+            self.stdout.write(
+                f"{name:<8} fit {results[name]['fit_seconds']:8.2f} s   "
+                f"peak {results[name]['fit_peak_mib']:8.1f} MiB   state {results[name]['state_mib']:8.1f} MiB   "
+                f"person median {results[name]['person']['median_ms']:7.3f} ms   "
+                f"hit rate {results[name]['hit_rate']:.3f}   recall {results[name]['recall']:.3f}"
+            )
+
+        output = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'split': {
+                'holdout': options['holdout'],
+                'min_products': options['min_products'],
+                'seed': options['seed'],
+                'train_purchases': len(train_df),
+                'test_people': len(test_people),
+                'held_out_products': sum(map(len, test.values())),
+            },
+            'dataset': {'users': user_item_matrix.shape[0], 'products': user_item_matrix.shape[1],
+                        'user_item_nnz': int(user_item_matrix.matrix.nnz)},
+            'top_n': options['top_n'],
+            'engines': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(output, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    # Fit (item neighbours count towards the fit of engines that use them),
+    # then score every test person and look for their held-out products
+    def evaluate(self, engine, user_item_matrix, test, test_people, sample, options):
+        top_n = options['top_n']
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        item_neighbours = None
+        if engine.uses_item_neighbours:
+            item_neighbours = compute_item_similarity(user_item_matrix, top_m=item_neighbour_limit())
+        state = engine.fit(user_item_matrix, item_neighbours)
+        fit_seconds = time.perf_counter() - started
+        fit_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        samples = []
+        for person_id in sample:
+            started = time.perf_counter()
+            engine.recommend_columns(state, user_item_matrix, [person_id], top_n=top_n)
+            samples.append(time.perf_counter() - started)
+
+        hits, recalls = [], []
+        started = time.perf_counter()
+        for start in range(0, len(test_people), options['batch_size']):
+            batch = test_people[start:start + options['batch_size']]
+            for person_id, columns in zip(batch, engine.recommend_columns(state, user_item_matrix, batch, top_n)):
+                held_out = test[person_id]
+                found = len(held_out.intersection(user_item_matrix.product_names[columns].tolist()))
+                hits.append(found > 0)
+                recalls.append(found / min(len(held_out), top_n))
+        batch_seconds = time.perf_counter() - started
+
+        return {
+            'fit_seconds': fit_seconds,
+            'fit_peak_mib': fit_peak / 2 ** 20,
+            'state_mib': state_bytes(state) / 2 ** 20,
+            'person': summarize(samples),
+            'batch_people_per_second': len(test_people) / batch_seconds,
+            'hit_rate': float(np.mean(hits)),
+            'recall': float(np.mean(recalls)),
+        }
@@ -0,0 +1,20 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from handleDataset.services import columnar
+from handleDataset.services.data_processing import columnar_path, get_data_dir, load_products, load_purchases
+from handleDataset.services.snapshot import PRODUCTS_FILE, PURCHASES_FILE
+
+
+class Command(BaseCommand):
+    help = 'Convert products.csv and purchases.csv into the columnar store the loaders read.'
+
+    def handle(self, *args, **options):
+        for filename, loader in ((PRODUCTS_FILE, load_products), (PURCHASES_FILE, load_purchases)):
+            # Stat before reading, so a concurrent append leaves the copy stale rather than wrong
+            source_stat = columnar.file_stat(os.path.join(get_data_dir(), filename))
+            df = loader(filename, use_columnar=False)
+            path = columnar.write_table(df, columnar_path(filename), source_stat)
+            self.stdout.write(f'{filename}: {len(df)} rows x {len(df.columns)} columns -> {path}')
+        self.stdout.write(self.style.SUCCESS('Columnar store is up to date'))
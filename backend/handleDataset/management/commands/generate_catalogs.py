@@ -0,0 +1,163 @@
+import importlib.util
+import json
+import multiprocessing
+import os
+import time
+
+import django
+import pandas as pd
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from handleDataset.services.data_processing import get_recommendations_for_people, load_purchases
+from handleDataset.services.engines import get_engine
+from handleDataset.services.model import FORMAT_VERSION, fit_model, publish_model, read_model_meta
+from handleDataset.services.snapshot import PURCHASES_FILE, get_snapshot, source_hash
+
+CHECKPOINT_FILE = '_checkpoint.json'
+
+_worker_options = {}
+
+
+# Runs once per worker process. The snapshot memory-maps the model artifact,
+# so every worker shares the same physical pages instead of a pickled copy.
+def _init_worker(options):
+    if not apps.ready:
+        django.setup()
+    _worker_options.update(options)
+    get_snapshot()
+
+
+def _chunk_path(output_dir, index, fmt):
+    return os.path.join(output_dir, f'catalogs-{index:05d}.{fmt}')
+
+
+# Compute one chunk of people and write it atomically, returning (index, people written)
+def _generate_chunk(task):
+    index, person_ids = task
+    options = _worker_options
+    recommendations = get_recommendations_for_people(person_ids, top_n=options['top_n'], snapshot=get_snapshot())
+
+    path = _chunk_path(options['output_dir'], index, options['format'])
+    tmp_path = f'{path}.tmp'
+    if options['format'] == 'parquet':
+        rows = [
+            {'personId': person_id, 'rank': rank, **item}
+            for person_id, items in recommendations.items()
+            for rank, item in enumerate(items, start=1)
+        ]
+        pd.DataFrame(rows).to_parquet(tmp_path, index=False)
+    else:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for person_id, items in recommendations.items():
+                f.write(json.dumps({'personId': person_id, 'topRecommendations': items}, ensure_ascii=False))
+                f.write('\n')
+    os.replace(tmp_path, path)
+    return index, len(recommendations)
+
+
+class Command(BaseCommand):
+    help = 'Generate catalogue recommendations for every PersonID in purchases.csv.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir')
+        parser.add_argument('--top-n', type=int, default=10)
+        parser.add_argument('--chunk-size', type=int, default=5000, help='People per output file.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint.')
+
+    def handle(self, *args, **options):
+        # pandas writes Parquet through pyarrow or fastparquet, neither of which the service needs
+        if options['format'] == 'parquet' and not any(
+            importlib.util.find_spec(engine) for engine in ('pyarrow', 'fastparquet')
+        ):
+            raise CommandError('--format parquet needs pyarrow (pip install pyarrow); use --format jsonl without it')
+
+        output_dir = options['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+
+        data_version = self.ensure_model()
+        person_ids = sorted(int(p) for p in get_snapshot().user_item_matrix.person_ids)
+        chunk_size = options['chunk_size']
+        chunks = [person_ids[i:i + chunk_size] for i in range(0, len(person_ids), chunk_size)]
+
+        checkpoint = {
+            'data_version': data_version,
+            'top_n': options['top_n'],
+            'chunk_size': chunk_size,
+            'format': options['format'],
+            'chunks': len(chunks),
+            'completed': [],
+        }
+        checkpoint['completed'] = self.load_checkpoint(output_dir, checkpoint, options['restart'])
+        done = set(checkpoint['completed'])
+        tasks = [(i, chunk) for i, chunk in enumerate(chunks) if i not in done]
+        if done:
+            self.stdout.write(f'Resuming: {len(done)}/{len(chunks)} chunks already written')
+
+        worker_options = {'output_dir': output_dir, 'top_n': options['top_n'], 'format': options['format']}
+        people_done = sum(len(chunks[i]) for i in done)
+        started = time.monotonic()
+
+        def record(index, count):
+            nonlocal people_done
+            checkpoint['completed'].append(index)
+            self.save_checkpoint(output_dir, checkpoint)
+            people_done += count
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"[{len(checkpoint['completed'])}/{len(chunks)} chunks] {people_done}/{len(person_ids)} people, "
+                f"{elapsed:.1f}s elapsed"
+            )
+
+        if options['workers'] <= 1:
+            _init_worker(worker_options)
+            for task in tasks:
+                record(*_generate_chunk(task))
+        else:
+            with multiprocessing.Pool(options['workers'], initializer=_init_worker, initargs=(worker_options,)) as pool:
+                for index, count in pool.imap_unordered(_generate_chunk, tasks):
+                    record(index, count)
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote catalogues for {len(person_ids)} people to {output_dir}'))
+
+    # Make sure workers can memory-map a model fitted on the current data, in
+    # the current format, with the state of the configured engine when it
+    # stores one, so none of them refits anything
+    def ensure_model(self):
+        data_version = source_hash()
+        engine = get_engine()
+        meta = read_model_meta()
+        if (
+            meta is None
+            or meta.get('data_version') != data_version
+            or meta.get('format_version') != FORMAT_VERSION
+            or meta.get('engine') != (engine.config() if engine.stores_state else None)
+        ):
+            self.stdout.write('Model artifact missing or stale, building it')
+            publish_model(fit_model(load_purchases(PURCHASES_FILE), data_version, engine=engine))
+        return data_version
+
+    def load_checkpoint(self, output_dir, checkpoint, restart):
+        path = os.path.join(output_dir, CHECKPOINT_FILE)
+        if restart or not os.path.exists(path):
+            return []
+
+        with open(path) as f:
+            saved = json.load(f)
+        settings = ('data_version', 'top_n', 'chunk_size', 'format')
+        if any(saved.get(key) != checkpoint[key] for key in settings):
+            raise CommandError(
+                f'{path} was written for different data or options; use --restart to start over'
+            )
+        return [
+            index for index in saved['completed']
+            if os.path.exists(_chunk_path(output_dir, index, checkpoint['format']))
+        ]
+
+    def save_checkpoint(self, output_dir, checkpoint):
+        path = os.path.join(output_dir, CHECKPOINT_FILE)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(f'{path}.tmp', path)
@@ -0,0 +1,44 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from handleDataset.services.data_processing import get_data_dir
+from handleDataset.services.synthetic import write_dataset
+
+
+class Command(BaseCommand):
+    help = 'Write a synthetic products.csv / purchases.csv pair with power-law purchase patterns.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir')
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same files.')
+        parser.add_argument('--basket-min', type=int, default=4, help='Smallest number of products per person.')
+        parser.add_argument('--basket-alpha', type=float, default=2.5, help='Pareto exponent of basket sizes.')
+        parser.add_argument('--popularity-alpha', type=float, default=1.0, help='Zipf exponent of product popularity.')
+        parser.add_argument('--affinity', type=float, default=0.5, help='Share of a basket from a favourite category.')
+        parser.add_argument('--chunk-size', type=int, default=100000, help='People generated per chunk.')
+        parser.add_argument('--overwrite', action='store_true', help='Replace existing CSV files in output_dir.')
+
+    def handle(self, *args, **options):
+        output_dir = options['output_dir']
+        existing = [name for name in ('products.csv', 'purchases.csv') if os.path.exists(os.path.join(output_dir, name))]
+        if existing and not options['overwrite']:
+            raise CommandError(f"{output_dir} already has {', '.join(existing)}; pass --overwrite to replace them")
+
+        n_products, n_purchases = write_dataset(
+            output_dir,
+            options['users'],
+            options['products'],
+            seed_dir=str(get_data_dir()),
+            random_seed=options['seed'],
+            basket_min=options['basket_min'],
+            basket_alpha=options['basket_alpha'],
+            popularity_alpha=options['popularity_alpha'],
+            affinity=options['affinity'],
+            chunk_size=options['chunk_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {n_products} products and {n_purchases} purchases by {options['users']} people to {output_dir}"
+        ))
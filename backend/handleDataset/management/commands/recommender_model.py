@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from handleDataset.services.model import (
+    current_generation,
+    fit_model,
+    load_model,
+    model_path,
+    publish_model,
+    read_model_meta,
+    save_model,
+    validate_model,
+)
+from handleDataset.services.engines import get_engine
+from handleDataset.services.snapshot import PURCHASES_FILE, source_hash
+from handleDataset.services.data_processing import load_purchases
+
+
+class Command(BaseCommand):
+    help = 'Build, inspect or validate the persisted item-similarity model.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['build', 'inspect', 'validate'])
+        parser.add_argument(
+            '--path', default=None,
+            help='Artifact directory. By default build publishes a new generation in RECOMMENDER_MODEL_DIR '
+                 'and inspect/validate read the current one.',
+        )
+        parser.add_argument('--keep', type=int, default=None, help='Generations kept when publishing.')
+
+    def handle(self, *args, **options):
+        self.keep = options['keep']
+        getattr(self, f"handle_{options['action']}")(options['path'])
+
+    def handle_build(self, path):
+        model = fit_model(load_purchases(PURCHASES_FILE), source_hash(), engine=get_engine())
+        if path is None:
+            generation, path = publish_model(model, keep=self.keep)
+            published = f' as generation {generation}'
+        else:
+            save_model(model, path)
+            published = ''
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote model {model.data_version} '
+            f'({len(model.person_ids)} users x {len(model.product_names)} products) to {path}{published}'
+        ))
+
+    def handle_inspect(self, path):
+        generation = current_generation() if path is None else None
+        path = path or model_path()
+        meta = read_model_meta(path)
+        if meta is None:
+            raise CommandError(f'No model artifact in {path}')
+
+        sources = source_hash()
+        self.stdout.write(f"Path:           {path}")
+        if generation is not None:
+            self.stdout.write(f"Generation:     {generation[0]}")
+        self.stdout.write(f"Format version: {meta['format_version']}")
+        self.stdout.write(f"Data version:   {meta['data_version']} "
+                          f"({'current' if meta['data_version'] == sources else f'stale, sources are {sources}'})")
+        if meta.get('engine'):
+            self.stdout.write(f"Engine state:   {meta['engine']['BACKEND']}")
+        for name, shape in meta['shapes'].items():
+            nnz = f"  ({meta['nnz'][name]} non-zero)" if name in meta['nnz'] else ''
+            self.stdout.write(f"  {name:<16} {' x '.join(map(str, shape))}{nnz}")
+
+    def handle_validate(self, path):
+        path = path or model_path()
+        try:
+            model = load_model(path)
+        except (FileNotFoundError, ValueError) as e:
+            raise CommandError(str(e))
+
+        problems = validate_model(model)
+        if model.data_version != source_hash():
+            problems.append(f'data version {model.data_version} does not match the current sources')
+        if problems:
+            raise CommandError('Model is invalid:\n  ' + '\n  '.join(problems))
+        self.stdout.write(self.style.SUCCESS(f'Model {model.data_version} is valid'))
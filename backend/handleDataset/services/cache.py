@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .data_processing import get_recommendations_for_person
+from .singleflight import SingleFlight
+
+# Result cache in front of get_recommendations_for_person.
+#
+# Keys carry the snapshot version, the model generation and the revision of
+# the person's last ingested purchase, so new source data, a newly published
+# model or a new purchase by that person simply stops matching old entries;
+# nothing has to be purged. Purchases by
+# other people can still shift neighbour weights slightly, which entries
+# pick up once their TTL runs out. Concurrent misses for the same key share a
+# single computation.
+
+
+@dataclass(frozen=True)
+class CachedRecommendations:
+    records: list  # shared between callers, do not modify
+    etag: str
+
+
+class RecommendationCache:
+    """Bounded in-process LRU with a TTL, optionally backed by a Django cache
+    shared between processes."""
+
+    def __init__(self, max_entries=10000, ttl=300, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        value = self.backend.get(key) if self.backend is not None else None
+        if value is not None:
+            self._store(key, value)
+        return value
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value, self.ttl)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# The process-wide cache, configured from settings on first use
+def get_cache():
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                alias = getattr(settings, 'RECOMMENDER_CACHE_ALIAS', None)
+                _cache = RecommendationCache(
+                    max_entries=getattr(settings, 'RECOMMENDER_CACHE_SIZE', 10000),
+                    ttl=getattr(settings, 'RECOMMENDER_CACHE_TTL', 300),
+                    backend=caches[alias] if alias else None,
+                )
+    return _cache
+
+
+# Drop the process-wide cache so the next call rebuilds it from settings
+def reset_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def recommendation_key(snapshot, person_id, top_n):
+    user_revision = snapshot.user_revisions.get(person_id, 0)
+    return f'recommendations:{snapshot.version}:{snapshot.model_generation}:{user_revision}:{person_id}:{top_n}'
+
+
+# Strong validator for a list of recommendation records computed with the
+# given model generation
+def records_etag(records, model_generation=0):
+    payload = json.dumps(records, sort_keys=True, separators=(',', ':'), default=str)
+    return f'{model_generation}-' + hashlib.sha1(payload.encode('utf-8')).hexdigest()[:20]
+
+
+_flights = SingleFlight()
+
+
+def _load(key, person_id, top_n, snapshot):
+    cache = get_cache()
+    result = cache.get(key)
+    if result is None:
+        records = get_recommendations_for_person(person_id, top_n=top_n, snapshot=snapshot)
+        result = CachedRecommendations(records=records, etag=records_etag(records, snapshot.model_generation))
+        cache.set(key, result)
+    return result
+
+
+# get_recommendations_for_person through the cache, with an ETag for the result
+def get_cached_recommendations(person_id, top_n=10, snapshot=None):
+    if snapshot is None:
+        from .snapshot import get_snapshot
+        snapshot = get_snapshot()
+
+    key = recommendation_key(snapshot, person_id, top_n)
+    return _flights.do(key, lambda: _load(key, person_id, top_n, snapshot))
+
+
+# get_cached_recommendations for async views, computing off the event loop
+async def aget_cached_recommendations(person_id, top_n=10, snapshot=None):
+    if snapshot is None:
+        from .snapshot import get_snapshot
+        snapshot = await asyncio.to_thread(get_snapshot)
+
+    key = recommendation_key(snapshot, person_id, top_n)
+    return await _flights.ado(key, lambda: _load(key, person_id, top_n, snapshot))
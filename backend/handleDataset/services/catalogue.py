@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class Catalogue:
+    """Column arrays of the products frame, indexed by dense ProductId.
+
+    ProductId is the row position in products_df, so id order is catalogue
+    order. Product names are also encoded as name codes (one per distinct
+    name), which is what set membership by name compares on: a name set
+    becomes a boolean table over name codes and name_codes maps it onto ids.
+    """
+    product_names: np.ndarray  # ProductId -> ProductName
+    names: pd.Index  # name code -> ProductName, unique
+    name_codes: np.ndarray  # ProductId -> name code
+    categories: pd.Index
+    category_codes: np.ndarray  # -1 where Category is missing
+    subcategories: pd.Index  # sorted
+    subcategory_codes: np.ndarray  # -1 where Subcategory is missing
+    price: np.ndarray
+    healthy_index: np.ndarray
+    discount: np.ndarray
+    basic_needs_index: np.ndarray
+    image_urls: np.ndarray  # imageUrl of the recommendation records
+
+    def __len__(self):
+        return len(self.product_names)
+
+    # Name codes of names, -1 for names not in the catalogue
+    def name_codes_of(self, names):
+        return self.names.get_indexer(list(names))
+
+    # ProductId mask of the products whose name code is in codes
+    def mask_of_codes(self, codes):
+        # The extra last slot stays False and absorbs -1 codes
+        flags = np.zeros(len(self.names) + 1, dtype=bool)
+        flags[np.asarray(codes, dtype=np.intp)] = True
+        flags[-1] = False
+        return flags[self.name_codes]
+
+    # ProductId mask of the products named in names
+    def mask_of_names(self, names):
+        return self.mask_of_codes(self.name_codes_of(names))
+
+    # Category codes of category names, missing names dropped
+    def category_codes_of(self, names):
+        codes = self.categories.get_indexer(list(names))
+        return codes[codes >= 0]
+
+
+# Encode a products frame as returned by load_products (Category and
+# Subcategory already categorical)
+def build_catalogue(products_df):
+    product_names = products_df['ProductName'].to_numpy(dtype=object)
+    name_codes, names = pd.factorize(products_df['ProductName'])
+    subcategories = products_df['Subcategory'] if 'Subcategory' in products_df else None
+
+    return Catalogue(
+        product_names=product_names,
+        names=pd.Index(names),
+        name_codes=name_codes,
+        categories=products_df['Category'].cat.categories,
+        category_codes=products_df['Category'].cat.codes.to_numpy(),
+        subcategories=subcategories.cat.categories if subcategories is not None else pd.Index([]),
+        subcategory_codes=(
+            subcategories.cat.codes.to_numpy() if subcategories is not None else np.full(len(products_df), -1)
+        ),
+        price=products_df['Price'].to_numpy(),
+        healthy_index=products_df['HealthyIndex'].to_numpy(),
+        discount=products_df['Discount'].to_numpy(),
+        basic_needs_index=products_df['BasicNeedsIndex'].to_numpy(),
+        image_urls=np.array(
+            [f"/{name.replace(',', '').replace('/', '')}.png" for name in product_names], dtype=object
+        ),
+    )
@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+# Columnar store for cleaned tables: one .npy file per column plus a JSON
+# manifest, so loaders can memory-map numeric columns and read only the
+# columns they need. Strings are stored as fixed-width unicode arrays with a
+# missing-value mask, categoricals as codes plus categories. The manifest
+# records the (mtime, size) of the CSV a table was converted from, and a
+# table is only used while that CSV is unchanged.
+
+# Bump whenever the on-disk layout or the meaning of an array changes
+FORMAT_VERSION = 1
+
+META_FILE = 'meta.json'
+
+
+def file_stat(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+# Write df as a columnar table in directory, recording source_stat (the
+# file_stat of its CSV, taken before the CSV was read)
+def write_table(df, directory, source_stat):
+    directory = str(directory)
+    tmp_path = f'{directory}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    def save(name, array):
+        np.save(os.path.join(tmp_path, f'{name}.npy'), np.asarray(array), allow_pickle=False)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        series = df[name]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories
+            save(f'{i}.codes', series.cat.codes.to_numpy())
+            save(f'{i}.categories', categories.to_numpy() if is_numeric_dtype(categories.dtype) else categories.to_numpy(dtype=str))
+            kind = 'category'
+        elif is_numeric_dtype(series.dtype):
+            save(str(i), series.to_numpy())
+            kind = 'numeric'
+        else:
+            missing = series.isna().to_numpy()
+            save(str(i), series.astype(object).where(~missing, '').to_numpy(dtype=str))
+            save(f'{i}.missing', missing)
+            kind = 'string'
+        columns.append({'name': name, 'kind': kind})
+
+    index = None
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        save('index', df.index.to_numpy())
+        index = 'index'
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'rows': len(df),
+        'columns': columns,
+        'index': index,
+        'source': source_stat,
+    }
+    with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    # Swap the finished directory into place
+    old_path = f'{directory}.old-{os.getpid()}'
+    if os.path.exists(directory):
+        os.rename(directory, old_path)
+    os.rename(tmp_path, directory)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return directory
+
+
+# Table manifest, or None when there is no table in directory
+def read_meta(directory):
+    meta_path = os.path.join(str(directory), META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+# Whether directory holds a table converted from the current source_path
+def is_current(directory, source_path):
+    meta = read_meta(directory)
+    return (
+        meta is not None
+        and meta.get('format_version') == FORMAT_VERSION
+        and meta.get('source') == file_stat(source_path)
+    )
+
+
+# Read a table, only materializing the listed columns (all by default).
+# Numeric columns and categorical codes stay memory mapped when mmap is set.
+def read_table(directory, columns=None, mmap=True):
+    directory = str(directory)
+    meta = read_meta(directory)
+    if meta is None:
+        raise FileNotFoundError(f'No columnar table in {directory}')
+
+    # Plain ndarray views of the memory maps, so results behave like any other frame
+    def load(name):
+        return np.asarray(
+            np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None, allow_pickle=False)
+        )
+
+    stored = {column['name']: (i, column['kind']) for i, column in enumerate(meta['columns'])}
+    if columns is None:
+        columns = list(stored)
+    missing = [name for name in columns if name not in stored]
+    if missing:
+        raise KeyError(f'Columns not in {directory}: {missing}')
+
+    index = pd.Index(load(meta['index'])) if meta['index'] else None
+    data = {}
+    for name in columns:
+        i, kind = stored[name]
+        if kind == 'category':
+            data[name] = pd.Categorical.from_codes(load(f'{i}.codes'), categories=pd.Index(load(f'{i}.categories')))
+        elif kind == 'numeric':
+            data[name] = load(str(i))
+        else:
+            data[name] = pd.Series(load(str(i)), index=index).where(~load(f'{i}.missing'))
+    return pd.DataFrame(data, index=index, copy=False)
@@ -1,15 +1,52 @@
+import logging
 import os
+from dataclasses import dataclass
+
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from django.conf import settings
-from sklearn.metrics.pairwise import cosine_similarity
 import random
 
+from . import columnar, metrics, scoring
+from .neighbours import build_item_neighbours, build_user_neighbours
+from .pools import NameSet
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the source CSV files
+def get_data_dir():
+    return getattr(
+        settings, 'RECOMMENDER_DATA_DIR',
+        os.path.join(settings.BASE_DIR, 'handleDataset', 'data')
+    )
+
+# Directory holding the columnar copies of the source files
+def get_columnar_dir():
+    return getattr(settings, 'RECOMMENDER_COLUMNAR_DIR', os.path.join(get_data_dir(), 'columnar'))
+
+# Columnar table converted from a source file
+def columnar_path(filename):
+    return os.path.join(get_columnar_dir(), os.path.splitext(filename)[0])
+
 # Load DataFrame from CSV
-def load_dataframe(filename):
-    csv_path = os.path.join(settings.BASE_DIR, 'handleDataset', 'data', filename)
-    df = pd.read_csv(csv_path)
+def load_dataframe(filename, columns=None):
+    csv_path = os.path.join(get_data_dir(), filename)
+    df = pd.read_csv(csv_path, usecols=columns)
     return df
 
+# Cleaned table from the columnar store, or None unless it was converted
+# from the current version of the source file
+def load_columnar(filename, columns=None):
+    path = columnar_path(filename)
+    if columnar.is_current(path, os.path.join(get_data_dir(), filename)):
+        return columnar.read_table(path, columns)
+    if columnar.read_meta(path) is not None:
+        logger.warning(
+            'Columnar copy of %s is stale; reading the CSV. Run `manage.py convert_data` to refresh it.', filename
+        )
+    return None
+
 # Process DataFrame
 def process_data(df):
     if 'Price' in df.columns:
@@ -19,8 +56,13 @@ def process_data(df):
         df = df.dropna(subset=['Category'])
     return df
 
-# Load Products
-def load_products(filename='products.csv'):
+# Load Products, from the columnar store when it is current. columns
+# limits the result to those columns.
+def load_products(filename='products.csv', columns=None, use_columnar=True):
+    products_df = load_columnar(filename, columns) if use_columnar else None
+    if products_df is not None:
+        return products_df
+
     products_df = load_dataframe(filename)
     products_df = process_data(products_df)
     if 'ProductName' not in products_df.columns:
@@ -29,57 +71,153 @@ def load_products(filename='products.csv'):
         products_df['Discount'] = 0
     if 'BasicNeedsIndex' not in products_df.columns:
         products_df['BasicNeedsIndex'] = -1
-    return products_df
-
-# Load Purchases
-def load_purchases(filename='purchases.csv'):
-    purchases_df = load_dataframe(filename)
+    # Integer category codes for the vectorized scoring rules
+    products_df['Category'] = products_df['Category'].astype('category')
+    if 'Subcategory' in products_df.columns:
+        products_df['Subcategory'] = products_df['Subcategory'].astype('category')
+    return products_df if columns is None else products_df[columns]
+
+# Load Purchases, from the columnar store when it is current. columns
+# limits the result to those columns.
+def load_purchases(filename='purchases.csv', columns=None, use_columnar=True):
+    purchases_df = load_columnar(filename, columns) if use_columnar else None
+    if purchases_df is not None:
+        return purchases_df
+
+    purchases_df = load_dataframe(filename, columns)
     if 'Amount' in purchases_df.columns:
         purchases_df['Amount'] = pd.to_numeric(purchases_df['Amount'], errors='coerce').fillna(0)
     return purchases_df
 
-# Create User-Item Matrix
-def create_user_item_matrix(purchases_df):
-    user_item_matrix = purchases_df.pivot_table(
-        index='PersonID',
-        columns='ProductName',
-        values='Amount',
-        fill_value=0
-    )
-    return user_item_matrix
+# Sparse PersonID x ProductName matrix with integer-encoded axes
+@dataclass(frozen=True)
+class UserItemMatrix:
+    matrix: sp.csr_matrix
+    person_ids: np.ndarray  # sorted, row i belongs to person_ids[i]
+    product_names: np.ndarray  # sorted, column j belongs to product_names[j]
 
-# Compute Item Similarity
-def compute_item_similarity(user_item_matrix):
-    item_similarity = pd.DataFrame(
-        cosine_similarity(user_item_matrix.T),
-        index=user_item_matrix.columns,
-        columns=user_item_matrix.columns
-    )
-    return item_similarity
+    @property
+    def shape(self):
+        return self.matrix.shape
 
-# Recommend Products for User
-def recommend_products_for_user(person_id, user_item_matrix, item_similarity, top_n=20):
-    if person_id not in user_item_matrix.index:
-        return []
+    def user_position(self, person_id):
+        pos = np.searchsorted(self.person_ids, person_id)
+        if pos < len(self.person_ids) and self.person_ids[pos] == person_id:
+            return int(pos)
+        return -1
+
+    def user_positions(self, person_ids):
+        person_ids = np.asarray(person_ids, dtype=np.int64)
+        if len(self.person_ids) == 0:
+            return np.full(len(person_ids), -1)
+        pos = np.searchsorted(self.person_ids, person_ids).clip(max=len(self.person_ids) - 1)
+        return np.where(self.person_ids[pos] == person_ids, pos, -1)
 
-    user_row = user_item_matrix.loc[person_id]
-    purchased = user_row[user_row > 0].index.tolist()
+    def __contains__(self, person_id):
+        return self.user_position(person_id) >= 0
 
-    if not purchased:
-        # Recommend based on most popular items or randomly selected products
-        return item_similarity.sum().sort_values(ascending=False).head(top_n).index.tolist()
 
-    scores = pd.Series(dtype=float)
-    for product in purchased:
-        similar_items = item_similarity[product].drop(product, errors='ignore')
-        scores = scores.add(similar_items * user_row[product], fill_value=0)
+# Create User-Item Matrix
+def create_user_item_matrix(purchases_df):
+    # Same semantics as pivot_table(aggfunc='mean', fill_value=0), without the dense frame
+    person_codes, person_ids = pd.factorize(purchases_df['PersonID'], sort=True)
+    product_codes, product_names = pd.factorize(purchases_df['ProductName'], sort=True)
+    amounts = pd.Series(purchases_df['Amount'].to_numpy(dtype=np.float64))
+
+    cells = amounts.groupby([person_codes, product_codes]).mean()
+    rows = cells.index.get_level_values(0).to_numpy()
+    cols = cells.index.get_level_values(1).to_numpy()
+
+    matrix = sp.csr_matrix(
+        (cells.to_numpy(), (rows, cols)),
+        shape=(len(person_ids), len(product_names))
+    )
+    matrix.eliminate_zeros()
+    return UserItemMatrix(
+        matrix=matrix,
+        person_ids=np.asarray(person_ids, dtype=np.int64),
+        product_names=np.asarray(product_names, dtype=str),
+    )
 
-    # Add all products not yet purchased to the scoring pool
-    missing_products = item_similarity.index.difference(purchased)
-    scores = scores.reindex(scores.index.union(missing_products), fill_value=0)
+# Compute Item Similarity
+def compute_item_similarity(user_item_matrix, top_m=100):
+    # Top-M neighbours per product (no self-similarity), axes follow user_item_matrix.product_names
+    return build_item_neighbours(user_item_matrix.matrix, m=top_m)
+
+# Indices of the top_n largest scores, ties broken by lower index (name order).
+# argpartition keeps this linear in the number of scored products.
+def top_n_indices(indices, scores, top_n):
+    if len(indices) > top_n:
+        kth = np.argpartition(-scores, top_n - 1)[top_n - 1]
+        keep = scores >= scores[kth]
+        indices, scores = indices[keep], scores[keep]
+    order = np.lexsort((indices, -scores))[:top_n]
+    return indices[order]
+
+# Pick top_n product indices from one row of sparse scores. Every product
+# not yet purchased is in the scoring pool, so the list is padded with
+# zero-score products in name order.
+def _select_top_products(row_indices, row_scores, purchased, n_products, top_n):
+    selected = top_n_indices(row_indices, row_scores, top_n)
+    if len(selected) < top_n:
+        limit = min(n_products, top_n + len(purchased) + len(row_indices))
+        padding = np.setdiff1d(np.arange(limit), np.concatenate([purchased, row_indices]))
+        selected = np.concatenate([selected, padding[:top_n - len(selected)]])
+    return selected
+
+# Model columns ordered by summed item-neighbour weight, the fallback for
+# users whose rows are empty
+def popular_columns(item_neighbours):
+    popularity = np.asarray(item_neighbours.sum(axis=0)).ravel()
+    return np.argsort(-popularity, kind='stable')
+
+# Model column indices of the recommended products for many users at once.
+# Unknown users get an empty array. popular is popular_columns(item_neighbours)
+# when the caller has it precomputed.
+def recommend_product_columns_for_users(person_ids, user_item_matrix, item_neighbours, top_n=20, popular=None):
+    positions = user_item_matrix.user_positions(person_ids)
+    known = positions >= 0
+    n_products = len(user_item_matrix.product_names)
+
+    # One sparse (users x products) x (products x products) product for the whole batch
+    rows = user_item_matrix.matrix[positions[known]]
+    weights = rows.multiply(rows > 0).tocsr()
+    scores = (weights @ item_neighbours).tocsr()
+    scores = (scores - scores.multiply(weights > 0)).tocsr()  # exclude already purchased
+    scores.eliminate_zeros()
+
+    results = []
+    row = 0
+    for is_known in known:
+        if not is_known:
+            results.append(np.empty(0, dtype=np.intp))
+            continue
+
+        purchased = weights.indices[weights.indptr[row]:weights.indptr[row + 1]]
+        if len(purchased) == 0:
+            # Recommend based on most popular items or randomly selected products
+            if popular is None:
+                popular = popular_columns(item_neighbours)
+            results.append(popular[:top_n])
+        else:
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            results.append(_select_top_products(
+                scores.indices[start:end], scores.data[start:end], purchased, n_products, top_n
+            ))
+        row += 1
+    return results
+
+# Recommend Products for many Users at once
+def recommend_products_for_users(person_ids, user_item_matrix, item_neighbours, top_n=20):
+    product_names = user_item_matrix.product_names
+    return [
+        product_names[columns].tolist()
+        for columns in recommend_product_columns_for_users(person_ids, user_item_matrix, item_neighbours, top_n)
+    ]
 
-    scores = scores.drop(purchased, errors='ignore')  # Exclude already purchased products
-    return scores.nlargest(top_n).index.tolist()
+# Recommend Products for User
+def recommend_products_for_user(person_id, user_item_matrix, item_neighbours, top_n=20):
+    return recommend_products_for_users([person_id], user_item_matrix, item_neighbours, top_n=top_n)[0]
 
 
 # Get User Preferences
@@ -96,289 +234,389 @@ def get_user_preferences(person_id, purchases_df, products_df):
     else:
         user_avg_healthy = user_data['HealthyIndex'].mean()
 
-    category_sums = user_data.groupby('Category')['Amount'].sum().sort_values(ascending=False)
+    category_sums = user_data.groupby('Category', observed=True)['Amount'].sum().sort_values(ascending=False, kind='stable')
     top_categories = category_sums.index[:2].tolist() if not category_sums.empty else []
     purchased_categories = category_sums.index.tolist()
 
     return user_avg_healthy, top_categories, purchased_categories
 
+# Products left out unless the person has bought them before
+SPECIAL_ITEMS = ['Scutece', 'Absorbante']
+
+# Mask of the ids kept by the subcategory limit: only the first limit
+# products of subcategory ("Lapte") in ids pass, and products without a
+# subcategory are left out like groupby('Subcategory') leaves them out,
+# unless keep_missing
+def within_subcategory_limit(catalogue, ids, subcategory='Lapte', limit=1, keep_missing=False):
+    codes = catalogue.subcategory_codes[ids]
+    limited_code = catalogue.subcategories.get_indexer([subcategory])[0]
+    is_limited = (codes == limited_code) & (limited_code >= 0)
+    return ((codes >= 0) | keep_missing) & (~is_limited | (np.cumsum(is_limited) <= limit))
+
 # Determine User Type
 def determine_user_type(user_avg_healthy):
     return 'healthy' if user_avg_healthy >= 5 else 'unhealthy'
 
-# Refine Main Recommendations
+# Rows of frame whose category is one of names, compared on integer codes
+def category_mask(frame, names):
+    codes, categories = scoring.category_codes(frame)
+    return np.isin(codes, categories.get_indexer(list(names)))
+
+# Refine Main Recommendations: ProductIds of candidates, best first
 def refine_recommendations(
-    recommended_products, products_df, user_avg_healthy, 
+    candidates, catalogue, user_avg_healthy,
     top_categories, purchased_categories, user_type, top_n=5, category_boost=5
 ):
-    recommended_details = products_df[products_df['ProductName'].isin(recommended_products)].copy()
-
-    # Dynamic scoring weights
-    category_weight = category_boost  # Boost for previously purchased categories
-    complementary_weight = 3  # Boost for complementary categories
-    novelty_weight = 1  # Small weight for introducing new categories
-    discount_weight = 2
-
-    recommended_details['Score'] = 0
-
-    # Boost scores for purchased and complementary categories
-    recommended_details['Score'] += recommended_details['Category'].apply(
-        lambda c: category_weight if c in purchased_categories else 
-                  complementary_weight if c in top_categories else novelty_weight
+    healthy_index = catalogue.healthy_index[candidates]
+    healthy = user_type == 'healthy'
+
+    # Purchased categories get category_boost, top categories 3, new categories 1,
+    # plus health preference and a small discount weight
+    score = scoring.refine_scores(
+        np.zeros(len(candidates), dtype=np.intp),
+        catalogue.category_codes[candidates],
+        healthy_index,
+        catalogue.discount[candidates],
+        purchased_flags=scoring.category_flags(catalogue.categories, [purchased_categories]),
+        top_flags=scoring.category_flags(catalogue.categories, [top_categories]),
+        healthy_users=np.array([healthy]),
+        category_weight=category_boost,
     )
 
-    # Adjust for health preferences
-    if user_type == 'healthy':
-        recommended_details['Score'] += recommended_details['HealthyIndex']
-    else:
-        recommended_details['Score'] += (10 - recommended_details['HealthyIndex'])
-
-    # Include discounts for extra weight
-    recommended_details['Score'] += recommended_details['Discount'].apply(
-        lambda d: discount_weight * (d / 100)
-    )
-
-    # Sort by score and return top recommendations
-    recommended_details = recommended_details.sort_values(
-        by=['Score', 'HealthyIndex'], 
-        ascending=[False, user_type == 'unhealthy']
-    )
-    return recommended_details['ProductName'].head(top_n).tolist()
+    # Sort by score, then by HealthyIndex in the user's preferred direction
+    order = np.lexsort((-healthy_index if healthy else healthy_index, -score))
+    return candidates[order[:top_n]]
 
 
 # Recommend Discounted Items
-def recommend_discounted_items(person_id, purchases_df, products_df, top_categories, purchased_categories, user_type, top_n=5):
-    user_purchases = purchases_df[purchases_df['PersonID'] == person_id]
-    purchased_items = user_purchases['ProductName'].unique().tolist()
+def recommend_discounted_items(
+    person_id, purchases_df, products_df, top_categories, purchased_categories, user_type, top_n=5,
+    purchased_items=None
+):
+    if purchased_items is None:
+        purchased_items = purchases_df.loc[purchases_df['PersonID'] == person_id, 'ProductName'].unique()
 
-    candidate_products = products_df[
-        (products_df['Category'].isin(top_categories)) &
-        (~products_df['ProductName'].isin(purchased_items)) &
-        (products_df['Discount'] > 0)
-    ].copy()
+    available = (~products_df['ProductName'].isin(purchased_items)).to_numpy() & (products_df['Discount'] > 0).to_numpy()
+    in_top = available & category_mask(products_df, top_categories)
+    candidate_products = products_df[in_top]
 
     if len(candidate_products) < top_n:
-        additional_candidates = products_df[
-            (products_df['Category'].isin(purchased_categories)) &
-            (~products_df['ProductName'].isin(purchased_items)) &
-            (products_df['Discount'] > 0)
-        ].copy()
-        candidate_products = pd.concat([candidate_products, additional_candidates]).drop_duplicates()
-
-    if user_type == 'healthy':
-        candidate_products['Score'] = candidate_products['BasicNeedsIndex'].apply(lambda b: 5 if b == 10 else 0)
-    else:
-        candidate_products['Score'] = candidate_products['BasicNeedsIndex'].apply(lambda b: 5 if b == -1 else 0)
-
-    candidate_products['Score'] += candidate_products['Discount'].apply(lambda d: min(4, d // 10))
+        additional = available & category_mask(products_df, purchased_categories) & ~in_top
+        candidate_products = pd.concat([candidate_products, products_df[additional]])
 
-    if user_type == 'healthy':
-        candidate_products = candidate_products.sort_values(by=['Score', 'HealthyIndex'], ascending=[False, False])
+    healthy = user_type == 'healthy'
+    healthy_index = candidate_products['HealthyIndex'].to_numpy()
+    score = scoring.discount_scores(
+        candidate_products['BasicNeedsIndex'].to_numpy(), candidate_products['Discount'].to_numpy(), healthy
+    )
+    order = np.lexsort((-healthy_index if healthy else healthy_index, -score))
+    return candidate_products['ProductName'].to_numpy()[order[:top_n]].tolist()
+
+# Recommend BasicNeeds Items: ProductIds from the basic-needs pool whose
+# names are neither taken nor purchased (both NameSets)
+def recommend_basicneeds_items(catalogue, pools, taken, purchased, top_categories, purchased_categories, top_n=3):
+    def usable(ids):
+        return purchased.free(taken.free(ids, catalogue.name_codes), catalogue.name_codes)
+
+    wanted = catalogue.category_codes_of(list(top_categories) + list(purchased_categories))
+    candidates = usable(pools.basic_needs_in(wanted))
+
+    if len(candidates) < top_n:
+        others = pools.basic_needs[~np.isin(catalogue.category_codes[pools.basic_needs], wanted)]
+        candidates = np.concatenate([candidates, usable(others)])
+
+    score = scoring.tiered_category_score(
+        np.zeros(len(candidates), dtype=np.intp),
+        catalogue.category_codes[candidates],
+        scoring.category_flags(catalogue.categories, [top_categories]),
+        scoring.category_flags(catalogue.categories, [purchased_categories]),
+        5, 2, 0
+    )
+    order = np.lexsort((catalogue.price[candidates], -score))
+    return candidates[order[:top_n]]
+
+# Weighted sum of each user's top-K neighbours' purchases, one sparse row per
+# position. Only the neighbours' rows of the user-item matrix are touched.
+def user_neighbour_scores(positions, user_item_matrix, user_neighbours=None):
+    positions = np.asarray(positions, dtype=np.int64)
+    known = np.flatnonzero(positions >= 0)
+    if user_neighbours is not None:
+        neighbours = user_neighbours[positions[known]]
     else:
-        candidate_products = candidate_products.sort_values(by=['Score', 'HealthyIndex'], ascending=[False, True])
-
-    return candidate_products['ProductName'].head(top_n).tolist()
-
-# Recommend BasicNeeds Items
-def recommend_basicneeds_items(person_id, purchases_df, products_df, top_categories, purchased_categories, top_n=3):
-    user_purchases = purchases_df[purchases_df['PersonID'] == person_id]
-    purchased_items = user_purchases['ProductName'].unique().tolist()
-
-    candidate_products = products_df[
-        (products_df['BasicNeedsIndex'] == 10) &
-        (~products_df['ProductName'].isin(purchased_items)) &
-        (products_df['Category'].isin(top_categories + purchased_categories))
-    ].copy()
-
-    if len(candidate_products) < top_n:
-        additional_candidates = products_df[
-            (products_df['BasicNeedsIndex'] == 10) &
-            (~products_df['ProductName'].isin(purchased_items))
-        ].copy()
-        candidate_products = pd.concat([candidate_products, additional_candidates]).drop_duplicates()
-
-    candidate_products['Score'] = candidate_products['Category'].apply(
-        lambda c: 5 if c in top_categories else 2 if c in purchased_categories else 0
+        neighbours = build_user_neighbours(user_item_matrix.matrix, rows=positions[known])
+    # People missing from the model (position -1) get empty rows
+    if len(known) < len(positions):
+        neighbours = sp.csr_matrix(
+            (np.ones(len(known), dtype=neighbours.dtype), (known, np.arange(len(known)))),
+            shape=(len(positions), len(known))
+        ) @ neighbours
+
+    used = np.unique(neighbours.indices)
+    rows = user_item_matrix.matrix[used]
+    rows = rows.multiply(rows > 0).tocsr()
+    compact = sp.csr_matrix(
+        (neighbours.data, np.searchsorted(used, neighbours.indices), neighbours.indptr),
+        shape=(len(positions), len(used))
     )
-    candidate_products = candidate_products.sort_values(by=['Score', 'Price'], ascending=[False, True])
-
-    return candidate_products['ProductName'].head(top_n).tolist()
+    return (compact @ rows).tocsr()
 
-# Recommend Based on Profile Similarity
+# Recommend Based on Profile Similarity: ProductIds whose names are not
+# taken (a NameSet). model_product_codes maps model columns to catalogue
+# name codes.
 def recommend_similarity_products(
-    person_id, user_item_matrix, products_df, all_recommended, top_n=5, diversity_boost=2
+    person_id, user_item_matrix, catalogue, pools, taken, model_product_codes, top_n=5, diversity_boost=2,
+    user_neighbours=None, neighbour_scores=None
 ):
-    if person_id not in user_item_matrix.index:
-        return []
-
-    user_similarity = cosine_similarity(user_item_matrix)
-    similarity_df = pd.DataFrame(
-        user_similarity, 
-        index=user_item_matrix.index, 
-        columns=user_item_matrix.index
+    if person_id not in user_item_matrix:
+        return np.empty(0, dtype=np.intp)
+
+    # Scores from the top-K similar users, unless the caller batched them already
+    if neighbour_scores is None:
+        pos = user_item_matrix.user_position(person_id)
+        neighbour_scores = user_neighbour_scores([pos], user_item_matrix, user_neighbours)[0]
+
+    # Scores per name code (model columns have distinct names), products missing from the catalogue dropped
+    codes = model_product_codes[neighbour_scores.indices]
+    in_catalogue = codes >= 0
+    order = np.argsort(codes[in_catalogue])
+    scored_codes, scores = codes[in_catalogue][order], neighbour_scores.data[in_catalogue][order]
+    candidates = taken.free(pools.ids_of_codes(scored_codes), catalogue.name_codes)
+
+    # Ensure diverse category representation: category counts of the untaken
+    # products, each category placed where its first untaken product is
+    taken_categories = catalogue.category_codes[pools.ids_of_codes(taken.codes())]
+    counts = pools.category_counts - np.bincount(
+        taken_categories[taken_categories >= 0], minlength=len(pools.category_counts)
     )
-    similar_users = similarity_df[person_id].drop(person_id).sort_values(ascending=False).index.tolist()
-
-    candidate_scores = pd.Series(dtype=float)
-    for similar_user in similar_users:
-        similar_purchases = user_item_matrix.loc[similar_user]
-        not_purchased = similar_purchases[
-            (similar_purchases > 0) & 
-            (~similar_purchases.index.isin(all_recommended))
-        ]
-        candidate_scores = candidate_scores.add(
-            not_purchased * similarity_df.at[person_id, similar_user], 
-            fill_value=0
-        )
-
-    # Normalize scores and ensure diverse category representation
-    candidate_scores = candidate_scores.sort_values(ascending=False)
-    candidate_products = products_df[
-        products_df['ProductName'].isin(candidate_scores.index)
-    ]
-
-    # Define the diversity weight within the function
-    diversity_weight = diversity_boost
-
-    underrepresented_categories = products_df['Category'].value_counts().tail(5).index.tolist()
-    candidate_products['DiversityBoost'] = candidate_products['Category'].apply(
-        lambda c: diversity_weight if c in underrepresented_categories else 0
+    first_ids = pools.category_first.copy()
+    for code in np.flatnonzero((counts > 0) & taken.contains(catalogue.name_codes[first_ids])):
+        first_ids[code] = taken.first_free(pools.category_ids(code), catalogue.name_codes, 1)[0]
+    underrepresented_categories = scoring.least_common_of_counts(counts, first_ids, 5)
+
+    final_score = (
+        np.where(np.isin(catalogue.category_codes[candidates], underrepresented_categories), diversity_boost, 0)
+        + scores[np.searchsorted(scored_codes, catalogue.name_codes[candidates])]
     )
-    candidate_products['FinalScore'] = candidate_products['DiversityBoost'] + candidate_scores.reindex(candidate_products['ProductName'], fill_value=0)
+    order = np.argsort(-final_score, kind='stable')
+    return candidates[order[:top_n]]
 
-    return candidate_products.sort_values('FinalScore', ascending=False).head(top_n)['ProductName'].tolist()
+def get_recommendations_for_person(person_id, top_n=10, snapshot=None):
+    if snapshot is None:
+        from .snapshot import get_snapshot
+        with metrics.stage('snapshot'):
+            snapshot = get_snapshot()
 
-def get_recommendations_for_person(person_id, top_n=10):
-    purchases_df = load_purchases('purchases.csv')
-    products_df = load_products('products.csv')
-
-    user_item_matrix = create_user_item_matrix(purchases_df)
-    item_similarity = compute_item_similarity(user_item_matrix)
+    # No purchase history: a lookup in the popularity tables instead of the pipeline
+    if person_id not in snapshot.user_profiles:
+        metrics.observe('cold_start', 1)
+        return snapshot.popularity.recommendations(top_n)
 
     # Step 1: Main Recommendations
-    initial_recommendations = recommend_products_for_user(person_id, user_item_matrix, item_similarity, top_n=20)
-
-    user_avg_healthy, top_categories, purchased_categories = get_user_preferences(person_id, purchases_df, products_df)
-    user_type = determine_user_type(user_avg_healthy)
-
-    final_recommendations = refine_recommendations(
-        initial_recommendations,
-        products_df,
-        user_avg_healthy,
-        top_categories,
-        purchased_categories,
-        user_type,
-        top_n=top_n
+    with metrics.stage('item_recommendations'):
+        initial_recommendations = snapshot.engine.recommend_columns(
+            snapshot.engine_state, snapshot.user_item_matrix, [person_id], top_n=20
+        )[0]
+    return complete_recommendations(person_id, snapshot, initial_recommendations, top_n=top_n)
+
+# Recommendations for many people, sharing the model-level matrix work.
+# People without a purchase profile are left out of the result, like the
+# cold start of get_recommendations_for_person.
+def get_recommendations_for_people(person_ids, top_n=10, snapshot=None, batch_size=1024):
+    return dict(iter_recommendations_for_people(person_ids, top_n=top_n, snapshot=snapshot, batch_size=batch_size))
+
+# (PersonID, recommendations) pairs in the order of get_recommendations_for_people,
+# computed batch_size people at a time as they are consumed
+def iter_recommendations_for_people(person_ids, top_n=10, snapshot=None, batch_size=1024):
+    if snapshot is None:
+        from .snapshot import get_snapshot
+        snapshot = get_snapshot()
+
+    user_item_matrix = snapshot.user_item_matrix
+    person_ids = [int(p) for p in dict.fromkeys(person_ids) if p in snapshot.user_profiles]
+
+    for start in range(0, len(person_ids), batch_size):
+        batch = person_ids[start:start + batch_size]
+        metrics.observe('batch_people', len(batch))
+
+        with metrics.stage('item_recommendations'):
+            initial_recommendations = snapshot.engine.recommend_columns(
+                snapshot.engine_state, user_item_matrix, batch, top_n=20
+            )
+        with metrics.stage('user_neighbour_scores'):
+            neighbour_scores = user_neighbour_scores(
+                user_item_matrix.user_positions(batch), user_item_matrix, snapshot.user_neighbours
+            )
+
+        candidates = [
+            collect_candidates(
+                person_id,
+                snapshot,
+                initial_recommendations[i],
+                top_n=top_n,
+                neighbour_scores=neighbour_scores[i]
+            )
+            for i, person_id in enumerate(batch)
+        ]
+        # Relevance ranking for the whole batch at once
+        yield from zip(batch, rank_recommendations(candidates, snapshot.catalogue, top_n=top_n))
+
+# Everything after the main item-based step, for one person.
+# initial_recommendations holds model column indices.
+def complete_recommendations(person_id, snapshot, initial_recommendations, top_n=10, neighbour_scores=None):
+    candidates = collect_candidates(
+        person_id, snapshot, initial_recommendations, top_n=top_n, neighbour_scores=neighbour_scores
     )
-    
-    # Step 2: Filter for specific items based on purchase history
-    user_purchases = purchases_df[purchases_df['PersonID'] == person_id]['ProductName'].unique()
-    special_items = ['Scutece', 'Absorbante']
-
-    # Remove "Scutece" and "Absorbante" unless they are in the user's purchase history
-    products_df = products_df[~products_df['ProductName'].isin(special_items) | 
-                              products_df['ProductName'].isin(user_purchases)]
-
-    # Step 3: Split recommendations into healthy and unhealthy groups
-    all_recommended = set(final_recommendations)
-
-    # Unhealthy recommendations
-    unhealthy_candidates = products_df[
-        (products_df['HealthyIndex'] <= 5) &
-        (~products_df['ProductName'].isin(all_recommended))
-    ]
-    unhealthy_recommendations = unhealthy_candidates['ProductName'].head(int(top_n * 0.6)).tolist()
-
-    all_recommended.update(unhealthy_recommendations)
-
-    # Healthy recommendations
-    healthy_candidates = products_df[
-        (products_df['HealthyIndex'] > 5) &
-        (~products_df['ProductName'].isin(all_recommended))
-    ]
-    healthy_recommendations = healthy_candidates['ProductName'].head(int(top_n * 0.4)).tolist()
-
-    all_recommended.update(healthy_recommendations)
+    return rank_recommendations([candidates], snapshot.catalogue, top_n=top_n)[0]
+
+# Candidate ProductIds and preferences for one person, ready for
+# rank_recommendations. Each stage draws from a precomputed candidate pool;
+# "already recommended" is tracked per name code, like the name lists it
+# replaces, so the work per stage follows its pool and the few names
+# excluded so far rather than the catalogue.
+def collect_candidates(person_id, snapshot, initial_recommendations, top_n=10, neighbour_scores=None):
+    catalogue = snapshot.catalogue
+    pools = snapshot.pools
+    name_codes = catalogue.name_codes
+    user_item_matrix = snapshot.user_item_matrix
+
+    # Preferences and purchased products from the precomputed profile store
+    with metrics.stage('preferences'):
+        profile = snapshot.user_profiles[person_id]
+        user_avg_healthy, top_categories, purchased_categories = profile.preferences()
+        user_type = determine_user_type(user_avg_healthy)
+
+    metrics.observe('initial_candidates', len(initial_recommendations))
+    with metrics.stage('refine'):
+        initial_codes = snapshot.model_product_codes[initial_recommendations]
+        final_recommendations = refine_recommendations(
+            pools.ids_of_codes(initial_codes),
+            catalogue,
+            user_avg_healthy,
+            top_categories,
+            purchased_categories,
+            user_type,
+            top_n=top_n
+        )
+    metrics.observe('refined_candidates', len(final_recommendations))
 
-    # Step 4: Add similarity-based and basic needs recommendations
-    similarity_recommendations = recommend_similarity_products(
-        person_id,
-        user_item_matrix,
-        products_df[~products_df['ProductName'].isin(all_recommended)],
-        all_recommended,
-        top_n=5
-    )
-    all_recommended.update(similarity_recommendations)
-
-    basicneeds_recommendations = recommend_basicneeds_items(
-        person_id,
-        purchases_df,
-        products_df[~products_df['ProductName'].isin(all_recommended)],
-        top_categories,
-        purchased_categories,
-        top_n=2
-    )
-    all_recommended.update(basicneeds_recommendations)
+    with metrics.stage('health_split'):
+        # Step 2: Filter for specific items based on purchase history
+        purchased = NameSet(len(catalogue.names))
+        purchased.add(catalogue.name_codes_of(profile.purchased_products))
 
-    # Combine all recommendations
-    combined_recommendations = unhealthy_recommendations + healthy_recommendations + list(all_recommended)
+        # Remove "Scutece" and "Absorbante" unless they are in the user's purchase history
+        blocked = NameSet(len(catalogue.names))
+        blocked.add(pools.special_codes[~purchased.contains(pools.special_codes)])
+        taken = NameSet(len(catalogue.names))
+        taken.add(blocked.codes())
 
-    # Create a DataFrame to manage scores
-    recommendation_scores = products_df[products_df['ProductName'].isin(combined_recommendations)].copy()
+        # Step 3: Split recommendations into healthy and unhealthy groups
+        recommended = [name_codes[final_recommendations]]
+        taken.add(recommended[-1])
 
-    # Enforce subcategory limit
-    subcategory_limit = 1
-    restricted_recommendations = recommendation_scores.groupby('Subcategory').apply(
-        lambda group: group.head(subcategory_limit) if group.name == 'Lapte' else group
-    ).reset_index(drop=True)
+        # Unhealthy recommendations
+        unhealthy_recommendations = taken.first_free(pools.unhealthy, name_codes, int(top_n * 0.6))
 
-    # Replace excess items with alternatives
-    excess_items = recommendation_scores[~recommendation_scores['ProductName'].isin(restricted_recommendations['ProductName'])]
-    alternative_items = excess_items.head(top_n - len(restricted_recommendations))
-    recommendation_scores = pd.concat([restricted_recommendations, alternative_items])
+        recommended.append(name_codes[unhealthy_recommendations])
+        taken.add(recommended[-1])
 
-    # Weighted scoring for relevance
-    recommendation_scores['RelevanceScore'] = 0
+        # Healthy recommendations
+        healthy_recommendations = taken.first_free(pools.healthy, name_codes, int(top_n * 0.4))
 
-    # Boost products from user's top and purchased categories
-    recommendation_scores['RelevanceScore'] += recommendation_scores['Category'].apply(
-        lambda c: 5 if c in top_categories else 3 if c in purchased_categories else 1
-    )
+        recommended.append(name_codes[healthy_recommendations])
+        taken.add(recommended[-1])
 
-    # Adjust for health preferences
-    if user_type == 'healthy':
-        recommendation_scores['RelevanceScore'] += recommendation_scores['HealthyIndex']
-    else:
-        recommendation_scores['RelevanceScore'] += recommendation_scores['HealthyIndex'].apply(
-            lambda h: (10 - h) if h < 5 else h * 0.5
+    # Step 4: Add similarity-based and basic needs recommendations
+    with metrics.stage('user_similarity'):
+        similarity_recommendations = recommend_similarity_products(
+            person_id,
+            user_item_matrix,
+            catalogue,
+            pools,
+            taken,
+            snapshot.model_product_codes,
+            top_n=5,
+            user_neighbours=snapshot.user_neighbours,
+            neighbour_scores=neighbour_scores
         )
+        recommended.append(name_codes[similarity_recommendations])
+        taken.add(recommended[-1])
+
+    with metrics.stage('basic_needs'):
+        basicneeds_recommendations = recommend_basicneeds_items(
+            catalogue,
+            pools,
+            taken,
+            purchased,
+            top_categories,
+            purchased_categories,
+            top_n=2
+        )
+        recommended.append(name_codes[basicneeds_recommendations])
+
+    with metrics.stage('subcategory_limit'):
+        # Combine all recommendations, in catalogue order
+        recommended_codes = np.concatenate(recommended)
+        recommendation_ids = pools.ids_of_codes(recommended_codes[~blocked.contains(recommended_codes)])
+
+        # Enforce subcategory limit: only the first "Lapte" item is kept, groups in subcategory order
+        restricted = within_subcategory_limit(catalogue, recommendation_ids)
+        sort_key = catalogue.subcategory_codes[recommendation_ids[restricted]]
+        restricted_recommendations = recommendation_ids[restricted][np.argsort(sort_key, kind='stable')]
+
+        # Replace excess items with alternatives
+        excess_items = recommendation_ids[~restricted]
+        alternative_items = excess_items[:top_n - len(restricted_recommendations)]
+        recommendation_ids = np.concatenate([restricted_recommendations, alternative_items])
+    metrics.observe('final_candidates', len(recommendation_ids))
+
+    return recommendation_ids, (top_categories, purchased_categories, user_type)
+
+# Relevance-rank many people's candidate sets in one pass and build the
+# top_n records of each. candidates holds (ProductIds, (top_categories,
+# purchased_categories, user_type)) per person, as returned by
+# collect_candidates. Names are only looked up for the selected products.
+def rank_recommendations(candidates, catalogue, top_n=10):
+    if not candidates:
+        return []
 
-    # Boost items with discounts
-    recommendation_scores['RelevanceScore'] += recommendation_scores['Discount'] / 10
-
-    # Finalize recommendation order
-    recommendation_scores = recommendation_scores.sort_values('RelevanceScore', ascending=False)
-    selected_recommendations = recommendation_scores.head(top_n)
-
-    # Enrich recommendations with details, including imageUrl
-    enriched_recommendations = selected_recommendations[['ProductName', 'Price', 'Discount']].copy()
-
-    # Add imageUrl column
-    enriched_recommendations['imageUrl'] = enriched_recommendations['ProductName'].apply(
-        lambda name: f"/{name.replace(',', '').replace('/', '')}.png"
-    )
+    sizes = np.array([len(ids) for ids, _ in candidates])
+    recommendation_ids = np.concatenate([ids for ids, _ in candidates])
+    user_index = np.repeat(np.arange(len(candidates)), sizes)
+    profiles = [profile for _, profile in candidates]
+
+    with metrics.stage('relevance_ranking'):
+        # Weighted scoring for relevance: category tier, health preference, discount
+        relevance = scoring.relevance_scores(
+            user_index,
+            catalogue.category_codes[recommendation_ids],
+            catalogue.healthy_index[recommendation_ids],
+            catalogue.discount[recommendation_ids],
+            top_flags=scoring.category_flags(catalogue.categories, [profile[0] for profile in profiles]),
+            purchased_flags=scoring.category_flags(catalogue.categories, [profile[1] for profile in profiles]),
+            healthy_users=np.array([profile[2] == 'healthy' for profile in profiles]),
+        )
 
-    # Rename columns to match desired keys
-    enriched_recommendations.rename(
-        columns={
-            'ProductName': 'name',
-            'Price': 'price',
-            'Discount': 'discount'
-        },
-        inplace=True
-    )
+        # Finalize recommendation order and keep each person's top_n
+        order = scoring.order_by_user(user_index, [relevance], [True])
+        rank = np.arange(len(order)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        selected = recommendation_ids[order[rank < top_n]]
+
+    with metrics.stage('enrichment'):
+        # Enrich recommendations with details, including imageUrl
+        records = [
+            {'name': name, 'price': price, 'discount': discount, 'imageUrl': image_url}
+            for name, price, discount, image_url in zip(
+                catalogue.product_names[selected].tolist(),
+                catalogue.price[selected].tolist(),
+                catalogue.discount[selected].tolist(),
+                catalogue.image_urls[selected].tolist(),
+            )
+        ]
 
-    return enriched_recommendations.to_dict(orient='records')
+    counts = np.minimum(sizes, top_n)
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    return [records[bounds[i]:bounds[i + 1]] for i in range(len(candidates))]
 
 
 # Example Usage
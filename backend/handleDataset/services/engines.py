@@ -0,0 +1,259 @@
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import scipy.sparse as sp
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .data_processing import popular_columns, recommend_product_columns_for_users, top_n_indices
+
+# Engines behind step 1 of the pipeline (the products a person is likely to
+# buy, before the health, similarity and basic-needs stages), chosen by the
+# RECOMMENDER_ENGINE setting ({'BACKEND': dotted path, 'OPTIONS': kwargs}).
+#
+# An engine is stateless configuration; what it learns from a model lives in
+# the state returned by fit(), which the snapshot carries next to the model.
+
+DEFAULT_ENGINE = {
+    'BACKEND': 'handleDataset.services.engines.CosineEngine',
+    'OPTIONS': {},
+}
+
+
+class RecommendationEngine:
+    """Scores products for people from the shared user-item matrix.
+
+    fit() derives the engine state from a fitted model's user-item matrix and
+    item neighbours; update() refreshes it after purchases were ingested for
+    the given matrix rows; recommend_columns() returns model column indices
+    per person, best first, and an empty array for people not in the matrix.
+
+    An engine whose fit is expensive returns its state as named arrays from
+    state_arrays() and sets stores_state; a published model stores them, and
+    load_state() rebuilds the state from their memory maps instead of
+    fitting again.
+    """
+    uses_item_neighbours = True
+    stores_state = False
+
+    # The RECOMMENDER_ENGINE value this engine was created from
+    def config(self):
+        return {'BACKEND': f'{type(self).__module__}.{type(self).__qualname__}', 'OPTIONS': dict(vars(self))}
+
+    def fit(self, user_item_matrix, item_neighbours):
+        raise NotImplementedError
+
+    def state_arrays(self, state):
+        return None
+
+    def load_state(self, arrays, user_item_matrix, item_neighbours):
+        raise NotImplementedError
+
+    def update(self, state, user_item_matrix, item_neighbours, rows):
+        return self.fit(user_item_matrix, item_neighbours)
+
+    def recommend_columns(self, state, user_item_matrix, person_ids, top_n=20):
+        raise NotImplementedError
+
+
+@dataclass(frozen=True)
+class CosineState:
+    item_neighbours: sp.csr_matrix
+    popular: np.ndarray  # popular_columns(item_neighbours)
+
+
+class CosineEngine(RecommendationEngine):
+    """Purchased amounts times top-M cosine item neighbours."""
+
+    def fit(self, user_item_matrix, item_neighbours):
+        return CosineState(item_neighbours=item_neighbours, popular=popular_columns(item_neighbours))
+
+    def recommend_columns(self, state, user_item_matrix, person_ids, top_n=20):
+        return recommend_product_columns_for_users(
+            person_ids, user_item_matrix, state.item_neighbours, top_n=top_n, popular=state.popular
+        )
+
+
+@dataclass(frozen=True)
+class FactorState:
+    person_ids: np.ndarray  # axes the factors were fitted on, as in UserItemMatrix
+    product_names: np.ndarray
+    user_factors: np.ndarray  # float32, one row per person_ids entry
+    item_factors: np.ndarray  # float32, one row per product_names entry
+    popular: np.ndarray  # columns by number of buyers, for people without purchases
+
+
+# Positive amounts of a user-item matrix as float32 CSR
+def _positive(matrix):
+    weights = matrix.multiply(matrix > 0).tocsr().astype(np.float32)
+    weights.sort_indices()
+    return weights
+
+
+def _rows_with_data(matrix, data):
+    return sp.csr_matrix((data, matrix.indices, matrix.indptr), shape=matrix.shape)
+
+
+# Conjugate-gradient steps on every row's least-squares problem at once:
+# row u solves (F^T F + reg I + F^T W_u F) x_u = F^T (1 + W_u) p_u, where F
+# is fixed (the other side's factors) and W_u = alpha * amounts of row u.
+# Each step is two GEMMs and two sparse products over the whole block.
+def _conjugate_gradient(factors, fixed, weights, gram, steps):
+    rows = np.repeat(np.arange(weights.shape[0]), np.diff(weights.indptr))
+    fixed_rows = fixed[weights.indices]
+
+    def times_a(vectors):
+        dots = np.einsum('ij,ij->i', vectors[rows], fixed_rows)
+        return vectors @ gram + _rows_with_data(weights, weights.data * dots) @ fixed
+
+    residual = _rows_with_data(weights, 1 + weights.data) @ fixed - times_a(factors)
+    direction = residual.copy()
+    norms = np.einsum('ij,ij->i', residual, residual)
+    for _ in range(steps):
+        product = times_a(direction)
+        curvature = np.einsum('ij,ij->i', direction, product)
+        step = np.divide(norms, curvature, out=np.zeros_like(norms), where=curvature > 0)
+        factors = factors + step[:, None] * direction
+        residual = residual - step[:, None] * product
+        new_norms = np.einsum('ij,ij->i', residual, residual)
+        ratio = np.divide(new_norms, norms, out=np.zeros_like(norms), where=norms > 0)
+        direction = residual + ratio[:, None] * direction
+        norms = new_norms
+    return factors
+
+
+class ALSEngine(RecommendationEngine):
+    """Implicit-feedback matrix factorization (Hu, Koren and Volinsky) fitted
+    by alternating least squares on the amount-weighted purchase matrix, with
+    confidence 1 + alpha * amount. Each half-step runs cg_steps conjugate
+    gradient steps for all rows together, block_size rows at a time, so the
+    work is NumPy GEMMs (multithreaded by BLAS) and sparse products.
+    Scoring a person is one dot product with the item factors.
+    """
+    uses_item_neighbours = False
+    stores_state = True
+
+    def __init__(self, factors=16, regularization=10.0, alpha=10.0, iterations=15, cg_steps=3, block_size=8192,
+                 random_state=0):
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.cg_steps = cg_steps
+        self.block_size = block_size
+        self.random_state = random_state
+
+    # Half-step: new factors for rows of weights against fixed
+    def _solve(self, factors, fixed, weights, steps):
+        gram = fixed.T @ fixed + self.regularization * np.eye(self.factors, dtype=np.float32)
+        for start in range(0, weights.shape[0], self.block_size):
+            block = slice(start, start + self.block_size)
+            factors[block] = _conjugate_gradient(factors[block], fixed, weights[block], gram, steps)
+        return factors
+
+    def fit(self, user_item_matrix, item_neighbours):
+        weights = _positive(user_item_matrix.matrix)
+        weights.data *= self.alpha
+        item_weights = weights.T.tocsr()
+
+        rng = np.random.default_rng(self.random_state)
+        n_users, n_products = weights.shape
+        users = (rng.standard_normal((n_users, self.factors)) * 0.01).astype(np.float32)
+        items = (rng.standard_normal((n_products, self.factors)) * 0.01).astype(np.float32)
+        for _ in range(self.iterations):
+            users = self._solve(users, items, weights, self.cg_steps)
+            items = self._solve(items, users, item_weights, self.cg_steps)
+
+        return FactorState(
+            person_ids=user_item_matrix.person_ids,
+            product_names=user_item_matrix.product_names,
+            user_factors=users,
+            item_factors=items,
+            popular=np.argsort(-np.diff(item_weights.indptr), kind='stable'),
+        )
+
+    def state_arrays(self, state):
+        return {'user_factors': state.user_factors, 'item_factors': state.item_factors, 'popular': state.popular}
+
+    def load_state(self, arrays, user_item_matrix, item_neighbours):
+        return FactorState(
+            person_ids=user_item_matrix.person_ids, product_names=user_item_matrix.product_names, **arrays
+        )
+
+    # Carry the factors over to the grown axes, then refit the changed
+    # people's rows and their products' rows against the other side, with
+    # enough conjugate gradient steps to solve them exactly. Everyone else
+    # keeps their factors until the next full fit.
+    def update(self, state, user_item_matrix, item_neighbours, rows):
+        weights = _positive(user_item_matrix.matrix)
+        weights.data *= self.alpha
+        n_users, n_products = weights.shape
+
+        users = np.zeros((n_users, self.factors), dtype=np.float32)
+        users[np.searchsorted(user_item_matrix.person_ids, state.person_ids)] = state.user_factors
+        items = np.zeros((n_products, self.factors), dtype=np.float32)
+        items[np.searchsorted(user_item_matrix.product_names, state.product_names)] = state.item_factors
+
+        rows = np.unique(np.asarray(rows, dtype=np.intp))
+        users[rows] = self._solve(users[rows], items, weights[rows], self.factors)
+        columns = np.unique(weights[rows].indices)
+        items[columns] = self._solve(items[columns], users, weights.T.tocsr()[columns], self.factors)
+
+        return FactorState(
+            person_ids=user_item_matrix.person_ids,
+            product_names=user_item_matrix.product_names,
+            user_factors=users,
+            item_factors=items,
+            popular=np.argsort(-np.diff(weights.tocsc().indptr), kind='stable'),
+        )
+
+    def recommend_columns(self, state, user_item_matrix, person_ids, top_n=20):
+        positions = user_item_matrix.user_positions(person_ids)
+        known = positions[positions >= 0]
+        weights = _positive(user_item_matrix.matrix[known])
+
+        # One GEMM for the batch, purchased products scored out
+        scores = state.user_factors[known] @ state.item_factors.T
+        scores[np.repeat(np.arange(len(known)), np.diff(weights.indptr)), weights.indices] = -np.inf
+
+        results = []
+        row = 0
+        columns = np.arange(scores.shape[1])
+        for position in positions:
+            if position < 0:
+                results.append(np.empty(0, dtype=np.intp))
+                continue
+            if weights.indptr[row] == weights.indptr[row + 1]:
+                results.append(state.popular[:top_n])
+            else:
+                selected = top_n_indices(columns, scores[row], top_n)
+                results.append(selected[np.isfinite(scores[row][selected])])
+            row += 1
+        return results
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+# The process-wide engine, created from settings on first use
+def get_engine():
+    global _engine
+
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(getattr(settings, 'RECOMMENDER_ENGINE', DEFAULT_ENGINE))
+    return _engine
+
+
+def create_engine(config):
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+# Drop the process-wide engine so the next snapshot build recreates it from settings
+def reset_engine():
+    global _engine
+    with _engine_lock:
+        _engine = None
@@ -0,0 +1,225 @@
+from dataclasses import replace
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from .data_processing import UserItemMatrix
+from .model import item_neighbour_limit, user_neighbour_limit
+from .neighbours import build_item_neighbours, build_user_neighbours
+from .popularity import cold_start_size, update_popularity
+from .profiles import build_user_profiles
+from .purchase_index import build_purchase_index, extend_purchase_index
+from .purchase_log import EVENT_COLUMNS, append_to_purchase_log, read_purchase_log
+from .snapshot import get_snapshot, refresh_snapshot, update_snapshot
+
+# Incremental ingestion of new purchases.
+#
+# A batch of (PersonID, ProductName, Amount) events is applied to the current
+# snapshot without refitting: only the buyers' rows of the user-item matrix are
+# recomputed, and only neighbour lists that can contain a changed row or column
+# are rescored. The cosine similarity of two products depends on nothing but
+# their two columns (and likewise for users), so rescoring the changed
+# entries, the entries that list them and the entries they now list keeps
+# every affected weight exact. An untouched product whose list would only now
+# gain a changed product picks it up at the next full fit.
+#
+# Events ingested with persist go through the shared purchase log (see
+# purchase_log), so every worker applies them the same way.
+
+
+# Clean events into a purchases-shaped frame with the dtypes of purchases_df
+def events_frame(events, purchases_df):
+    frame = pd.DataFrame(list(events), columns=EVENT_COLUMNS)
+    frame['PersonID'] = frame['PersonID'].astype(np.int64)
+    frame['ProductName'] = frame['ProductName'].astype(str).str.strip()
+    if (frame['ProductName'] == '').any():
+        raise ValueError('ProductName must not be empty')
+    frame['Amount'] = pd.to_numeric(frame['Amount'], errors='coerce').fillna(0)
+
+    # Keep integer amounts integer so purchase details render the same as after a reload
+    if frame['Amount'].eq(frame['Amount'].round()).all():
+        frame['Amount'] = frame['Amount'].astype(purchases_df['Amount'].dtype)
+    return frame[purchases_df.columns.intersection(EVENT_COLUMNS, sort=False)]
+
+
+# Move the entries of a CSR matrix onto larger axes (old index -> new index maps)
+def _remap(matrix, row_map, col_map, shape):
+    coo = matrix.tocoo()
+    return sp.csr_matrix((coo.data, (row_map[coo.row], col_map[coo.col])), shape=shape)
+
+
+# Copy of matrix with the given sorted rows replaced by the rows of block
+def _replace_rows(matrix, rows, block):
+    coo = matrix.tocoo()
+    keep = ~np.isin(coo.row, rows)
+    block = block.tocoo()
+    return sp.csr_matrix(
+        (
+            np.concatenate([coo.data[keep], block.data]),
+            (np.concatenate([coo.row[keep], rows[block.row]]), np.concatenate([coo.col[keep], block.col])),
+        ),
+        shape=matrix.shape,
+    )
+
+
+# Grow the user and product axes to cover new ids, keeping both sorted
+def _expand_axes(user_item_matrix, item_neighbours, user_neighbours, events):
+    person_ids = np.union1d(user_item_matrix.person_ids, events['PersonID'].to_numpy(dtype=np.int64))
+    product_names = np.union1d(user_item_matrix.product_names, events['ProductName'].to_numpy(dtype=str))
+    if len(person_ids) == len(user_item_matrix.person_ids) and len(product_names) == len(user_item_matrix.product_names):
+        return user_item_matrix, item_neighbours, user_neighbours
+
+    user_map = np.searchsorted(person_ids, user_item_matrix.person_ids)
+    product_map = np.searchsorted(product_names, user_item_matrix.product_names)
+    n_users, n_products = len(person_ids), len(product_names)
+    return (
+        UserItemMatrix(
+            matrix=_remap(user_item_matrix.matrix, user_map, product_map, (n_users, n_products)),
+            person_ids=person_ids,
+            product_names=product_names,
+        ),
+        _remap(item_neighbours, product_map, product_map, (n_products, n_products)),
+        _remap(user_neighbours, user_map, user_map, (n_users, n_users)),
+    )
+
+
+# Recompute the neighbour lists of changed rows, of rows listing them and of
+# the rows they now list, returning the updated neighbour matrix
+def _update_neighbours(neighbours, changed, build):
+    if len(changed) == 0:
+        return neighbours
+
+    changed_block = build(changed)
+    listing = neighbours[:, changed].tocoo().row
+    others = np.setdiff1d(np.union1d(listing, changed_block.indices), changed)
+
+    rows = np.concatenate([changed, others])
+    block = sp.vstack([changed_block, build(others)], format='csr') if len(others) else changed_block
+    order = np.argsort(rows)
+    return _replace_rows(neighbours, rows[order], block[order])
+
+
+# New snapshot with the purchases in events applied to snapshot. revisions
+# holds a label per event for the cache keys of its buyer (by default the
+# new revision number); a person's last event sets theirs.
+def apply_purchases(snapshot, events, revisions=None):
+    if events.empty:
+        return snapshot
+
+    revision = snapshot.revision + 1
+    if revisions is None:
+        revisions = [f'rev{revision}'] * len(events)
+
+    purchases_df = pd.concat([snapshot.purchases_df, events], ignore_index=True)
+    user_item_matrix, item_neighbours, user_neighbours = _expand_axes(
+        snapshot.user_item_matrix, snapshot.item_neighbours, snapshot.user_neighbours, events
+    )
+
+    # The buyers' purchases before and after, from the purchase index rather than the whole frame
+    buyers = np.unique(events['PersonID'].to_numpy(dtype=np.int64))
+    if set(events.columns) == set(snapshot.purchases_df.columns):
+        purchase_index = extend_purchase_index(snapshot.purchase_index, events, snapshot.products_df)
+    else:
+        purchase_index = build_purchase_index(purchases_df, snapshot.products_df)
+    old_purchases = snapshot.purchase_index.purchases_of(buyers)
+    buyer_purchases = purchase_index.purchases_of(buyers)
+
+    # Rebuild the buyers' rows with the same per-cell mean as create_user_item_matrix
+    cells = pd.Series(buyer_purchases['Amount'].to_numpy(dtype=np.float64)).groupby([
+        np.searchsorted(buyers, buyer_purchases['PersonID'].to_numpy(dtype=np.int64)),
+        np.searchsorted(user_item_matrix.product_names, buyer_purchases['ProductName'].to_numpy(dtype=str)),
+    ]).mean()
+    rows = user_item_matrix.user_positions(buyers)
+    new_rows = sp.csr_matrix(
+        (cells.to_numpy(), (cells.index.get_level_values(0), cells.index.get_level_values(1))),
+        shape=(len(buyers), user_item_matrix.shape[1]),
+    )
+    new_rows.eliminate_zeros()
+
+    # Only rows and columns whose values moved change any similarity
+    difference = (new_rows - user_item_matrix.matrix[rows]).tocoo()
+    difference.eliminate_zeros()
+    changed_users = rows[np.unique(difference.row)]
+    changed_products = np.unique(difference.col)
+
+    matrix = _replace_rows(user_item_matrix.matrix, rows, new_rows)
+    matrix.eliminate_zeros()
+    user_item_matrix = replace(user_item_matrix, matrix=matrix)
+
+    # A handful of rows is scored exactly against every user even when the
+    # full fit uses the approximate user index
+    item_neighbours = _update_neighbours(
+        item_neighbours, changed_products,
+        lambda rows: build_item_neighbours(matrix, m=item_neighbour_limit(), rows=rows),
+    )
+    user_neighbours = _update_neighbours(
+        user_neighbours, changed_users,
+        lambda rows: build_user_neighbours(matrix, k=user_neighbour_limit(), rows=rows),
+    )
+
+    buyer_profiles = build_user_profiles(buyer_purchases, snapshot.products_df)
+    user_profiles = {**snapshot.user_profiles, **buyer_profiles}
+    popularity = update_popularity(
+        snapshot.popularity, snapshot.catalogue,
+        old_purchases, {p: snapshot.user_profiles[p] for p in buyers.tolist() if p in snapshot.user_profiles},
+        buyer_purchases, buyer_profiles,
+        size=cold_start_size(),
+    )
+
+    model = replace(
+        snapshot.model,
+        person_ids=user_item_matrix.person_ids,
+        product_names=user_item_matrix.product_names,
+        user_item=matrix,
+        item_neighbours=item_neighbours,
+        user_neighbours=user_neighbours,
+        engine=None,
+        engine_arrays={},
+    )
+    return replace(
+        snapshot,
+        purchases_df=purchases_df,
+        model=model,
+        user_item_matrix=user_item_matrix,
+        model_product_codes=snapshot.catalogue.name_codes_of(user_item_matrix.product_names),
+        item_neighbours=item_neighbours,
+        user_neighbours=user_neighbours,
+        user_profiles=user_profiles,
+        purchase_index=purchase_index,
+        popularity=popularity,
+        engine_state=snapshot.engine.update(snapshot.engine_state, user_item_matrix, item_neighbours, changed_users),
+        revision=revision,
+        user_revisions={
+            **snapshot.user_revisions,
+            **dict(zip(events['PersonID'].to_numpy(dtype=np.int64).tolist(), revisions)),
+        },
+    )
+
+
+# snapshot with the purchase log lines it has not applied yet; each buyer's
+# cache label is the log offset past their last purchase, the same in every
+# worker however the lines were batched
+def apply_purchase_log(snapshot):
+    events, ends, offset = read_purchase_log(snapshot.log_offset)
+    if offset == snapshot.log_offset:
+        return snapshot
+
+    frame = events_frame(events, snapshot.purchases_df)
+    snapshot = apply_purchases(snapshot, frame, revisions=[f'log{end}' for end in ends.tolist()])
+    return replace(snapshot, log_offset=offset)
+
+
+# Apply (PersonID, ProductName, Amount) events and return this process's
+# snapshot including them. With persist, the events are appended to the
+# shared purchase log, which this worker applies right away and every other
+# worker on its next refresh; otherwise they only reach this process's
+# snapshot, until its next rebuild.
+def ingest_purchases(events, persist=True):
+    if not persist:
+        return update_snapshot(lambda snapshot: apply_purchases(snapshot, events_frame(events, snapshot.purchases_df)))
+
+    frame = events_frame(events, get_snapshot().purchases_df)
+    if not frame.empty:
+        append_to_purchase_log(frame)
+    return refresh_snapshot()
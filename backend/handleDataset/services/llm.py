@@ -0,0 +1,82 @@
+import asyncio
+import os
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Text generation backends behind generate_recipe, chosen by the
+# RECIPE_LLM_BACKEND setting ({'BACKEND': dotted path, 'OPTIONS': kwargs}).
+# One backend instance is created per process and reused by every request.
+
+DEFAULT_BACKEND = {
+    'BACKEND': 'handleDataset.services.llm.GeminiBackend',
+    'OPTIONS': {'model_name': 'gemini-1.5-flash'},
+}
+
+
+class RecipeBackend:
+    """Streams generated text for a prompt without blocking the event loop."""
+
+    async def stream(self, prompt):
+        raise NotImplementedError
+        yield
+
+    async def generate(self, prompt):
+        return ''.join([chunk async for chunk in self.stream(prompt)])
+
+
+class GeminiBackend(RecipeBackend):
+    """Google Gemini, configured once from GEMINI_API_KEY (or a .env file)."""
+
+    def __init__(self, model_name='gemini-1.5-flash', api_key=None):
+        import google.generativeai as genai
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        genai.configure(api_key=api_key or os.getenv('GEMINI_API_KEY'))
+        self.model = genai.GenerativeModel(model_name)
+
+    async def stream(self, prompt):
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            yield chunk.text
+
+
+class EchoBackend(RecipeBackend):
+    """Offline stand-in that streams the prompt back word by word, optionally
+    pausing between words to imitate a remote model's latency."""
+
+    def __init__(self, delay=0.0, max_words=None):
+        self.delay = delay
+        self.max_words = max_words
+
+    async def stream(self, prompt):
+        words = prompt.split()[:self.max_words]
+        for i, word in enumerate(words):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield word if i == 0 else f' {word}'
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+# The process-wide backend, created from settings on first use
+def get_llm_backend():
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = getattr(settings, 'RECIPE_LLM_BACKEND', DEFAULT_BACKEND)
+                _backend = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _backend
+
+
+# Drop the process-wide backend so the next request recreates it from settings
+def reset_llm_backend():
+    global _backend
+    with _backend_lock:
+        _backend = None
@@ -0,0 +1,192 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+
+# Pipeline instrumentation: per-stage timers, size observations and gauges,
+# kept in a process-wide registry and rendered in the Prometheus text format.
+#
+# Stages are recorded when RECOMMENDER_METRICS is on, or inside capture(),
+# which collects one request's timings for ?debug=timings. Otherwise stage()
+# hands back a shared no-op context manager, so instrumented code pays for
+# one settings lookup per stage.
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_STAGE = nullcontext()
+_capture = contextvars.ContextVar('recommender_metrics_capture', default=None)
+
+
+class Registry:
+    """Thread-safe store of stage timings, sizes and gauges."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}  # stage -> [bucket counts..., sum, count]
+        self._sizes = {}  # name -> [sum, count]
+        self._gauges = {}  # name -> value
+
+    def observe_time(self, stage, seconds):
+        with self._lock:
+            timing = self._timings.get(stage)
+            if timing is None:
+                timing = self._timings[stage] = [0] * (len(TIME_BUCKETS) + 2)
+            for i, bound in enumerate(TIME_BUCKETS):
+                if seconds <= bound:
+                    timing[i] += 1
+            timing[-2] += seconds
+            timing[-1] += 1
+
+    def observe_size(self, name, value):
+        with self._lock:
+            size = self._sizes.setdefault(name, [0, 0])
+            size[0] += value
+            size[1] += 1
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def render(self):
+        with self._lock:
+            lines = [
+                '# HELP recommender_stage_seconds Time spent in each recommendation pipeline stage.',
+                '# TYPE recommender_stage_seconds histogram',
+            ]
+            for stage, timing in sorted(self._timings.items()):
+                for bound, count in zip(TIME_BUCKETS, timing):
+                    lines.append(f'recommender_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'recommender_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {timing[-1]}')
+                lines.append(f'recommender_stage_seconds_sum{{stage="{stage}"}} {timing[-2]}')
+                lines.append(f'recommender_stage_seconds_count{{stage="{stage}"}} {timing[-1]}')
+
+            lines += [
+                '# HELP recommender_items Sizes seen by the pipeline (candidate sets, batches).',
+                '# TYPE recommender_items summary',
+            ]
+            for name, (total, count) in sorted(self._sizes.items()):
+                lines.append(f'recommender_items_sum{{name="{name}"}} {total}')
+                lines.append(f'recommender_items_count{{name="{name}"}} {count}')
+
+            lines += [
+                '# HELP recommender_model Shape of the model in the current snapshot.',
+                '# TYPE recommender_model gauge',
+            ]
+            for name, value in sorted(self._gauges.items()):
+                lines.append(f'recommender_model{{name="{name}"}} {value}')
+            return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._sizes.clear()
+            self._gauges.clear()
+
+
+registry = Registry()
+
+
+def enabled():
+    return getattr(settings, 'RECOMMENDER_METRICS', True)
+
+
+class _Stage:
+    __slots__ = ('name', 'captured', 'started')
+
+    def __init__(self, name, captured):
+        self.name = name
+        self.captured = captured
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        if self.captured is not None:
+            timings = self.captured['timings']
+            timings[self.name] = timings.get(self.name, 0.0) + seconds
+        if enabled():
+            registry.observe_time(self.name, seconds)
+
+
+# Context manager timing one pipeline stage
+def stage(name):
+    captured = _capture.get()
+    if captured is None and not enabled():
+        return _NULL_STAGE
+    return _Stage(name, captured)
+
+
+# Record a size (candidate set, batch) seen by a stage
+def observe(name, value):
+    captured = _capture.get()
+    if captured is not None:
+        captured['sizes'][name] = captured['sizes'].get(name, 0) + value
+    if enabled():
+        registry.observe_size(name, value)
+
+
+def set_gauge(name, value):
+    if enabled():
+        registry.set_gauge(name, value)
+
+
+# Collect the stage timings and sizes of the code run inside the block
+@contextmanager
+def capture():
+    captured = {'timings': {}, 'sizes': {}}
+    token = _capture.set(captured)
+    try:
+        yield captured
+    finally:
+        _capture.reset(token)
+
+
+class SamplingProfiler:
+    """Samples the calling thread's stack from a helper thread every interval
+    seconds and counts the stacks, root first, in the collapsed format
+    flame graph tools read."""
+
+    def __init__(self, interval=0.001, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._sampler.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            names = []
+            while frame is not None and len(names) < self.max_depth:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def report(self, top=20):
+        return [{'stack': stack, 'samples': samples} for stack, samples in self.stacks.most_common(top)]
+
+
+# A new profiler from RECOMMENDER_PROFILER (a dotted path to a class with the
+# SamplingProfiler interface), for one request
+def get_profiler():
+    from django.utils.module_loading import import_string
+
+    path = getattr(settings, 'RECOMMENDER_PROFILER', 'handleDataset.services.metrics.SamplingProfiler')
+    return import_string(path)()
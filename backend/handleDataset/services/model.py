@@ -0,0 +1,250 @@
+import json
+import os
+import shutil
+from dataclasses import dataclass, field
+
+import numpy as np
+import scipy.sparse as sp
+from django.conf import settings
+
+from . import metrics
+from .data_processing import get_data_dir, create_user_item_matrix, compute_item_similarity, UserItemMatrix
+from .neighbours import build_user_neighbours
+
+# Bump whenever the on-disk layout or the meaning of an array changes
+FORMAT_VERSION = 5
+
+META_FILE = 'meta.json'
+CURRENT_FILE = 'CURRENT'
+GENERATIONS_DIR = 'generations'
+DENSE_ARRAYS = ('person_ids', 'product_names')
+SPARSE_MATRICES = ('user_item', 'item_neighbours', 'user_neighbours')
+CSR_PARTS = ('indptr', 'indices', 'data')
+ENGINE_PREFIX = 'engine.'
+
+
+@dataclass(frozen=True)
+class SimilarityModel:
+    """Fitted sparse user-item matrix with top-M item and top-K user neighbours,
+    plus the state arrays of the engine it was fitted for, when that engine
+    stores any (see RecommendationEngine.state_arrays).
+
+    Arrays loaded from an artifact are read-only memory maps shared with every
+    other process that maps the same files.
+    """
+    data_version: str
+    person_ids: np.ndarray
+    product_names: np.ndarray
+    user_item: sp.csr_matrix
+    item_neighbours: sp.csr_matrix
+    user_neighbours: sp.csr_matrix
+    engine: dict = None  # config() of the engine the state arrays belong to
+    engine_arrays: dict = field(default_factory=dict)
+
+    def user_item_matrix(self):
+        return UserItemMatrix(matrix=self.user_item, person_ids=self.person_ids, product_names=self.product_names)
+
+
+# Directory of the persisted model artifact
+def get_model_dir():
+    return getattr(settings, 'RECOMMENDER_MODEL_DIR', os.path.join(get_data_dir(), 'model'))
+
+
+# Published models live in <model dir>/generations/<generation>/, one
+# artifact each, and the CURRENT file names the live one. Publishing writes a
+# new generation and then replaces CURRENT, so a process either sees the old
+# generation or the complete new one. Every worker memory-maps the same
+# files, so the model's pages are held once by the page cache however many
+# workers serve it.
+
+# (generation, artifact path) named by CURRENT, or None before the first publish
+def current_generation(root=None):
+    root = str(root or get_model_dir())
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return int(name), os.path.join(root, GENERATIONS_DIR, name)
+
+
+# Artifact directory of the live model: the current generation, or a flat
+# artifact directly in root (the layout before generations)
+def model_path(root=None):
+    current = current_generation(root)
+    return current[1] if current is not None else str(root or get_model_dir())
+
+
+def _generation_names(root):
+    try:
+        names = os.listdir(os.path.join(root, GENERATIONS_DIR))
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name.isdigit())
+
+
+# Save model as a new generation and make it current, keeping the newest
+# keep generations (RECOMMENDER_MODEL_KEEP_GENERATIONS by default). Pruned
+# files stay readable by processes that still map them.
+def publish_model(model, root=None, keep=None):
+    root = str(root or get_model_dir())
+    keep = keep or getattr(settings, 'RECOMMENDER_MODEL_KEEP_GENERATIONS', 3)
+    names = _generation_names(root)
+    name = f'{int(names[-1]) + 1 if names else 1:06d}'
+    path = save_model(model, os.path.join(root, GENERATIONS_DIR, name))
+
+    tmp_path = os.path.join(root, f'{CURRENT_FILE}.tmp-{os.getpid()}')
+    with open(tmp_path, 'w') as f:
+        f.write(name + '\n')
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+    for old in _generation_names(root)[:-keep]:
+        shutil.rmtree(os.path.join(root, GENERATIONS_DIR, old), ignore_errors=True)
+    return int(name), path
+
+
+# Neighbour list sizes kept per product and per user
+def item_neighbour_limit():
+    return getattr(settings, 'RECOMMENDER_ITEM_NEIGHBOURS', 100)
+
+
+def user_neighbour_limit():
+    return getattr(settings, 'RECOMMENDER_USER_NEIGHBOURS', 50)
+
+
+# Fit the model from a purchases frame, with the state of engine when it
+# stores one
+def fit_model(purchases_df, data_version, engine=None):
+    with metrics.stage('user_item_matrix'):
+        user_item_matrix = create_user_item_matrix(purchases_df)
+    with metrics.stage('item_similarity'):
+        item_neighbours = compute_item_similarity(user_item_matrix, top_m=item_neighbour_limit())
+    with metrics.stage('user_neighbours'):
+        user_neighbours = build_user_neighbours(
+            user_item_matrix.matrix,
+            k=user_neighbour_limit(),
+            approximate=getattr(settings, 'RECOMMENDER_USER_NEIGHBOURS_APPROXIMATE', False),
+        )
+    engine_arrays = {}
+    if engine is not None and engine.stores_state:
+        with metrics.stage('engine'):
+            engine_arrays = engine.state_arrays(engine.fit(user_item_matrix, item_neighbours))
+    return SimilarityModel(
+        data_version=data_version,
+        person_ids=user_item_matrix.person_ids,
+        product_names=user_item_matrix.product_names,
+        user_item=user_item_matrix.matrix,
+        item_neighbours=item_neighbours,
+        user_neighbours=user_neighbours,
+        engine=engine.config() if engine_arrays else None,
+        engine_arrays=engine_arrays,
+    )
+
+
+# Flatten a model into the named arrays stored on disk
+def _model_arrays(model):
+    arrays = {name: getattr(model, name) for name in DENSE_ARRAYS}
+    for name in SPARSE_MATRICES:
+        matrix = getattr(model, name)
+        for part in CSR_PARTS:
+            arrays[f'{name}.{part}'] = getattr(matrix, part)
+    for name, array in model.engine_arrays.items():
+        arrays[ENGINE_PREFIX + name] = array
+    return arrays
+
+
+# Write the model as one .npy file per array plus a JSON manifest.
+# Plain .npy files (unlike .npz members) can be memory mapped on load.
+def save_model(model, path):
+    path = str(path)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    for name, array in _model_arrays(model).items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), np.asarray(array), allow_pickle=False)
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'data_version': model.data_version,
+        'shapes': {name: list(getattr(model, name).shape) for name in DENSE_ARRAYS + SPARSE_MATRICES},
+        'nnz': {name: int(getattr(model, name).nnz) for name in SPARSE_MATRICES},
+        'engine': model.engine,
+    }
+    meta['shapes'].update({ENGINE_PREFIX + name: list(array.shape) for name, array in model.engine_arrays.items()})
+    with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    # Swap the finished directory into place
+    old_path = f'{path}.old-{os.getpid()}'
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+
+# Read the artifact manifest, or None when there is no artifact
+def read_model_meta(path=None):
+    meta_path = os.path.join(str(path or model_path()), META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+# Load a saved model, memory mapping its arrays by default
+def load_model(path=None, mmap=True):
+    path = str(path or model_path())
+    meta = read_model_meta(path)
+    if meta is None:
+        raise FileNotFoundError(f'No model artifact in {path}')
+    if meta.get('format_version') != FORMAT_VERSION:
+        raise ValueError(
+            f"Model artifact format {meta.get('format_version')} is not supported "
+            f"(expected {FORMAT_VERSION}), rebuild it"
+        )
+
+    def load(name):
+        return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None, allow_pickle=False)
+
+    fields = {name: load(name) for name in DENSE_ARRAYS}
+    for name in SPARSE_MATRICES:
+        # csr_matrix keeps references to the mapped buffers when dtypes already match
+        parts = [load(f'{name}.{part}') for part in CSR_PARTS]
+        fields[name] = sp.csr_matrix((parts[2], parts[1], parts[0]), shape=tuple(meta['shapes'][name]), copy=False)
+    fields['engine_arrays'] = {
+        name[len(ENGINE_PREFIX):]: load(name) for name in meta['shapes'] if name.startswith(ENGINE_PREFIX)
+    }
+    return SimilarityModel(data_version=meta['data_version'], engine=meta.get('engine'), **fields)
+
+
+# Check a model for internal consistency, returning a list of problems
+def validate_model(model, tolerance=1e-6):
+    problems = []
+    n_users, n_products = len(model.person_ids), len(model.product_names)
+
+    if model.user_item.shape != (n_users, n_products):
+        problems.append(f'user_item shape {model.user_item.shape} != ({n_users}, {n_products})')
+    if model.item_neighbours.shape != (n_products, n_products):
+        problems.append(f'item_neighbours shape {model.item_neighbours.shape} != ({n_products}, {n_products})')
+    if model.user_neighbours.shape != (n_users, n_users):
+        problems.append(f'user_neighbours shape {model.user_neighbours.shape} != ({n_users}, {n_users})')
+    if problems:
+        return problems
+
+    if len(np.unique(model.person_ids)) != n_users:
+        problems.append('person_ids contains duplicates')
+    if len(np.unique(model.product_names)) != n_products:
+        problems.append('product_names contains duplicates')
+    if not np.all(np.diff(model.person_ids) > 0):
+        problems.append('person_ids is not sorted')
+    for name in ('item_neighbours', 'user_neighbours'):
+        neighbours = getattr(model, name)
+        if not np.isfinite(neighbours.data).all():
+            problems.append(f'{name} contains non-finite values')
+        if (np.abs(neighbours.data) > 1 + tolerance).any():
+            problems.append(f'{name} has weights outside [-1, 1]')
+        if (neighbours.diagonal() != 0).any():
+            problems.append(f'{name} lists an entry as its own neighbour')
+    return problems
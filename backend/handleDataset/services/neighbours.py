@@ -0,0 +1,121 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+# Copy of matrix as float64 CSR with rows scaled to unit L2 norm (all-zero
+# rows left as they are). Same arithmetic as sklearn's normalize (bincount
+# sums each row in order, like its loop), without importing sklearn, which
+# would double the service's import time.
+def _normalize_rows(matrix):
+    normalized = matrix.tocsr().astype(np.float64, copy=True)
+    lengths = np.diff(normalized.indptr)
+    rows = np.repeat(np.arange(normalized.shape[0]), lengths)
+    norms = np.sqrt(np.bincount(rows, weights=normalized.data * normalized.data, minlength=normalized.shape[0]))
+    norms[norms == 0] = 1.0
+    normalized.data /= np.repeat(norms, lengths)
+    return normalized
+
+
+# Keep the k largest positive entries of every row of a sparse block.
+# Ties are broken by column index so the result does not depend on sort internals.
+# Values are split into buckets equal slices up to the block's maximum: the
+# buckets above the one where a row reaches k entries are kept whole, and only
+# that boundary bucket is sorted, so the cost stays linear in the block
+# however many candidates a row has.
+def _top_k_per_row(block, k, exclude=None, buckets=1024):
+    block = block.tocsr()
+    n_rows = block.shape[0]
+    rows = np.repeat(np.arange(n_rows), np.diff(block.indptr))
+    cols, data = block.indices, block.data
+
+    keep = data > 0
+    if exclude is not None:
+        keep &= cols != exclude[rows]
+    rows, cols, data = rows[keep], cols[keep], data[keep]
+
+    if len(data) > k:
+        # Bucket 0 holds the largest values; rows short of k entries keep them all
+        bucket = buckets - 1 - np.minimum((data * (buckets / data.max())).astype(np.int64), buckets - 1)
+        counts = np.cumsum(
+            np.bincount(rows * buckets + bucket, minlength=n_rows * buckets).reshape(n_rows, buckets), axis=1
+        )
+        reached = counts >= k
+        cutoff = np.where(reached.any(axis=1), reached.argmax(axis=1), buckets)
+        room = k - np.where(cutoff > 0, counts[np.arange(n_rows), np.maximum(cutoff - 1, 0)], 0)
+
+        keep = bucket < cutoff[rows]
+        boundary = np.flatnonzero(bucket == cutoff[rows])
+        order = boundary[np.lexsort((cols[boundary], -data[boundary], rows[boundary]))]
+        ranks = np.arange(len(order)) - np.searchsorted(rows[order], rows[order], side='left')
+        keep[order[ranks < room[rows[order]]]] = True
+        rows, cols, data = rows[keep], cols[keep], data[keep]
+
+    return sp.csr_matrix((data, (rows, cols)), shape=block.shape)
+
+
+# Cap every item's buyer list at the max_postings users it weighs most in
+# (ties by user index). Those are the users whose similarity it contributes
+# most to, so the capped lists keep the strongest candidate pairs.
+def _cap_postings(matrix_csc, max_postings):
+    counts = np.diff(matrix_csc.indptr)
+    if counts.max(initial=0) <= max_postings:
+        return matrix_csc
+
+    cols = np.repeat(np.arange(matrix_csc.shape[1]), counts)
+    order = np.lexsort((matrix_csc.indices, -matrix_csc.data, cols))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - matrix_csc.indptr[cols[order]]
+
+    capped = matrix_csc.copy()
+    capped.data = np.where(rank < max_postings, capped.data, 0)
+    capped.eliminate_zeros()
+    return capped
+
+
+# Top-k cosine neighbours of the row vectors of matrix, for the rows listed
+# (all by default), as a CSR matrix with one row per entry of rows.
+#
+# Exact mode computes one block of rows at a time as a sparse product, so
+# memory follows the number of co-occurring pairs in a block rather than
+# rows x rows. Approximate mode finds candidates through posting lists
+# (the non-zero rows of each column) capped at max_postings entries, since
+# very popular columns otherwise pair almost everything, keeps the
+# max_candidates best of each row by that partial score, and then scores
+# only those exactly.
+def _build_neighbours(
+    matrix, k, rows=None, block_size=2048, approximate=False, max_postings=200, max_candidates=500
+):
+    n_rows = matrix.shape[0]
+    rows = np.arange(n_rows) if rows is None else np.asarray(rows, dtype=np.int64)
+
+    normalized = _normalize_rows(matrix)
+    others = normalized.T.tocsc()
+    if approximate:
+        others = _cap_postings(normalized.tocsc(), max_postings).T.tocsc()
+
+    blocks = []
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        block = normalized[block_rows] @ others
+
+        if approximate:
+            # Rescore the best candidate pairs against the uncapped vectors
+            block = _top_k_per_row(block, max(k, max_candidates), exclude=block_rows).tocoo()
+            exact = normalized[block_rows[block.row]].multiply(normalized[block.col]).sum(axis=1)
+            block = sp.csr_matrix(
+                (np.asarray(exact).ravel(), (block.row, block.col)), shape=(len(block_rows), n_rows)
+            )
+
+        blocks.append(_top_k_per_row(block, k, exclude=block_rows))
+
+    return sp.vstack(blocks, format='csr') if blocks else sp.csr_matrix((0, n_rows))
+
+
+# Top-k most similar users of each user (users x users)
+def build_user_neighbours(user_item, k=50, rows=None, **options):
+    return _build_neighbours(user_item, k, rows=rows, **options)
+
+
+# Top-m most similar products of each product (products x products)
+def build_item_neighbours(user_item, m=100, rows=None, **options):
+    return _build_neighbours(user_item.T, m, rows=rows, **options)
@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# (offsets, ids) grouping ProductIds by key: the ids of key k, ascending,
+# are ids[offsets[k]:offsets[k + 1]]. Negative keys are left out.
+def _group(keys, n_keys):
+    ids = np.flatnonzero(keys >= 0)
+    ids = ids[np.argsort(keys[ids], kind='stable')]
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(keys[keys >= 0], minlength=n_keys))])
+    return offsets, ids
+
+
+# Ascending ids of the given groups
+def _members(offsets, ids, groups):
+    groups = np.unique(groups)
+    groups = groups[groups >= 0]
+    starts, counts = offsets[groups], offsets[groups + 1] - offsets[groups]
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.sort(ids[np.repeat(starts, counts) + np.arange(counts.sum()) - first])
+
+
+@dataclass(frozen=True)
+class CandidatePools:
+    """ProductIds behind the catalogue-wide filters of the pipeline, built
+    once per snapshot. Pools are ascending, like the boolean masks over the
+    catalogue they replace, so a stage that needs the first n usable
+    products only reads a prefix of its pool.
+    """
+    unhealthy: np.ndarray  # HealthyIndex <= 5
+    healthy: np.ndarray  # HealthyIndex > 5
+    basic_needs: np.ndarray  # BasicNeedsIndex == 10
+    special_codes: np.ndarray  # name codes of the items only offered to people who bought them
+    name_groups: tuple  # (offsets, ids) by name code
+    category_groups: tuple  # (offsets, ids) by category code
+    basic_needs_groups: tuple  # (offsets, ids) of basic_needs by category code
+    category_counts: np.ndarray  # products per category code
+    category_first: np.ndarray  # first ProductId of each category code, -1 for empty ones
+
+    # Ascending ids of the products whose name code is in codes (-1 ignored)
+    def ids_of_codes(self, codes):
+        return _members(*self.name_groups, np.asarray(codes, dtype=np.intp))
+
+    def category_ids(self, code):
+        offsets, ids = self.category_groups
+        return ids[offsets[code]:offsets[code + 1]]
+
+    # Ascending basic-needs ids in the given categories
+    def basic_needs_in(self, category_codes):
+        return _members(*self.basic_needs_groups, np.asarray(category_codes, dtype=np.intp))
+
+
+class NameSet:
+    """A growing set of catalogue name codes, such as the names the remaining
+    stages of one person's pipeline skip, kept as flags so filtering
+    ProductIds by name costs one lookup per id."""
+
+    def __init__(self, n_names):
+        # The extra last slot absorbs -1 codes
+        self.flags = np.zeros(n_names + 1, dtype=bool)
+        self._codes = []
+
+    def add(self, codes):
+        self.flags[codes] = True
+        self._codes.append(np.asarray(codes, dtype=np.intp))
+
+    # Flag per code: whether it is in the set
+    def contains(self, codes):
+        return self.flags[codes]
+
+    def codes(self):
+        return np.unique(np.concatenate(self._codes)) if self._codes else np.empty(0, dtype=np.intp)
+
+    # ids whose name is not in the set
+    def free(self, ids, name_codes):
+        return ids[~self.flags[name_codes[ids]]]
+
+    # First n free ids of an ascending pool, reading only as much of it as needed
+    def first_free(self, pool, name_codes, n):
+        if n <= 0:
+            return pool[:0]
+        length = 2 * n + 8
+        while True:
+            free = self.free(pool[:length], name_codes)
+            if len(free) >= n or length >= len(pool):
+                return free[:n]
+            length *= 4
+
+
+def build_candidate_pools(catalogue, special_items):
+    n_categories = len(catalogue.categories)
+    basic_needs = np.flatnonzero(catalogue.basic_needs_index == 10)
+    special_codes = catalogue.name_codes_of(special_items)
+
+    basic_needs_offsets, basic_needs_positions = _group(catalogue.category_codes[basic_needs], n_categories)
+    category_offsets, category_ids = _group(catalogue.category_codes, n_categories)
+    category_counts = np.diff(category_offsets)
+    category_first = np.full(n_categories, -1, dtype=np.intp)
+    category_first[category_counts > 0] = category_ids[category_offsets[:-1][category_counts > 0]]
+    return CandidatePools(
+        unhealthy=np.flatnonzero(catalogue.healthy_index <= 5),
+        healthy=np.flatnonzero(catalogue.healthy_index > 5),
+        basic_needs=basic_needs,
+        special_codes=special_codes[special_codes >= 0],
+        name_groups=_group(catalogue.name_codes, len(catalogue.names)),
+        category_groups=(category_offsets, category_ids),
+        basic_needs_groups=(basic_needs_offsets, basic_needs[basic_needs_positions]),
+        category_counts=category_counts,
+        category_first=category_first,
+    )
@@ -0,0 +1,193 @@
+from dataclasses import dataclass, fields
+
+import numpy as np
+from django.conf import settings
+
+from .data_processing import SPECIAL_ITEMS, determine_user_type, rank_recommendations, within_subcategory_limit
+from .profiles import UserProfile
+
+SEGMENTS = ('healthy', 'unhealthy')
+
+# Default preferences for a segment nobody in the data belongs to
+_EMPTY_SEGMENT_HEALTHY = {'healthy': 7.5, 'unhealthy': 2.5}
+
+
+@dataclass(frozen=True)
+class PopularityCounts:
+    """Sums the popularity tables are ranked from, kept with them so ingested
+    purchases update the tables without another pass over every purchase.
+    Keys are None for all shoppers, else a segment."""
+    buyers: dict  # key -> distinct buyers per name code
+    amounts: dict  # key -> summed Amount per name code
+    members: dict  # segment -> shoppers in it
+    healthy: dict  # segment -> summed avg_healthy of its shoppers
+    category_shoppers: dict  # segment -> its shoppers per category code
+    category_amounts: dict  # segment -> its summed category amounts per category code
+
+    def __add__(self, other):
+        return PopularityCounts(*(
+            {key: mine[key] + theirs[key] for key in mine}
+            for mine, theirs in ((getattr(self, f.name), getattr(other, f.name)) for f in fields(self))
+        ))
+
+    def __neg__(self):
+        return PopularityCounts(*({key: -value for key, value in getattr(self, f.name).items()} for f in fields(self)))
+
+    def __sub__(self, other):
+        return self + -other
+
+
+@dataclass(frozen=True)
+class PopularityTables:
+    """Popularity rankings and ready-made recommendations for people without
+    a purchase history, computed once per snapshot.
+
+    Rankings are ProductIds, one per product name, ordered by distinct
+    buyers, then total amount, then catalogue order. Segments split shoppers
+    by determine_user_type of their profile. Recommendation lists hold up to
+    size records, so a lookup is a slice.
+    """
+    overall: np.ndarray
+    by_category: dict  # category -> ranking restricted to it
+    by_segment: dict  # segment -> ranking among that segment's shoppers
+    default_profiles: dict  # segment -> UserProfile of an average shopper in it
+    default_segment: str  # segment most shoppers belong to
+    segment_records: dict  # segment -> recommendation records
+    category_records: dict  # category -> recommendation records
+    counts: PopularityCounts
+
+    # Records for a person without history, from the category when one is
+    # given, else from the segment (the most common one by default)
+    def recommendations(self, top_n=10, segment=None, category=None):
+        if segment is not None and segment not in SEGMENTS:
+            raise ValueError(f"segment must be one of {', '.join(SEGMENTS)}")
+        if category is not None:
+            if category not in self.category_records:
+                raise ValueError(f'Unknown category: {category}')
+            return self.category_records[category][:top_n]
+        return self.segment_records[segment or self.default_segment][:top_n]
+
+
+# Recommendations kept per cold-start list, the largest topN they serve
+def cold_start_size():
+    return getattr(settings, 'RECOMMENDER_COLD_START_SIZE', 50)
+
+
+# ProductIds ranked by buyers, then amount, keeping the first id of each name
+def _rank(catalogue, buyers, amounts):
+    ids = np.arange(len(catalogue))
+    codes = catalogue.name_codes
+    order = np.lexsort((ids, -amounts[codes], -buyers[codes]))
+    _, first = np.unique(codes[order], return_index=True)
+    return order[np.sort(first)]
+
+
+# Average shopper of a segment: mean HealthyIndex preference and the
+# segment's category amounts, largest first, ties in category order
+def _default_profile(segment, counts, catalogue):
+    members = counts.members[segment]
+    if not members:
+        return UserProfile(avg_healthy=_EMPTY_SEGMENT_HEALTHY[segment], category_amounts=(), purchased_products=frozenset())
+
+    amounts = counts.category_amounts[segment]
+    codes = np.flatnonzero(counts.category_shoppers[segment] > 0)
+    codes = codes[np.argsort(-amounts[codes], kind='stable')]
+    return UserProfile(
+        avg_healthy=float(counts.healthy[segment] / members),
+        category_amounts=tuple(zip(catalogue.categories[codes].tolist(), amounts[codes].tolist())),
+        purchased_products=frozenset(),
+    )
+
+
+# PopularityCounts of purchases_df and of the profiles of its buyers
+def count_popularity(purchases_df, catalogue, user_profiles):
+    n_names, n_categories = len(catalogue.names), len(catalogue.categories)
+    person_ids = purchases_df['PersonID'].to_numpy(dtype=np.int64)
+    codes = catalogue.name_codes_of(purchases_df['ProductName'])
+    amounts = purchases_df['Amount'].to_numpy(dtype=np.float64)
+    known = codes >= 0
+    person_ids, codes, amounts = person_ids[known], codes[known], amounts[known]
+
+    segment_of = {person_id: determine_user_type(profile.avg_healthy) for person_id, profile in user_profiles.items()}
+    buyer_segments = np.array([segment_of.get(person_id) for person_id in person_ids.tolist()], dtype=object)
+
+    # One vote per (person, name) for buyers, every row for amounts
+    buyers, totals = {}, {}
+    for key in (None,) + SEGMENTS:
+        mask = np.ones(len(codes), dtype=bool) if key is None else buyer_segments == key
+        pairs = np.unique(person_ids[mask] * n_names + codes[mask])
+        buyers[key] = np.bincount(pairs % n_names, minlength=n_names)
+        totals[key] = np.bincount(codes[mask], weights=amounts[mask], minlength=n_names)
+
+    profiles = list(user_profiles.values())
+    segments = np.array([segment_of[person_id] for person_id in user_profiles], dtype=object)
+    healthy = np.array([profile.avg_healthy for profile in profiles], dtype=np.float64)
+    sizes = np.array([len(profile.category_amounts) for profile in profiles], dtype=np.intp)
+    pairs = [pair for profile in profiles for pair in profile.category_amounts]
+    category_codes = catalogue.categories.get_indexer([category for category, _ in pairs])
+    category_amounts = np.array([amount for _, amount in pairs], dtype=np.float64)
+    pair_segments = np.repeat(segments, sizes)
+    in_catalogue = category_codes >= 0
+
+    def by_segment(values, segment):
+        mask = in_catalogue & (pair_segments == segment)
+        return np.bincount(category_codes[mask], weights=None if values is None else values[mask], minlength=n_categories)
+
+    return PopularityCounts(
+        buyers=buyers,
+        amounts=totals,
+        members={segment: int((segments == segment).sum()) for segment in SEGMENTS},
+        healthy={segment: float(healthy[segments == segment].sum()) for segment in SEGMENTS},
+        category_shoppers={segment: by_segment(None, segment) for segment in SEGMENTS},
+        category_amounts={segment: by_segment(category_amounts, segment) for segment in SEGMENTS},
+    )
+
+
+# Rankings and cold-start records from counts
+def popularity_tables(catalogue, counts, size=50):
+    overall = _rank(catalogue, counts.buyers[None], counts.amounts[None])
+    by_segment = {segment: _rank(catalogue, counts.buyers[segment], counts.amounts[segment]) for segment in SEGMENTS}
+    by_category = {
+        category: overall[catalogue.category_codes[overall] == code] for code, category in enumerate(catalogue.categories)
+    }
+    default_profiles = {segment: _default_profile(segment, counts, catalogue) for segment in SEGMENTS}
+    default_segment = max(SEGMENTS, key=lambda segment: counts.members[segment])
+
+    # The pipeline's rules for someone who never bought the special items
+    available = ~catalogue.mask_of_names(SPECIAL_ITEMS)
+
+    def records(ranked, segment):
+        ranked = ranked[available[ranked]]
+        candidates = ranked[within_subcategory_limit(catalogue, ranked, keep_missing=True)][:size]
+        profile = default_profiles[segment]
+        preferences = (profile.top_categories, profile.purchased_categories, segment)
+        return rank_recommendations([(candidates, preferences)], catalogue, top_n=size)[0]
+
+    return PopularityTables(
+        overall=overall,
+        by_category=by_category,
+        by_segment=by_segment,
+        default_profiles=default_profiles,
+        default_segment=default_segment,
+        segment_records={segment: records(by_segment[segment], segment) for segment in SEGMENTS},
+        category_records={
+            category: records(ranked, default_segment) for category, ranked in by_category.items()
+        },
+        counts=counts,
+    )
+
+
+def build_popularity(purchases_df, catalogue, user_profiles, size=50):
+    return popularity_tables(catalogue, count_popularity(purchases_df, catalogue, user_profiles), size=size)
+
+
+# popularity after some buyers' purchases changed: their purchases and
+# profiles before (old_purchases, old_profiles) are taken out of the counts
+# and their purchases and profiles now are put in
+def update_popularity(popularity, catalogue, old_purchases, old_profiles, new_purchases, new_profiles, size=50):
+    counts = (
+        popularity.counts
+        - count_popularity(old_purchases, catalogue, old_profiles)
+        + count_popularity(new_purchases, catalogue, new_profiles)
+    )
+    return popularity_tables(catalogue, counts, size=size)
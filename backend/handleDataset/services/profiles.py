@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    """What the pipeline needs to know about one person's purchase history."""
+    avg_healthy: float
+    category_amounts: tuple  # (category, amount) pairs, largest amount first
+    purchased_products: frozenset
+
+    @property
+    def top_categories(self):
+        return [category for category, _ in self.category_amounts[:2]]
+
+    @property
+    def purchased_categories(self):
+        return [category for category, _ in self.category_amounts]
+
+    # Same triple as get_user_preferences
+    def preferences(self):
+        return self.avg_healthy, self.top_categories, self.purchased_categories
+
+
+# Build every person's profile in one grouped pass over purchases joined with
+# products. Matches get_user_preferences person by person.
+def build_user_profiles(purchases_df, products_df):
+    merged = purchases_df.merge(products_df, on='ProductName', how='left')
+    person_ids = merged['PersonID']
+
+    # Amount-weighted HealthyIndex, plain mean when a person's amounts sum to zero
+    total_amount = merged['Amount'].groupby(person_ids).sum()
+    weighted = (merged['HealthyIndex'] * merged['Amount']).groupby(person_ids).sum()
+    mean_healthy = merged['HealthyIndex'].groupby(person_ids).mean()
+    avg_healthy = (weighted / total_amount.where(total_amount > 0)).where(total_amount > 0, mean_healthy)
+
+    # Category amounts per person, largest first, ties in category order
+    category_sums = merged.groupby(['PersonID', 'Category'], observed=True)['Amount'].sum()
+    category_people = category_sums.index.get_level_values(0).to_numpy()
+    categories = np.asarray(category_sums.index.get_level_values(1), dtype=object)
+    amounts = category_sums.to_numpy()
+    order = np.lexsort((-amounts, category_people))
+    category_people, categories, amounts = category_people[order], categories[order], amounts[order]
+    starts = np.searchsorted(category_people, avg_healthy.index.to_numpy(), side='left')
+    ends = np.searchsorted(category_people, avg_healthy.index.to_numpy(), side='right')
+
+    purchased_products = merged.groupby('PersonID')['ProductName'].unique()
+
+    return {
+        int(person_id): UserProfile(
+            avg_healthy=float(healthy),
+            category_amounts=tuple(zip(categories[start:end].tolist(), amounts[start:end].tolist())),
+            purchased_products=frozenset(products),
+        )
+        for person_id, healthy, start, end, products in zip(
+            avg_healthy.index, avg_healthy.to_numpy(), starts, ends, purchased_products.to_numpy()
+        )
+    }
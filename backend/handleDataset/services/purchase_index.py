@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+
+# Column values as an array whose tolist() gives the same Python values as
+# DataFrame.to_dict('records')
+def _record_values(series):
+    return series.to_numpy() if is_numeric_dtype(series.dtype) else series.to_numpy(dtype=object)
+
+
+@dataclass(frozen=True)
+class PurchaseIndex:
+    """Purchases grouped by PersonID, joined on demand to a per-product table.
+
+    details(person_id) returns the same records as merging all purchases with
+    the products (left join on ProductName), filtering the person, dropping
+    PersonID and adding ImageURL, but only touches that person's rows.
+    columns(person_id) returns them as (names, column arrays).
+    """
+    person_ids: np.ndarray  # sorted, unique
+    offsets: np.ndarray  # purchases of person_ids[i] are rows offsets[i]:offsets[i + 1]
+    product_codes: np.ndarray  # per purchase row, product in the product table
+    product_names: np.ndarray  # product code -> ProductName
+    purchase_columns: tuple  # (name, per-purchase values), in file order
+    table_starts: np.ndarray  # product code -> first row of its product table rows
+    table_counts: np.ndarray  # product code -> number of matching product rows
+    table_columns: tuple  # (name, per-product-row values), including ImageURL
+
+    def columns(self, person_id):
+        names = [name for name, _ in self.purchase_columns] + [name for name, _ in self.table_columns]
+        i = np.searchsorted(self.person_ids, person_id)
+        if i == len(self.person_ids) or self.person_ids[i] != person_id:
+            return names, [column[:0] for _, column in self.purchase_columns + self.table_columns]
+
+        start, end = self.offsets[i], self.offsets[i + 1]
+        codes = self.product_codes[start:end]
+        counts = self.table_counts[codes]
+
+        # One output row per (purchase, matching product row), as a merge would
+        purchase_rows = np.repeat(np.arange(start, end), counts)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        table_rows = np.repeat(self.table_starts[codes], counts) + np.arange(len(first)) - first
+
+        columns = [column[purchase_rows] for _, column in self.purchase_columns]
+        columns += [column[table_rows] for _, column in self.table_columns]
+        return names, columns
+
+    # Purchases of the given people (sorted, unique) as a frame with PersonID
+    # and the indexed purchase columns, each person's rows in file order
+    def purchases_of(self, person_ids):
+        person_ids = np.asarray(person_ids, dtype=np.int64)
+        i = np.searchsorted(self.person_ids, person_ids)
+        found = i < len(self.person_ids)
+        found[found] = self.person_ids[i[found]] == person_ids[found]
+        starts, counts = self.offsets[i[found]], np.diff(self.offsets)[i[found]]
+        rows = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        return pd.DataFrame({
+            'PersonID': np.repeat(person_ids[found], counts),
+            **{name: column[rows] for name, column in self.purchase_columns},
+        })
+
+    def details(self, person_id):
+        names, columns = self.columns(person_id)
+        return [dict(zip(names, row)) for row in zip(*(column.tolist() for column in columns))]
+
+
+# (counts, columns) of the product table rows for names: a left join on
+# ProductName, so column dtypes match the full merge, grouped by name
+def _product_table(names, products_df):
+    table = pd.DataFrame({'_code': np.arange(len(names)), 'ProductName': names}).merge(
+        products_df, on='ProductName', how='left'
+    )
+    table_counts = np.bincount(table['_code'].to_numpy(), minlength=len(names))
+    table['ImageURL'] = [f"{name}.png" for name in table['ProductName']]
+    table_columns = tuple(
+        (name, _record_values(table[name])) for name in table.columns if name not in ('_code', 'ProductName')
+    )
+    return table_counts, table_columns
+
+
+# Index purchases_df by PersonID and build the product table for its products
+def build_purchase_index(purchases_df, products_df):
+    person_ids = purchases_df['PersonID'].to_numpy(dtype=np.int64)
+    order = np.argsort(person_ids, kind='stable')
+    unique_ids, starts = np.unique(person_ids[order], return_index=True)
+
+    codes, names = pd.factorize(purchases_df['ProductName'], use_na_sentinel=False)
+    table_counts, table_columns = _product_table(names, products_df)
+
+    purchase_columns = tuple(
+        (name, _record_values(purchases_df[name])[order]) for name in purchases_df.columns if name != 'PersonID'
+    )
+    return PurchaseIndex(
+        person_ids=unique_ids,
+        offsets=np.append(starts, len(order)),
+        product_codes=codes[order],
+        product_names=np.asarray(names, dtype=object),
+        purchase_columns=purchase_columns,
+        table_starts=np.cumsum(table_counts) - table_counts,
+        table_counts=table_counts,
+        table_columns=table_columns,
+    )
+
+
+# Insert values at positions, in a dtype that holds both
+def _insert(column, positions, values):
+    dtype = np.result_type(column, values) if column.dtype != object and values.dtype != object else object
+    return np.insert(column.astype(dtype, copy=False), positions, values.astype(dtype, copy=False))
+
+
+# index with the purchases of events (a frame with the columns of the
+# purchases it was built from) added after each person's earlier purchases,
+# as build_purchase_index would index the concatenated purchases. Only the
+# products the index has not seen are joined to products_df.
+def extend_purchase_index(index, events, products_df):
+    if events.empty:
+        return index
+
+    person_ids = events['PersonID'].to_numpy(dtype=np.int64)
+    order = np.argsort(person_ids, kind='stable')
+    person_ids = person_ids[order]
+    positions = index.offsets[np.searchsorted(index.person_ids, person_ids, side='right')]
+
+    # Codes of the events' products, new names appended to the product table
+    event_names = events['ProductName'].to_numpy(dtype=object)[order]
+    known = pd.Index(index.product_names)
+    codes = known.get_indexer(event_names)
+    new_names = pd.unique(event_names[codes < 0])
+    product_names = index.product_names
+    table_starts, table_counts, table_columns = index.table_starts, index.table_counts, index.table_columns
+    if len(new_names):
+        codes[codes < 0] = len(product_names) + pd.Index(new_names).get_indexer(event_names[codes < 0])
+        product_names = np.concatenate([product_names, np.asarray(new_names, dtype=object)])
+        new_counts, new_columns = _product_table(new_names, products_df)
+        table_counts = np.concatenate([table_counts, new_counts])
+        table_starts = np.cumsum(table_counts) - table_counts
+        table_columns = tuple(
+            (name, _insert(column, len(column), new_column))
+            for (name, column), (_, new_column) in zip(table_columns, new_columns)
+        )
+
+    purchase_columns = tuple(
+        (name, _insert(column, positions, _record_values(events[name])[order]))
+        for name, column in index.purchase_columns
+    )
+    all_person_ids = np.union1d(index.person_ids, person_ids)
+    counts = np.diff(index.offsets)
+    counts = np.bincount(np.searchsorted(all_person_ids, index.person_ids), weights=counts, minlength=len(all_person_ids))
+    counts += np.bincount(np.searchsorted(all_person_ids, person_ids), minlength=len(all_person_ids))
+    return PurchaseIndex(
+        person_ids=all_person_ids,
+        offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        product_codes=np.insert(index.product_codes, positions, codes),
+        product_names=product_names,
+        purchase_columns=purchase_columns,
+        table_starts=table_starts,
+        table_counts=table_counts,
+        table_columns=table_columns,
+    )
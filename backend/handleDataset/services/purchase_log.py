@@ -0,0 +1,63 @@
+import csv
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .data_processing import get_data_dir
+
+EVENT_COLUMNS = ['PersonID', 'ProductName', 'Amount']
+
+# Purchases ingested through the API, shared by every worker process.
+#
+# Ingested events are appended to a log next to purchases.csv (one CSV line
+# per event, no header) instead of to purchases.csv itself, so ingestion
+# leaves the source files, their signature and the published model current.
+# Each snapshot records how many bytes of the log it has applied; a worker
+# that finds the log longer applies the new lines on top of its snapshot,
+# and a rebuilt snapshot replays the whole log.
+
+LOG_FILE = 'purchases.log'
+
+
+def purchase_log_path():
+    return getattr(settings, 'RECOMMENDER_PURCHASE_LOG', None) or os.path.join(get_data_dir(), LOG_FILE)
+
+
+# Bytes in the log, 0 before the first ingest
+def purchase_log_size():
+    try:
+        return os.stat(purchase_log_path()).st_size
+    except FileNotFoundError:
+        return 0
+
+
+# Append a frame of cleaned events. The batch goes out in one write to a file
+# opened for appending, so batches from concurrent workers never interleave.
+def append_to_purchase_log(frame):
+    data = frame.reindex(columns=EVENT_COLUMNS).to_csv(header=False, index=False, lineterminator='\n').encode('utf-8')
+    fd = os.open(purchase_log_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+# (events, line ends, new offset) for the complete lines after offset: events
+# as (PersonID, ProductName, Amount) rows, line ends as the log offset just
+# past each event's line. A line still being written is left for later.
+def read_purchase_log(offset=0):
+    try:
+        with open(purchase_log_path(), 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], np.empty(0, dtype=np.int64), offset
+
+    data = data[:data.rfind(b'\n') + 1]
+    lines = data.split(b'\n')[:-1]
+    ends = offset + np.cumsum([len(line) + 1 for line in lines], dtype=np.int64)
+    rows = list(csv.reader(line.decode('utf-8') for line in lines))
+    complete = np.array([len(row) == len(EVENT_COLUMNS) for row in rows], dtype=bool)
+    events = [tuple(row) for row, ok in zip(rows, complete) if ok]
+    return events, ends[complete], offset + len(data)
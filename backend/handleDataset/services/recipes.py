@@ -0,0 +1,133 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+# Prompt asking for a simple recipe built mainly from the recommended products
+def recipe_prompt(recommended_product_names, all_food_items):
+    # Convert lists to comma-separated strings
+    recommended_products_str = ', '.join(recommended_product_names)
+    all_food_items_str = ', '.join(all_food_items)
+
+    return (
+        "Ești un bucătar foarte priceput, scopul tău este să creezi o rețetă culinară în care să utilizezi unele din următoarele ingrediente: "
+        + recommended_products_str
+        + ". Încearcă să folosești în principal ingredientele pe care ți le-am dat, dar dacă nu sunt suficiente, adaugă cu prioritate peste orice alte ingrediente comune pe cele din lista următoare: "
+        + all_food_items_str
+        + ". Este important ca rețeta să fie simplă și accesibilă pentru oricine. Nu include niciun alt text suplimentar. Tot ceea ce trebuie să returnezi este rețeta și lista de ingrediente. De asemenea, limbajul trebuie să fie simplu și să facă rețeta să pară ușoară. Inconjoara fiecare idee cu <h1>, respectiv <p>"
+    )
+
+
+# One server-sent event; data is JSON so chunks may contain newlines
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+# Server-sent events for a streamed recipe: one "chunk" event per piece of
+# text, then "done" (or "error" if generation fails part way)
+async def recipe_events(person_id, chunks):
+    try:
+        async for chunk in chunks:
+            yield sse_event('chunk', chunk)
+    except Exception as e:
+        yield sse_event('error', {'personId': person_id, 'error': str(e)})
+        return
+    yield sse_event('done', {'personId': person_id})
+
+
+# Canonical cache key of an ingredient set: order and repeats do not matter
+def recipe_key(ingredients, catalogue_version):
+    canonical = '\n'.join(sorted(set(ingredients)))
+    digest = hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+    return f'{catalogue_version}:{digest}'
+
+
+class RecipeCache:
+    """Bounded LRU of generated recipes keyed on the recommended ingredient set
+    and the catalogue version.
+
+    With a similarity threshold, a miss falls back to the recipe for the same
+    catalogue whose ingredient set is most similar (Jaccard), provided the
+    similarity reaches the threshold. That scan is linear in the number of
+    entries, which the size bound keeps small.
+    """
+
+    def __init__(self, max_entries=1000, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  # key -> (catalogue_version, ingredient set, recipe)
+        self._lock = threading.Lock()
+
+    def get(self, ingredients, catalogue_version):
+        key = recipe_key(ingredients, catalogue_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.similarity_threshold is not None:
+                key, entry = self._nearest(frozenset(ingredients), catalogue_version)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def _nearest(self, ingredients, catalogue_version):
+        best_key, best_similarity = None, self.similarity_threshold
+        for key in reversed(self._entries):
+            version, cached, _ = self._entries[key]
+            if version != catalogue_version:
+                continue
+            similarity = len(ingredients & cached) / max(len(ingredients | cached), 1)
+            if similarity > best_similarity or (best_key is None and similarity == best_similarity):
+                best_key, best_similarity = key, similarity
+        return best_key, self._entries.get(best_key)
+
+    def set(self, ingredients, catalogue_version, recipe):
+        key = recipe_key(ingredients, catalogue_version)
+        with self._lock:
+            self._entries[key] = (catalogue_version, frozenset(ingredients), recipe)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# The process-wide recipe cache, configured from settings on first use
+def get_recipe_cache():
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = RecipeCache(
+                    max_entries=getattr(settings, 'RECIPE_CACHE_SIZE', 1000),
+                    similarity_threshold=getattr(settings, 'RECIPE_CACHE_SIMILARITY', None),
+                )
+    return _cache
+
+
+# Drop the process-wide recipe cache so the next call rebuilds it from settings
+def reset_recipe_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+# Pass chunks through and cache the whole recipe once the stream completes
+async def caching_chunks(chunks, cache, ingredients, catalogue_version):
+    parts = []
+    async for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(ingredients, catalogue_version, ''.join(parts))
+
+
+async def cached_chunks(recipe):
+    yield recipe
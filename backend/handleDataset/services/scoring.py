@@ -0,0 +1,76 @@
+import numpy as np
+
+# Vectorized scoring rules shared by the single-person and batch pipelines.
+#
+# Candidates are scored as flat (user, product) pairs: user_index says which
+# user of the batch a row belongs to, and per-user category memberships are
+# boolean users x categories tables, so one call can score every user's
+# candidate set at once. The single-person path is a batch of one.
+
+
+# Category codes of a categorical column, and the category index behind them
+def category_codes(frame):
+    return frame['Category'].cat.codes.to_numpy(), frame['Category'].cat.categories
+
+
+# users x categories membership table from per-user category name lists
+def category_flags(categories, category_lists):
+    flags = np.zeros((len(category_lists), len(categories) + 1), dtype=bool)
+    for user, names in enumerate(category_lists):
+        codes = categories.get_indexer(list(names))
+        flags[user, codes[codes >= 0]] = True
+    # The extra last column stays False and absorbs missing categories (code -1)
+    return flags
+
+
+# first where the pair's category is in first_flags, then second, else default
+def tiered_category_score(user_index, codes, first_flags, second_flags, first, second, default):
+    return np.select(
+        [first_flags[user_index, codes], second_flags[user_index, codes]],
+        [first, second],
+        default
+    )
+
+
+# Score of refine_recommendations
+def refine_scores(user_index, codes, healthy_index, discount, purchased_flags, top_flags, healthy_users,
+                  category_weight=5, complementary_weight=3, novelty_weight=1, discount_weight=2):
+    score = tiered_category_score(
+        user_index, codes, purchased_flags, top_flags, category_weight, complementary_weight, novelty_weight
+    )
+    score = score + np.where(healthy_users[user_index], healthy_index, 10 - healthy_index)
+    return score + discount_weight * (discount / 100)
+
+
+# Score of recommend_discounted_items
+def discount_scores(basic_needs_index, discount, healthy):
+    wanted = 10 if healthy else -1
+    return np.where(basic_needs_index == wanted, 5, 0) + np.minimum(4, discount // 10)
+
+
+# Final RelevanceScore of get_recommendations_for_person
+def relevance_scores(user_index, codes, healthy_index, discount, top_flags, purchased_flags, healthy_users):
+    score = tiered_category_score(user_index, codes, top_flags, purchased_flags, 5, 3, 1)
+    score = score + np.where(
+        healthy_users[user_index],
+        healthy_index,
+        np.where(healthy_index < 5, 10 - healthy_index, healthy_index * 0.5)
+    )
+    return score + discount / 10
+
+
+# Categories with the fewest products (value_counts().tail(n) order) from
+# per-category counts, with first_ids holding the position where each
+# counted category first appears
+def least_common_of_counts(counts, first_ids, n=5):
+    present = np.flatnonzero(counts)
+    present = present[np.argsort(first_ids[present], kind='stable')]
+    order = np.argsort(-counts[present], kind='stable')
+    return present[order][-n:]
+
+
+# Stable ordering of pairs by user, then by the given keys (descending when
+# the matching flag in descending is True)
+def order_by_user(user_index, keys, descending):
+    sort_keys = [-key if desc else key for key, desc in zip(keys, descending)]
+    return np.lexsort(sort_keys[::-1] + [user_index])
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time.
+
+    Callers that ask for a key while its computation is in flight wait for it
+    and share its result (or exception). Threads use do() and coroutines use
+    ado(); both go through the same map of futures, so a WSGI thread and an
+    ASGI coroutine asking for the same key also share one computation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    # (future, True) when the caller must run the computation, else (future, False)
+    def _join(self, key):
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def _finish(self, key, future, fn):
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def do(self, key, fn):
+        future, leader = self._join(key)
+        if leader:
+            self._finish(key, future, fn)
+        return future.result()
+
+    # Like do(), without blocking the event loop: the computation runs in a
+    # worker thread and waiters await the shared future.
+    async def ado(self, key, fn):
+        future, leader = self._join(key)
+        if leader:
+            await asyncio.to_thread(self._finish, key, future, fn)
+        return await asyncio.wrap_future(future)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
@@ -0,0 +1,353 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field, replace
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from django.conf import settings
+
+from . import metrics
+from .catalogue import Catalogue, build_catalogue
+from .data_processing import (
+    SPECIAL_ITEMS,
+    UserItemMatrix,
+    get_data_dir,
+    load_products,
+    load_purchases,
+)
+from .engines import RecommendationEngine, get_engine
+from .pools import CandidatePools, build_candidate_pools
+from .popularity import PopularityTables, build_popularity, cold_start_size
+from .profiles import build_user_profiles
+from .purchase_index import PurchaseIndex, build_purchase_index
+from .purchase_log import purchase_log_size
+from .model import (
+    CURRENT_FILE,
+    FORMAT_VERSION,
+    SimilarityModel,
+    current_generation,
+    fit_model,
+    get_model_dir,
+    load_model,
+    model_path,
+    read_model_meta,
+)
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_FILE = 'products.csv'
+PURCHASES_FILE = 'purchases.csv'
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Cleaned products/purchases frames plus the structures derived from them.
+
+    A snapshot is built once and shared by every request, so nothing reachable
+    from it may be modified in place. A change to the source files, or an
+    ingested batch of purchases, produces a new snapshot instead.
+    """
+    version: str
+    signature: tuple
+    built_at: float
+    products_df: pd.DataFrame
+    purchases_df: pd.DataFrame
+    catalogue: Catalogue
+    pools: CandidatePools  # ProductIds behind the pipeline's catalogue-wide filters
+    model: SimilarityModel
+    user_item_matrix: UserItemMatrix
+    model_product_codes: np.ndarray  # catalogue name code of each model column, -1 if not in the catalogue
+    item_neighbours: sp.csr_matrix
+    user_neighbours: sp.csr_matrix
+    user_profiles: dict
+    purchase_index: PurchaseIndex
+    popularity: PopularityTables  # cold-start rankings and recommendations
+    engine: RecommendationEngine  # step 1 of the pipeline, from RECOMMENDER_ENGINE
+    engine_state: object  # what engine derived from the model
+    product_names: tuple
+    catalogue_version: str  # content hash of the products file alone
+    model_generation: int = 0  # published model generation in use, 0 for a model fitted in-process
+    revision: int = 0  # ingested purchase batches applied on top of version
+    user_revisions: dict = field(default_factory=dict)  # PersonID -> label of their last ingested purchase
+    log_offset: int = 0  # bytes of the shared purchase log applied
+
+
+_lock = threading.Lock()
+_current = None
+_refresher = None
+_refresher_key = None
+_refresher_lock = threading.Lock()
+
+
+# (name, mtime, size) of every source file, plus the identity of the
+# published model pointer, cheap enough to check per request
+def _source_signature():
+    signature = []
+    for filename in (PRODUCTS_FILE, PURCHASES_FILE):
+        stat = os.stat(os.path.join(get_data_dir(), filename))
+        signature.append((filename, stat.st_mtime_ns, stat.st_size))
+    try:
+        stat = os.stat(os.path.join(get_model_dir(), CURRENT_FILE))
+        signature.append((CURRENT_FILE, stat.st_ino, stat.st_mtime_ns))
+    except FileNotFoundError:
+        signature.append((CURRENT_FILE, None, None))
+    return tuple(signature)
+
+
+# Content hash of the given data files
+def _files_hash(filenames):
+    digest = hashlib.sha1()
+    for filename in filenames:
+        with open(os.path.join(get_data_dir(), filename), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+# Content hash of the source files, used as the snapshot version
+def source_hash():
+    return _files_hash((PRODUCTS_FILE, PURCHASES_FILE))
+
+
+# Use the published model when it was fitted on these sources, else fit
+# in-process. Returns (model, generation), generation 0 for a model that is
+# not a published generation.
+def _load_or_fit_model(purchases_df, version):
+    current = current_generation()
+    generation, path = current if current is not None else (0, model_path())
+    meta = read_model_meta(path)
+    readable = meta is not None and meta.get('format_version') == FORMAT_VERSION
+    if readable and meta.get('data_version') == version:
+        return load_model(path), generation
+
+    # Workers that must not each fit their own copy keep serving the published one
+    if readable and not getattr(settings, 'RECOMMENDER_MODEL_FIT_IN_PROCESS', True):
+        logger.warning(
+            'Model artifact is stale (data %s, expected %s); serving it until a current one is published.',
+            meta.get('data_version'), version,
+        )
+        return load_model(path), generation
+
+    if meta is not None:
+        logger.warning(
+            'Model artifact is stale (data %s, expected %s); fitting in-process. '
+            'Run `manage.py recommender_model build` to refresh it.',
+            meta.get('data_version'), version,
+        )
+    return fit_model(purchases_df, version, engine=get_engine()), 0
+
+
+# engine's state for model: loaded from the arrays the model stores when this
+# engine configuration fitted them, else fitted now
+def _engine_state(engine, model, user_item_matrix):
+    if model.engine_arrays and model.engine == engine.config():
+        return engine.load_state(model.engine_arrays, user_item_matrix, model.item_neighbours)
+    return engine.fit(user_item_matrix, model.item_neighbours)
+
+
+# snapshot with its model fields taken from model
+def _with_model(snapshot, model, generation):
+    user_item_matrix = model.user_item_matrix()
+    return replace(
+        snapshot,
+        model=model,
+        user_item_matrix=user_item_matrix,
+        model_product_codes=snapshot.catalogue.name_codes_of(model.product_names),
+        item_neighbours=model.item_neighbours,
+        user_neighbours=model.user_neighbours,
+        engine_state=_engine_state(snapshot.engine, model, user_item_matrix),
+        model_generation=generation,
+    )
+
+
+# Move a snapshot whose sources are unchanged onto a newly published
+# generation fitted on them. A snapshot carrying ingested purchases is
+# rebuilt on it instead, and the purchase log replayed on top.
+def _refresh_model(snapshot):
+    current = current_generation()
+    if current is None or current[0] == snapshot.model_generation:
+        return snapshot
+
+    generation, path = current
+    meta = read_model_meta(path)
+    if meta is None or meta.get('format_version') != FORMAT_VERSION or meta.get('data_version') != snapshot.version:
+        return snapshot
+    if snapshot.revision:
+        return build_snapshot()
+    return _with_model(snapshot, load_model(path), generation)
+
+
+# Build a snapshot from the current source files
+def build_snapshot():
+    signature = _source_signature()
+    version = source_hash()
+
+    with metrics.stage('load_data'):
+        products_df = load_products(PRODUCTS_FILE)
+        purchases_df = load_purchases(PURCHASES_FILE)
+        catalogue = build_catalogue(products_df)
+    with metrics.stage('candidate_pools'):
+        pools = build_candidate_pools(catalogue, SPECIAL_ITEMS)
+    with metrics.stage('model'):
+        model, generation = _load_or_fit_model(purchases_df, version)
+        user_item_matrix = model.user_item_matrix()
+    with metrics.stage('engine'):
+        engine = get_engine()
+        engine_state = _engine_state(engine, model, user_item_matrix)
+    with metrics.stage('profiles'):
+        user_profiles = build_user_profiles(purchases_df, products_df)
+    with metrics.stage('purchase_index'):
+        purchase_index = build_purchase_index(purchases_df, products_df)
+    with metrics.stage('popularity'):
+        popularity = build_popularity(purchases_df, catalogue, user_profiles, size=cold_start_size())
+
+    return CatalogSnapshot(
+        version=version,
+        signature=signature,
+        built_at=time.time(),
+        products_df=products_df,
+        purchases_df=purchases_df,
+        catalogue=catalogue,
+        pools=pools,
+        model=model,
+        user_item_matrix=user_item_matrix,
+        model_product_codes=catalogue.name_codes_of(model.product_names),
+        item_neighbours=model.item_neighbours,
+        user_neighbours=model.user_neighbours,
+        user_profiles=user_profiles,
+        purchase_index=purchase_index,
+        popularity=popularity,
+        engine=engine,
+        engine_state=engine_state,
+        product_names=tuple(products_df['ProductName'].tolist()),
+        catalogue_version=_files_hash((PRODUCTS_FILE,)),
+        model_generation=generation,
+    )
+
+
+# Report the shape of a newly published snapshot's model
+def _publish_gauges(snapshot):
+    users, products = snapshot.user_item_matrix.matrix.shape
+    metrics.set_gauge('users', users)
+    metrics.set_gauge('products', products)
+    metrics.set_gauge('catalogue_products', len(snapshot.catalogue))
+    metrics.set_gauge('user_item_nnz', snapshot.user_item_matrix.matrix.nnz)
+    metrics.set_gauge('item_neighbours_nnz', snapshot.item_neighbours.nnz)
+    metrics.set_gauge('user_neighbours_nnz', snapshot.user_neighbours.nnz)
+    metrics.set_gauge('revision', snapshot.revision)
+    metrics.set_gauge('model_generation', snapshot.model_generation)
+
+
+# Whether snapshot reflects the source files, the published model and the
+# whole purchase log, cheap enough to check per request
+def _is_current(snapshot):
+    return (
+        snapshot is not None
+        and snapshot.signature == _source_signature()
+        and snapshot.log_offset == purchase_log_size()
+    )
+
+
+# Bring snapshot (None before the first build) up to date: rebuilt when the
+# sources changed or the purchase log was truncated, moved onto a newly
+# published generation when only that changed, then with the lines of the
+# purchase log it has not applied yet
+def _refreshed(snapshot):
+    from .ingest import apply_purchase_log
+
+    if snapshot is not None and purchase_log_size() < snapshot.log_offset:
+        snapshot = None
+    signature = _source_signature()
+    if snapshot is not None and snapshot.signature != signature:
+        if snapshot.version == source_hash():
+            # Touched but unchanged: keep the derived data, remember the new
+            # mtime, and pick up a model generation published for these sources
+            snapshot = _refresh_model(replace(snapshot, signature=signature))
+        else:
+            snapshot = None
+    if snapshot is None:
+        with metrics.stage('snapshot_build'):
+            snapshot = build_snapshot()
+    with metrics.stage('purchase_log'):
+        return apply_purchase_log(snapshot)
+
+
+# Return the shared snapshot, refreshing it when the source files, the
+# published model or the purchase log changed. Only the first build blocks
+# requests: with RECOMMENDER_REFRESH_IN_BACKGROUND, later refreshes run in a
+# background thread and the current snapshot is served until the new one is
+# swapped in.
+def get_snapshot():
+    snapshot = _current
+    if _is_current(snapshot):
+        return snapshot
+    if snapshot is not None and getattr(settings, 'RECOMMENDER_REFRESH_IN_BACKGROUND', True):
+        _refresh_in_background()
+        return snapshot
+    return refresh_snapshot()
+
+
+# Start a background refresh, one per state of the sources and the purchase
+# log: a refresh that fails is logged and not retried until they change again
+def _refresh_in_background():
+    global _refresher, _refresher_key
+
+    key = (_source_signature(), purchase_log_size())
+    with _refresher_lock:
+        if key == _refresher_key or (_refresher is not None and _refresher.is_alive()):
+            return
+        _refresher_key = key
+        _refresher = threading.Thread(target=_background_refresh, name='snapshot-refresh', daemon=True)
+        _refresher.start()
+
+
+def _background_refresh():
+    try:
+        refresh_snapshot()
+    except Exception:
+        logger.exception('Snapshot refresh failed; serving the previous snapshot.')
+
+
+# Bring the shared snapshot up to date now and return it
+def refresh_snapshot():
+    global _current
+
+    with _lock:
+        if not _is_current(_current):
+            _current = _refreshed(_current)
+            _publish_gauges(_current)
+        return _current
+
+
+# Whether this process has a snapshot, without building one
+def snapshot_loaded():
+    return _current is not None
+
+
+# Publish update(snapshot), a new snapshot derived from the current one.
+# Updates are serialised with refreshes so neither can overwrite the other.
+def update_snapshot(update):
+    global _current
+
+    with _lock:
+        snapshot = _current if _is_current(_current) else _refreshed(_current)
+        _current = update(snapshot)
+        _publish_gauges(_current)
+        return _current
+
+
+# Drop the shared snapshot so the next request rebuilds it, after any
+# background refresh has finished
+def reset_snapshot():
+    global _current, _refresher_key
+
+    refresher = _refresher
+    if refresher is not None:
+        refresher.join()
+    with _lock:
+        _current = None
+        _refresher_key = None
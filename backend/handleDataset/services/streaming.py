@@ -0,0 +1,142 @@
+import math
+from json.encoder import encode_basestring_ascii
+
+import numpy as np
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+# Streaming alternatives to JsonResponse for responses built around one long
+# list, opted into with ?stream=<format>:
+#
+#   ndjson  the response object without its list on the first line, then
+#           one list item per line
+#   json    the same object JsonResponse would send (compact separators, the
+#           list last), written item by item
+#
+# Items are encoded a column at a time, so numeric columns are converted with
+# one call each instead of walking every value through the JSON encoder.
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+# Rows encoded per step, and the response chunk size the pieces are joined to
+ROWS_PER_CHUNK = 1024
+BUFFER_SIZE = 64 * 1024
+
+_encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+
+# Requested stream format, None for a regular JsonResponse
+def stream_format(request):
+    fmt = request.GET.get('stream')
+    if fmt is None:
+        return None
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"stream must be one of {', '.join(STREAM_FORMATS)}")
+    return fmt
+
+
+# float as JsonResponse writes it, NaN and infinities included
+def _encode_float(value):
+    if math.isfinite(value):
+        return float.__repr__(value)
+    if value != value:
+        return 'NaN'
+    return 'Infinity' if value > 0 else '-Infinity'
+
+
+def _encode_value(value):
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        return _encode_float(value)
+    return _encoder.encode(value)
+
+
+# JSON text of each value of a column (an array or a list)
+def encode_column(values):
+    if isinstance(values, np.ndarray):
+        kind = values.dtype.kind
+        if kind == 'b':
+            return np.where(values, 'true', 'false').tolist()
+        if kind in 'iu':
+            return list(map(int.__repr__, values.tolist()))
+        if kind == 'f':
+            if np.isfinite(values).all():
+                return list(map(float.__repr__, values.tolist()))
+            return list(map(_encode_float, values.tolist()))
+        values = values.tolist()
+    return list(map(_encode_value, values))
+
+
+# JSON objects for the rows of named columns, ROWS_PER_CHUNK rows at a time
+def encode_rows(names, columns):
+    keys = [encode_basestring_ascii(str(name)) + ':' for name in names]
+    n_rows = len(columns[0]) if columns else 0
+    for start in range(0, n_rows, ROWS_PER_CHUNK):
+        encoded = [encode_column(column[start:start + ROWS_PER_CHUNK]) for column in columns]
+        for values in zip(*encoded):
+            yield '{' + ','.join(map(str.__add__, keys, values)) + '}'
+
+
+# JSON objects for a list of records; records sharing one key order (the
+# usual case) go through the column encoder
+def encode_records(records):
+    if not records:
+        return
+    names = list(records[0])
+    if all(list(record) == names for record in records):
+        yield from encode_rows(names, [[record[name] for record in records] for name in names])
+    else:
+        for record in records:
+            yield _encoder.encode(record)
+
+
+def _ndjson(envelope, items):
+    yield _encoder.encode(envelope) + '\n'
+    for item in items:
+        yield item + '\n'
+
+
+def _json_document(envelope, list_key, items):
+    head = _encoder.encode(envelope)[:-1]
+    yield head + (',' if envelope else '') + encode_basestring_ascii(list_key) + ':['
+    separator = ''
+    for item in items:
+        yield separator + item
+        separator = ','
+    yield ']}'
+
+
+# Text pieces joined into chunks of about BUFFER_SIZE bytes
+def _buffered(pieces):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+# Stream envelope plus items (encoded JSON objects, produced lazily) as
+# list_key of the response object, in format fmt
+def streaming_response(fmt, envelope, list_key, items, status=200):
+    if fmt == 'ndjson':
+        pieces = _ndjson(envelope, items)
+    else:
+        pieces = _json_document(envelope, list_key, items)
+    response = StreamingHttpResponse(_buffered(pieces), content_type=STREAM_FORMATS[fmt], status=status)
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Synthetic products.csv / purchases.csv pairs for load tests and benchmarks.
+#
+# Products are the seed catalogue (normally the shipped products.csv) followed
+# by variants of randomly chosen seed rows, so the category, health and
+# basic-needs mix stays realistic and the rules that name products
+# (Scutece, Absorbante, the Lapte subcategory limit) still fire.
+#
+# Purchases follow power laws: basket sizes are discrete Pareto, products are
+# drawn from a Zipf distribution over a random popularity order, and a share
+# of each shopper's basket comes from a favourite category. Repeated
+# (PersonID, ProductName) draws are dropped, like the shipped file which has
+# one row per pair. Purchases are generated in chunks of people, so memory
+# stays flat up to 10^6 people x 10^4 products.
+
+
+# Seed catalogue rows followed by n_products - len(seed) variants
+def generate_products(seed_products, n_products, rng):
+    seed = seed_products.reset_index(drop=True)
+    products = seed.iloc[:n_products]
+    extra = n_products - len(products)
+    if extra <= 0:
+        return products.copy()
+
+    variants = seed.iloc[rng.integers(len(seed), size=extra)].reset_index(drop=True)
+    variants['ProductName'] = [f'{name} #{i}' for i, name in enumerate(variants['ProductName'], start=1)]
+    prices = pd.to_numeric(variants['Price'].astype(str).str.replace(',', '.'), errors='coerce')
+    variants['Price'] = (prices * rng.uniform(0.7, 1.3, size=extra)).round(2)
+    if 'Discount' in seed.columns:
+        variants['Discount'] = rng.choice(seed['Discount'].to_numpy(), size=extra)
+    return pd.concat([products, variants], ignore_index=True)[list(seed.columns)]
+
+
+# Inverse-CDF sampler over items ranked by popularity (rank 1 most popular)
+class _ZipfSampler:
+    def __init__(self, items, alpha):
+        self.items = np.asarray(items)
+        self.cdf = np.cumsum(1.0 / np.arange(1, len(self.items) + 1) ** alpha)
+
+    def sample(self, rng, size):
+        ranks = np.searchsorted(self.cdf, rng.random(size) * self.cdf[-1], side='right')
+        return self.items[ranks.clip(max=len(self.items) - 1)]
+
+
+# Yield purchases frames for PersonIDs 1..n_users, chunk_size people at a time.
+# amounts is the pool Amount values are drawn from (the seed purchases' amounts).
+def generate_purchases(
+    products_df, n_users, rng, amounts=(1, 2, 3), basket_min=4, basket_alpha=2.5, max_basket=200,
+    popularity_alpha=1.0, affinity=0.5, chunk_size=100_000
+):
+    names = products_df['ProductName'].to_numpy(dtype=object)
+    categories = pd.factorize(products_df['Category'])[0]
+    amounts = np.asarray(amounts)
+
+    # One global popularity order; each category keeps it for its own products
+    order = rng.permutation(len(names))
+    overall = _ZipfSampler(order, popularity_alpha)
+    by_category = [
+        _ZipfSampler(order[categories[order] == c], popularity_alpha) for c in range(categories.max() + 1)
+    ]
+    category_weights = np.array([
+        (1.0 / (np.flatnonzero(categories[order] == c) + 1.0) ** popularity_alpha).sum()
+        for c in range(len(by_category))
+    ])
+    category_weights /= category_weights.sum()
+
+    for start in range(1, n_users + 1, chunk_size):
+        person_ids = np.arange(start, min(start + chunk_size, n_users + 1))
+        sizes = np.floor(basket_min * (1.0 - rng.random(len(person_ids))) ** (-1.0 / basket_alpha))
+        sizes = sizes.clip(max=max_basket).astype(np.int64)
+
+        buyers = np.repeat(person_ids, sizes)
+        favourites = np.repeat(rng.choice(len(by_category), size=len(person_ids), p=category_weights), sizes)
+        products = overall.sample(rng, len(buyers))
+        in_favourite = rng.random(len(buyers)) < affinity
+        for c, sampler in enumerate(by_category):
+            rows = np.flatnonzero(in_favourite & (favourites == c))
+            if len(rows) and len(sampler.items):
+                products[rows] = sampler.sample(rng, len(rows))
+
+        chunk = pd.DataFrame({
+            'PersonID': buyers,
+            'ProductName': names[products],
+            'Amount': rng.choice(amounts, size=len(buyers)),
+        })
+        yield chunk.drop_duplicates(['PersonID', 'ProductName'], ignore_index=True)
+
+
+# Write products.csv and purchases.csv for n_users x n_products into
+# output_dir, returning (products written, purchases written)
+def write_dataset(output_dir, n_users, n_products, seed_dir, random_seed=0, **options):
+    rng = np.random.default_rng(random_seed)
+    seed_products = pd.read_csv(os.path.join(seed_dir, 'products.csv'))
+    seed_purchases = pd.read_csv(os.path.join(seed_dir, 'purchases.csv'))
+    os.makedirs(output_dir, exist_ok=True)
+
+    products_df = generate_products(seed_products, n_products, rng)
+    products_df.to_csv(os.path.join(output_dir, 'products.csv'), index=False)
+
+    # Written beside the target and renamed, so readers never see half a file
+    path = os.path.join(output_dir, 'purchases.csv')
+    tmp_path = f'{path}.tmp'
+    n_purchases = 0
+    header = True
+    for chunk in generate_purchases(
+        products_df, n_users, rng, amounts=seed_purchases['Amount'].to_numpy(), **options
+    ):
+        chunk = chunk[list(seed_purchases.columns)]
+        chunk.to_csv(tmp_path, index=False, header=header, mode='w' if header else 'a')
+        header = False
+        n_purchases += len(chunk)
+    if header:
+        seed_purchases.iloc[:0].to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return len(products_df), n_purchases
@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Loading the catalogue snapshot before the first request, started from
+# HandledatasetConfig.ready() according to RECOMMENDER_WARM_UP:
+#
+#   'background'  load in a daemon thread; the process serves meanwhile and
+#                 the readiness endpoint answers 503 until it is done
+#   'blocking'    load inside ready(), before the server takes requests
+#                 (use with servers that fork workers after loading the app)
+#   None          load on first use
+#
+# The state is per process, like the snapshot it loads.
+
+PENDING, WARMING, READY, FAILED = 'pending', 'warming', 'ready', 'failed'
+
+_lock = threading.Lock()
+_state = {'status': PENDING, 'seconds': None, 'error': None}
+
+
+def warm_up_mode():
+    return getattr(settings, 'RECOMMENDER_WARM_UP', 'background')
+
+
+# Load the snapshot now, recording how long it took
+def warm_up():
+    from .snapshot import get_snapshot
+
+    with _lock:
+        if _state['status'] in (WARMING, READY):
+            return
+        _state.update(status=WARMING, error=None)
+
+    started = time.perf_counter()
+    try:
+        get_snapshot()
+    except Exception as e:
+        logger.exception('Recommender warm-up failed')
+        with _lock:
+            _state.update(status=FAILED, error=str(e))
+        return
+
+    seconds = time.perf_counter() - started
+    with _lock:
+        _state.update(status=READY, seconds=seconds)
+    metrics.set_gauge('warm_up_seconds', seconds)
+    logger.info('Recommender warmed up in %.2f s', seconds)
+
+
+def start_warm_up(mode=None):
+    mode = mode or warm_up_mode()
+    if mode == 'blocking':
+        warm_up()
+    elif mode == 'background':
+        threading.Thread(target=warm_up, name='recommender-warm-up', daemon=True).start()
+    elif mode:
+        raise ValueError(f"RECOMMENDER_WARM_UP must be 'background', 'blocking' or None, not {mode!r}")
+
+
+# Warm-up status, {'status', 'seconds', 'error'}. A process is ready once a
+# snapshot has been loaded, whatever the warm-up recorded: it may never have
+# started (RECOMMENDER_WARM_UP = None), failed before a request loaded the
+# snapshot, or be a forked worker that inherited WARMING.
+def readiness():
+    from .snapshot import snapshot_loaded
+
+    with _lock:
+        state = dict(_state)
+    if state['status'] != READY and snapshot_loaded():
+        state.update(status=READY, error=None)
+    return state
+
+
+# Back to PENDING, for tests
+def reset_warm_up():
+    with _lock:
+        _state.update(status=PENDING, seconds=None, error=None)
@@ -1,3 +1,1149 @@
-from django.test import TestCase
+import asyncio
+import dataclasses
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+
+from . import apps
+from .services import metrics, scoring, snapshot as catalog_snapshot, warmup
+from .services.cache import RecommendationCache, get_cache, get_cached_recommendations, recommendation_key, reset_cache
+from .services.data_processing import (
+    compute_item_similarity,
+    create_user_item_matrix,
+    get_recommendations_for_person,
+    get_user_preferences,
+    load_products,
+    popular_columns,
+    load_purchases,
+    recommend_products_for_user,
+    within_subcategory_limit,
+)
+from .services.catalogue import build_catalogue
+from .services.engines import ALSEngine, CosineEngine, get_engine, reset_engine
+from .services.ingest import ingest_purchases
+from .services.llm import reset_llm_backend
+from .services.model import fit_model, load_model, validate_model
+from .services.neighbours import _normalize_rows, _top_k_per_row, build_user_neighbours
+from .services.pools import NameSet, build_candidate_pools
+from .services.profiles import build_user_profiles
+from .services.popularity import build_popularity, cold_start_size
+from .services.purchase_index import build_purchase_index
+from .services.purchase_log import purchase_log_path
+from .services.recipes import RecipeCache, get_recipe_cache, reset_recipe_cache
+from .services.singleflight import SingleFlight
+from .services.streaming import encode_rows
+from .services.synthetic import write_dataset
+
+
+class DataDirTestCase(TestCase):
+    """Runs each test against a private copy of the CSV files."""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        for filename in ('products.csv', 'purchases.csv'):
+            shutil.copy(os.path.join(settings.RECOMMENDER_DATA_DIR, filename), self.data_dir)
+        self.settings_override = override_settings(
+            RECOMMENDER_DATA_DIR=self.data_dir,
+            RECOMMENDER_MODEL_DIR=os.path.join(self.data_dir, 'model'),
+            RECOMMENDER_COLUMNAR_DIR=os.path.join(self.data_dir, 'columnar'),
+            RECOMMENDER_REFRESH_IN_BACKGROUND=False,
+        )
+        self.settings_override.enable()
+        catalog_snapshot.reset_snapshot()
+        reset_cache()
+
+    def tearDown(self):
+        catalog_snapshot.reset_snapshot()
+        reset_cache()
+        self.settings_override.disable()
+        shutil.rmtree(self.data_dir)
+
+    def append_purchase(self, line):
+        with open(os.path.join(self.data_dir, 'purchases.csv'), 'a') as f:
+            f.write(line + '\n')
+
+
+class SnapshotTests(DataDirTestCase):
+    def test_snapshot_is_shared_until_sources_change(self):
+        first = catalog_snapshot.get_snapshot()
+        self.assertIs(catalog_snapshot.get_snapshot(), first)
+
+        self.append_purchase('1,Paine Alba,1')
+        second = catalog_snapshot.get_snapshot()
+        self.assertIsNot(second, first)
+        self.assertNotEqual(second.version, first.version)
+        self.assertEqual(len(second.purchases_df), len(first.purchases_df) + 1)
+
+    @override_settings(RECOMMENDER_REFRESH_IN_BACKGROUND=True)
+    def test_changed_sources_are_rebuilt_in_the_background(self):
+        first = catalog_snapshot.get_snapshot()
+        self.append_purchase('1,Paine Alba,1')
+
+        release = threading.Event()
+        build_snapshot = catalog_snapshot.build_snapshot
+
+        def blocked_build():
+            release.wait(10)
+            return build_snapshot()
+
+        with mock.patch('handleDataset.services.snapshot.build_snapshot', side_effect=blocked_build) as build:
+            for _ in range(3):
+                self.assertIs(catalog_snapshot.get_snapshot(), first)
+            release.set()
+            catalog_snapshot._refresher.join()
+        build.assert_called_once()
+        self.assertEqual(len(catalog_snapshot.get_snapshot().purchases_df), len(first.purchases_df) + 1)
+
+    @override_settings(RECOMMENDER_REFRESH_IN_BACKGROUND=True)
+    def test_failed_background_refresh_keeps_serving(self):
+        first = catalog_snapshot.get_snapshot()
+        self.append_purchase('1,Paine Alba,1')
+
+        with mock.patch('handleDataset.services.snapshot.build_snapshot', side_effect=OSError('broken')) as build:
+            with self.assertLogs('handleDataset.services.snapshot', 'ERROR'):
+                self.assertIs(catalog_snapshot.get_snapshot(), first)
+                catalog_snapshot._refresher.join()
+            self.assertIs(catalog_snapshot.get_snapshot(), first)
+        build.assert_called_once()
+
+    def test_touch_without_change_keeps_version(self):
+        first = catalog_snapshot.get_snapshot()
+        path = os.path.join(self.data_dir, 'purchases.csv')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        second = catalog_snapshot.get_snapshot()
+        self.assertEqual(second.version, first.version)
+        self.assertIs(second.item_neighbours, first.item_neighbours)
+
+
+class ModelArtifactTests(DataDirTestCase):
+    def test_built_artifact_is_memory_mapped_by_snapshot(self):
+        call_command('recommender_model', 'build', stdout=open(os.devnull, 'w'))
+        call_command('recommender_model', 'validate', stdout=open(os.devnull, 'w'))
+
+        snapshot = catalog_snapshot.get_snapshot()
+        self.assertFalse(snapshot.model.item_neighbours.data.flags.writeable)
+        self.assertEqual(validate_model(snapshot.model), [])
+
+    def test_inspect_reports_generation_and_staleness(self):
+        call_command('recommender_model', 'build', stdout=open(os.devnull, 'w'))
+        call_command('recommender_model', 'build', stdout=open(os.devnull, 'w'))
+        output = io.StringIO()
+        call_command('recommender_model', 'inspect', stdout=output)
+        self.assertIn('Generation:     2\n', output.getvalue())
+        self.assertIn(f'Data version:   {catalog_snapshot.source_hash()} (current)', output.getvalue())
+
+        self.append_purchase('1,Paine Alba,1')
+        output = io.StringIO()
+        path = os.path.join(self.data_dir, 'model', 'generations', '000001')
+        call_command('recommender_model', 'inspect', path=path, stdout=output)
+        self.assertNotIn('Generation:', output.getvalue())
+        self.assertIn(f'stale, sources are {catalog_snapshot.source_hash()}', output.getvalue())
+
+    def test_stale_artifact_is_ignored(self):
+        call_command('recommender_model', 'build', stdout=open(os.devnull, 'w'))
+        self.append_purchase('1,Paine Alba,1')
+
+        snapshot = catalog_snapshot.get_snapshot()
+        self.assertEqual(snapshot.model.data_version, snapshot.version)
+        self.assertNotEqual(load_model().data_version, snapshot.version)
+
+    def test_snapshot_switches_to_published_generations(self):
+        fitted = catalog_snapshot.get_snapshot()
+        self.assertEqual(fitted.model_generation, 0)
+
+        call_command('recommender_model', 'build', stdout=open(os.devnull, 'w'))
+        published = catalog_snapshot.get_snapshot()
+        self.assertEqual(published.model_generation, 1)
+        self.assertIs(published.purchase_index, fitted.purchase_index)
+        self.assertFalse(published.item_neighbours.data.flags.writeable)
+
+        for _ in range(3):
+            call_command('recommender_model', 'build', stdout=open(os.devnull, 'w'))
+        self.assertEqual(catalog_snapshot.get_snapshot().model_generation, 4)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.data_dir, 'model', 'generations'))), ['000002', '000003', '000004']
+        )
+
+    @override_settings(RECOMMENDER_MODEL_FIT_IN_PROCESS=False)
+    def test_stale_generation_is_served_instead_of_fitting(self):
+        call_command('recommender_model', 'build', stdout=open(os.devnull, 'w'))
+        self.append_purchase('1,Paine Alba,1')
+
+        with mock.patch('handleDataset.services.snapshot.fit_model', side_effect=AssertionError('fitted')):
+            snapshot = catalog_snapshot.get_snapshot()
+        self.assertEqual(snapshot.model_generation, 1)
+        self.assertNotEqual(snapshot.model.data_version, snapshot.version)
+        self.assertEqual(len(self.client.get('/api/data/', {'personId': 1, 'topN': 10}).json()['topRecommendations']), 10)
+
+
+class IngestTests(DataDirTestCase):
+    EVENTS = [(1, 'Paine Alba', 3), (1, 'Lapte Mega', 5), (999, 'Paine Alba', 2), (2, 'Produs Nou', 1)]
+
+    def test_incremental_update_matches_full_fit(self):
+        before = catalog_snapshot.get_snapshot()
+        after = ingest_purchases(self.EVENTS)
+        self.assertEqual(after.revision, before.revision + 1)
+        self.assertIs(catalog_snapshot.get_snapshot(), after)
+
+        expected = fit_model(after.purchases_df, 'full')
+        np.testing.assert_array_equal(after.model.person_ids, expected.person_ids)
+        np.testing.assert_array_equal(after.model.product_names, expected.product_names)
+        np.testing.assert_allclose(after.model.user_item.toarray(), expected.user_item.toarray())
+
+        # Every neighbour list touching an ingested product or buyer is exact
+        products = np.searchsorted(expected.product_names, ['Paine Alba', 'Lapte Mega', 'Produs Nou'])
+        np.testing.assert_allclose(
+            after.item_neighbours[products].toarray(), expected.item_neighbours[products].toarray()
+        )
+        users = np.searchsorted(expected.person_ids, [1, 2, 999])
+        np.testing.assert_allclose(
+            after.user_neighbours[users].toarray(), expected.user_neighbours[users].toarray()
+        )
+        self.assertEqual(
+            after.user_profiles[999], build_user_profiles(after.purchases_df, load_products())[999]
+        )
+
+    def test_incremental_tables_match_a_rebuild(self):
+        after = ingest_purchases(self.EVENTS)
+        index = build_purchase_index(after.purchases_df, after.products_df)
+        for person_id in (1, 2, 3, 999):
+            self.assertEqual(json.dumps(after.purchase_index.details(person_id)), json.dumps(index.details(person_id)))
+
+        popularity = build_popularity(after.purchases_df, after.catalogue, after.user_profiles, size=cold_start_size())
+        np.testing.assert_array_equal(after.popularity.overall, popularity.overall)
+        for segment, ranking in popularity.by_segment.items():
+            np.testing.assert_array_equal(after.popularity.by_segment[segment], ranking)
+        self.assertEqual(after.popularity.default_segment, popularity.default_segment)
+        self.assertEqual(after.popularity.default_profiles, popularity.default_profiles)
+        self.assertEqual(json.dumps(after.popularity.segment_records), json.dumps(popularity.segment_records))
+        self.assertEqual(json.dumps(after.popularity.category_records), json.dumps(popularity.category_records))
+
+    def test_other_workers_replay_the_log_without_refitting(self):
+        other = catalog_snapshot.get_snapshot()
+        after = ingest_purchases(self.EVENTS)
+
+        # Another worker still holds the snapshot from before the ingest
+        catalog_snapshot.reset_snapshot()
+        catalog_snapshot._current = other
+        with mock.patch('handleDataset.services.snapshot.build_snapshot', side_effect=AssertionError('rebuilt')), \
+                mock.patch('handleDataset.services.snapshot.fit_model', side_effect=AssertionError('fitted')):
+            replayed = catalog_snapshot.get_snapshot()
+        self.assertEqual(replayed.revision, 1)
+        self.assertIn(999, replayed.user_item_matrix)
+        self.assertEqual(replayed.purchase_index.details(999), after.purchase_index.details(999))
+        self.assertEqual(replayed.user_revisions, after.user_revisions)
+        self.assertEqual(replayed.log_offset, os.path.getsize(purchase_log_path()))
+
+    def test_ingested_purchases_match_a_rebuild(self):
+        response = self.client.post(
+            '/api/purchases/', {'purchases': [{'personId': 1, 'productName': 'Cheddar Cheese', 'amount': 2}]},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'ingested': 1, 'revision': 1})
+        with open(purchase_log_path()) as f:
+            self.assertEqual(f.read().splitlines()[-1], '1,Cheddar Cheese,2')
+
+        incremental = [self.client.get('/api/data/', {'personId': p, 'topN': 10}).json() for p in (1, 2)]
+        catalog_snapshot.reset_snapshot()
+        rebuilt = [self.client.get('/api/data/', {'personId': p, 'topN': 10}).json() for p in (1, 2)]
+        self.assertEqual(incremental, rebuilt)
+
+    def test_rejects_bad_body(self):
+        response = self.client.post('/api/purchases/', {'purchases': [{'personId': 'x'}]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class RecommendationCacheTests(DataDirTestCase):
+    def test_lru_evicts_oldest_and_expires(self):
+        cache = RecommendationCache(max_entries=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+        expired = RecommendationCache(ttl=0)
+        expired.set('a', 1)
+        self.assertIsNone(expired.get('a'))
+
+    def test_results_are_reused_until_the_person_buys(self):
+        first = get_cached_recommendations(1, top_n=10)
+        self.assertIs(get_cached_recommendations(1, top_n=10), first)
+        other = get_cached_recommendations(2, top_n=10)
+
+        ingest_purchases([(1, 'Paine Alba', 3)], persist=False)
+        snapshot = catalog_snapshot.get_snapshot()
+        self.assertIsNot(get_cached_recommendations(1, top_n=10), first)
+        self.assertIs(get_cached_recommendations(2, top_n=10), other)
+        self.assertNotEqual(recommendation_key(snapshot, 1, 10), recommendation_key(snapshot, 2, 10))
+
+    def test_new_model_generation_is_not_served_from_cache(self):
+        first = get_cached_recommendations(1, top_n=10)
+        call_command('recommender_model', 'build', stdout=open(os.devnull, 'w'))
+        self.assertEqual(catalog_snapshot.get_snapshot().model_generation, 1)
+
+        second = get_cached_recommendations(1, top_n=10)
+        self.assertIsNot(second, first)
+        self.assertNotEqual(second.etag, first.etag)
+
+    @override_settings(
+        CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        RECOMMENDER_CACHE_ALIAS='shared',
+    )
+    def test_shared_backend_serves_other_processes(self):
+        reset_cache()
+        first = get_cached_recommendations(1, top_n=10)
+        reset_cache()
+        self.assertEqual(len(get_cache()), 0)
+        self.assertEqual(get_cached_recommendations(1, top_n=10), first)
+
+    def test_concurrent_misses_compute_once(self):
+        snapshot = catalog_snapshot.get_snapshot()
+        compute = mock.Mock(side_effect=lambda *args, **kwargs: time.sleep(0.2) or [])
+        with mock.patch('handleDataset.services.cache.get_recommendations_for_person', compute):
+            threads = [
+                threading.Thread(target=get_cached_recommendations, args=(1,), kwargs={'snapshot': snapshot})
+                for _ in range(6)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(compute.call_count, 1)
+
+    def test_etag_revalidation(self):
+        response = self.client.get('/api/data/', {'personId': 1, 'topN': 10})
+        etag = response['ETag']
+        revalidated = self.client.get('/api/data/', {'personId': 1, 'topN': 10}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], etag)
+
+        other = self.client.get('/api/data/', {'personId': 1, 'topN': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(other.status_code, 200)
+
+
+class SingleFlightTests(TestCase):
+    def slow_counter(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return object()
+        return calls, compute
+
+    def test_threads_share_one_computation(self):
+        flights = SingleFlight()
+        calls, compute = self.slow_counter()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flights.do('k', compute))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({id(result) for result in results}), 1)
+        self.assertEqual(flights.in_flight(), 0)
+
+    def test_coroutines_and_threads_share_one_computation(self):
+        flights = SingleFlight()
+        calls, compute = self.slow_counter()
+
+        async def main():
+            thread_result = []
+            thread = threading.Thread(target=lambda: thread_result.append(flights.do('k', compute)))
+            results = asyncio.gather(*[flights.ado('k', compute) for _ in range(5)])
+            await asyncio.sleep(0.05)
+            thread.start()
+            results = await results
+            thread.join()
+            return results + thread_result
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({id(result) for result in results}), 1)
+
+    def test_errors_reach_every_waiter(self):
+        flights = SingleFlight()
+
+        def fail():
+            time.sleep(0.1)
+            raise ValueError('boom')
+
+        errors = []
+
+        def call():
+            try:
+                flights.do('k', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+
+
+@override_settings(RECIPE_LLM_BACKEND={'BACKEND': 'handleDataset.services.llm.EchoBackend'})
+class RecipeTests(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_llm_backend()
+        reset_recipe_cache()
+
+    def tearDown(self):
+        reset_llm_backend()
+        reset_recipe_cache()
+        super().tearDown()
+
+    async def test_recipe_as_json(self):
+        response = await self.async_client.get('/generate-recipe/', {'personId': 1})
+        self.assertEqual(response.status_code, 200)
+        recipe = response.json()['recipe']
+        self.assertTrue(recipe.startswith('Ești un bucătar'))
+        self.assertIn('Cheddar Cheese', recipe)
+
+    async def test_recipe_as_server_sent_events(self):
+        response = await self.async_client.get('/generate-recipe/', {'personId': 1}, headers={'Accept': 'text/event-stream'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+        events = [event.split('\n') for event in body.strip().split('\n\n')]
+
+        self.assertEqual(events[-1], ['event: done', 'data: {"personId": 1}'])
+        chunks = [json.loads(data[len('data: '):]) for kind, data in events[:-1] if kind == 'event: chunk']
+        self.assertEqual(len(chunks), len(events) - 1)
+        json_recipe = (await self.async_client.get('/generate-recipe/', {'personId': 1})).json()['recipe']
+        self.assertEqual(''.join(chunks), json_recipe)
+
+    async def test_repeated_recipes_come_from_the_cache(self):
+        first = (await self.async_client.get('/generate-recipe/', {'personId': 1})).json()['recipe']
+        self.assertEqual(len(get_recipe_cache()), 1)
+
+        with mock.patch('handleDataset.services.llm.EchoBackend.stream', side_effect=AssertionError):
+            response = await self.async_client.get('/generate-recipe/', {'personId': 1, 'stream': '1'})
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+        self.assertEqual(body.split('\n\n')[0], 'event: chunk\ndata: ' + json.dumps(first, ensure_ascii=False))
+
+
+class RecipeCacheTests(TestCase):
+    def test_key_ignores_order_and_catalogue_versions_are_separate(self):
+        cache = RecipeCache()
+        cache.set(['Lapte', 'Oua', 'Faina'], 'v1', 'clatite')
+        self.assertEqual(cache.get(['Faina', 'Oua', 'Lapte', 'Oua'], 'v1'), 'clatite')
+        self.assertIsNone(cache.get(['Faina', 'Oua', 'Lapte'], 'v2'))
+        self.assertIsNone(cache.get(['Faina', 'Oua'], 'v1'))
+
+    def test_near_duplicates_and_eviction(self):
+        cache = RecipeCache(max_entries=2, similarity_threshold=0.75)
+        cache.set(['a', 'b', 'c', 'd'], 'v1', 'abcd')
+        cache.set(['a', 'b', 'x', 'y'], 'v1', 'abxy')
+        self.assertEqual(cache.get(['a', 'b', 'c', 'd', 'e'], 'v1'), 'abcd')  # 4/5
+        self.assertIsNone(cache.get(['a', 'b', 'c', 'x'], 'v1'))  # 3/5 at best
+
+        cache.set(['p', 'q'], 'v1', 'pq')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(['a', 'b', 'x', 'y'], 'v1'))
+        self.assertEqual(cache.get(['a', 'b', 'c', 'd'], 'v1'), 'abcd')
+
+
+class MetricsTests(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+
+    def test_stages_are_exported_in_prometheus_format(self):
+        self.client.get('/api/data/', {'personId': 1, 'topN': 10})
+        text = self.client.get('/metrics/').content.decode()
+        for stage in ('snapshot_build', 'user_item_matrix', 'refine', 'relevance_ranking', 'data_api'):
+            self.assertIn(f'recommender_stage_seconds_count{{stage="{stage}"}} 1', text)
+        self.assertIn('recommender_stage_seconds_bucket{stage="refine",le="+Inf"} 1', text)
+        self.assertIn('recommender_items_count{name="final_candidates"} 1', text)
+        self.assertIn('recommender_model{name="users"}', text)
+
+    def test_disabled_metrics_record_nothing(self):
+        with self.settings(RECOMMENDER_METRICS=False):
+            self.assertIs(metrics.stage('refine'), metrics.stage('relevance_ranking'))
+            self.client.get('/api/data/', {'personId': 1, 'topN': 10})
+        self.assertNotIn('stage=', metrics.registry.render())
+
+    @override_settings(RECOMMENDER_DEBUG_REQUESTS=True, RECOMMENDER_METRICS=False)
+    def test_debug_timings_and_profile(self):
+        plain = self.client.get('/api/data/', {'personId': 1, 'topN': 10}).json()
+        data = self.client.get('/api/data/', {'personId': 1, 'topN': 10, 'debug': 'timings'}).json()
+        self.assertEqual(data['topRecommendations'], plain['topRecommendations'])
+        self.assertLessEqual({'refine', 'user_similarity', 'enrichment'}, set(data['timings']))
+        self.assertEqual(data['sizes']['initial_candidates'], 20)
+
+        profiled = self.client.get('/api/data/', {'personId': 1, 'topN': 10, 'debug': 'profile'}).json()
+        self.assertIn('profile', profiled)
+
+    def test_debug_requires_opt_in(self):
+        with self.settings(RECOMMENDER_DEBUG_REQUESTS=False):
+            data = self.client.get('/api/data/', {'personId': 1, 'topN': 10, 'debug': 'timings'}).json()
+        self.assertNotIn('timings', data)
+
+    def test_sampling_profiler_sees_the_running_function(self):
+        def busy():
+            end = time.perf_counter() + 0.05
+            while time.perf_counter() < end:
+                pass
+
+        with metrics.SamplingProfiler(interval=0.001) as profiler:
+            busy()
+        report = profiler.report()
+        self.assertTrue(report)
+        self.assertIn('busy (tests.py', report[0]['stack'].split(';')[-1])
+
+
+class WarmUpTests(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        warmup.reset_warm_up()
+
+    def tearDown(self):
+        warmup.reset_warm_up()
+        super().tearDown()
+
+    def test_ready_after_warm_up(self):
+        warmup.start_warm_up('blocking')
+        self.assertTrue(catalog_snapshot.snapshot_loaded())
+        response = self.client.get('/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'ready')
+        self.assertGreater(response.json()['warmUpSeconds'], 0)
+
+    def test_failed_warm_up_is_not_ready(self):
+        with mock.patch('handleDataset.services.snapshot.get_snapshot', side_effect=OSError('no data')):
+            with self.assertLogs('handleDataset.services.warmup', 'ERROR'):
+                warmup.warm_up()
+        with mock.patch('handleDataset.views.start_warm_up') as start:
+            response = self.client.get('/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'status': 'failed', 'warmUpSeconds': None, 'error': 'no data'})
+        start.assert_called_once_with('background')
+
+    def test_ready_once_serving_after_a_failed_warm_up(self):
+        with mock.patch('handleDataset.services.snapshot.get_snapshot', side_effect=OSError('no data')):
+            with self.assertLogs('handleDataset.services.warmup', 'ERROR'):
+                warmup.warm_up()
+        self.assertEqual(self.client.get('/api/data/', {'personId': 1}).status_code, 200)
+
+        with mock.patch('handleDataset.views.start_warm_up') as start:
+            response = self.client.get('/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'ready')
+        self.assertNotIn('error', response.json())
+        start.assert_not_called()
+
+    def test_probe_retries_a_failed_warm_up(self):
+        with mock.patch('handleDataset.services.snapshot.get_snapshot', side_effect=OSError('no data')):
+            with self.assertLogs('handleDataset.services.warmup', 'ERROR'):
+                warmup.warm_up()
+        with mock.patch('handleDataset.views.start_warm_up', side_effect=lambda mode: warmup.warm_up()):
+            response = self.client.get('/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.json()['warmUpSeconds'], 0)
+
+    def test_probe_starts_a_pending_warm_up(self):
+        with mock.patch('handleDataset.views.start_warm_up') as start:
+            response = self.client.get('/ready/')
+        self.assertEqual(response.status_code, 503)
+        start.assert_called_once_with('background')
+
+        self.client.get('/api/data/', {'personId': 1})
+        self.assertEqual(self.client.get('/ready/').status_code, 200)
+
+    def test_only_servers_warm_up(self):
+        for argv, environ, serving in (
+            (['gunicorn', 'api.wsgi'], {'RECOMMENDER_SERVING': '1'}, True),
+            (['gunicorn', 'api.wsgi'], {'RECOMMENDER_SERVING': '0'}, False),
+            (['celery', 'worker'], {}, False),
+            (['-c'], {}, False),
+            (['python -m pytest'], {}, False),
+            (['manage.py', 'migrate'], {}, False),
+            (['manage.py', 'runserver'], {}, False),
+            (['manage.py', 'runserver'], {'RUN_MAIN': 'true'}, True),
+            (['manage.py', 'runserver', '--noreload'], {}, True),
+        ):
+            with mock.patch.object(sys, 'argv', argv), mock.patch.dict(os.environ, environ):
+                for name in {'RUN_MAIN', 'RECOMMENDER_SERVING'} - set(environ):
+                    os.environ.pop(name, None)
+                self.assertEqual(apps._serving(), serving, argv)
+
+    def test_heavy_modules_stay_unimported(self):
+        script = (
+            "import os, sys; os.environ['DJANGO_SETTINGS_MODULE'] = 'api.settings'\n"
+            "from django.conf import settings; settings.RECOMMENDER_WARM_UP = None\n"
+            "import django; django.setup(); import api.urls\n"
+            "print(sorted(m for m in ('sklearn', 'google.generativeai', 'dotenv') if m in sys.modules))"
+        )
+        completed = subprocess.run(
+            [sys.executable, '-c', script], capture_output=True, text=True, cwd=str(settings.BASE_DIR), check=True
+        )
+        self.assertEqual(completed.stdout.strip(), '[]')
+
+
+class ColdStartTests(DataDirTestCase):
+    def test_unknown_person_gets_popular_products(self):
+        response = self.client.get('/api/data/', {'personId': 999999, 'topN': 10})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['coldStart'])
+        names = [item['name'] for item in data['topRecommendations']]
+        self.assertEqual(len(names), 10)
+        self.assertEqual(len(set(names)), 10)
+        self.assertFalse({'Scutece', 'Absorbante'} & set(names))
+
+        products = load_products().set_index('ProductName')
+        self.assertLessEqual((products.loc[names, 'Subcategory'] == 'Lapte').sum(), 1)
+        self.assertNotIn('coldStart', self.client.get('/api/data/', {'personId': 1}).json())
+
+    def test_segment_and_category_lookups(self):
+        category = self.client.get('/api/data/', {'personId': 999999, 'category': 'Lactate'}).json()
+        products = load_products().set_index('ProductName')
+        self.assertTrue((products.loc[[item['name'] for item in category['topRecommendations']], 'Category'] == 'Lactate').all())
+
+        healthy = self.client.get('/api/data/', {'personId': 999999, 'segment': 'healthy'}).json()
+        self.assertEqual(len(healthy['topRecommendations']), 10)
+        for params in ({'segment': 'vegan'}, {'category': 'Nothing'}):
+            self.assertEqual(self.client.get('/api/data/', {'personId': 999999, **params}).status_code, 400)
+
+    def test_rankings_follow_distinct_buyers(self):
+        snapshot = catalog_snapshot.get_snapshot()
+        buyers = snapshot.purchases_df.drop_duplicates(['PersonID', 'ProductName'])['ProductName'].value_counts()
+        overall = snapshot.catalogue.product_names[snapshot.popularity.overall]
+        self.assertEqual(buyers[overall[0]], buyers.max())
+        self.assertEqual(len(overall), len(snapshot.catalogue.names))
+        self.assertTrue(all(buyers.get(a, 0) >= buyers.get(b, 0) for a, b in zip(overall, overall[1:])))
+
+    def test_ingested_shopper_leaves_cold_start(self):
+        self.assertTrue(self.client.get('/api/data/', {'personId': 999}).json()['coldStart'])
+        snapshot = ingest_purchases([(999, 'Paine Alba', 2)], persist=False)
+        np.testing.assert_array_equal(snapshot.engine_state.popular, popular_columns(snapshot.item_neighbours))
+        self.assertNotIn('coldStart', self.client.get('/api/data/', {'personId': 999}).json())
+
+
+@override_settings(RECOMMENDER_ENGINE={'BACKEND': 'handleDataset.services.engines.ALSEngine', 'OPTIONS': {}})
+class EngineTests(DataDirTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_engine()
+
+    def tearDown(self):
+        super().tearDown()
+        reset_engine()
+
+    def test_engine_follows_setting(self):
+        snapshot = catalog_snapshot.get_snapshot()
+        self.assertIsInstance(snapshot.engine, ALSEngine)
+        with self.settings(RECOMMENDER_ENGINE={'BACKEND': 'handleDataset.services.engines.CosineEngine'}):
+            reset_engine()
+            self.assertIsInstance(get_engine(), CosineEngine)
+
+        person_id = int(snapshot.user_item_matrix.person_ids[0])
+        response = self.client.get('/api/data/', {'personId': person_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['topRecommendations']), 10)
+
+    def test_factors_separate_purchase_groups(self):
+        # Two groups of shoppers buying from two disjoint sets of products
+        rows = [(person, f'A{product}', 1) for person in range(20) for product in range(5) if (person + product) % 5]
+        rows += [(person, f'B{product}', 1) for person in range(20, 40) for product in range(5) if (person + product) % 5]
+        user_item_matrix = create_user_item_matrix(pd.DataFrame(rows, columns=['PersonID', 'ProductName', 'Amount']))
+
+        engine = ALSEngine(factors=4, regularization=0.1)
+        state = engine.fit(user_item_matrix, None)
+        unknown, first, second = engine.recommend_columns(state, user_item_matrix, [-1, 0, 20], top_n=1)
+        self.assertEqual(len(unknown), 0)
+        self.assertEqual(user_item_matrix.product_names[first].tolist(), ['A0'])
+        self.assertEqual(user_item_matrix.product_names[second].tolist(), ['B0'])
+
+    def test_ingest_folds_in_new_people_and_products(self):
+        catalog_snapshot.get_snapshot()
+        snapshot = ingest_purchases([(999, 'Paine Alba', 2), (1, 'Produs Nou', 1)], persist=False)
+        state = snapshot.engine_state
+        self.assertEqual(len(state.user_factors), len(snapshot.user_item_matrix.person_ids))
+        self.assertEqual(len(state.item_factors), len(snapshot.user_item_matrix.product_names))
+        self.assertTrue(state.user_factors[snapshot.user_item_matrix.user_position(999)].any())
+        self.assertTrue(state.item_factors[np.searchsorted(state.product_names, 'Produs Nou')].any())
+
+        columns = snapshot.engine.recommend_columns(state, snapshot.user_item_matrix, [999], top_n=20)[0]
+        self.assertEqual(len(columns), 20)
+        self.assertNotIn('Paine Alba', snapshot.user_item_matrix.product_names[columns])
+
+    def test_published_model_carries_the_factors(self):
+        call_command('recommender_model', 'build', stdout=open(os.devnull, 'w'))
+        with mock.patch.object(ALSEngine, 'fit', side_effect=AssertionError('fitted')):
+            snapshot = catalog_snapshot.get_snapshot()
+        self.assertFalse(snapshot.engine_state.user_factors.flags.writeable)
+        fitted = ALSEngine().fit(snapshot.user_item_matrix, None)
+        np.testing.assert_array_equal(snapshot.engine_state.user_factors, fitted.user_factors)
+        np.testing.assert_array_equal(snapshot.engine_state.item_factors, fitted.item_factors)
+
+        call_command('recommender_model', 'build', stdout=open(os.devnull, 'w'))
+        with mock.patch.object(ALSEngine, 'fit', side_effect=AssertionError('fitted')):
+            self.assertEqual(catalog_snapshot.get_snapshot().model_generation, 2)
+
+    def test_compare_engines_reports_both(self):
+        output = os.path.join(self.data_dir, 'engines.json')
+        call_command('compare_engines', users=300, products=100, people=5, output=output, stdout=open(os.devnull, 'w'))
+        with open(output) as f:
+            results = json.load(f)
+        self.assertEqual(set(results['engines']), {'cosine', 'als'})
+        self.assertGreater(results['split']['held_out_products'], 0)
+        for engine in results['engines'].values():
+            self.assertTrue(0 <= engine['recall'] <= engine['hit_rate'] <= 1)
+
+
+class ColumnarStoreTests(DataDirTestCase):
+    def test_converted_tables_match_csv_and_go_stale(self):
+        call_command('convert_data', stdout=open(os.devnull, 'w'))
+
+        pd.testing.assert_frame_equal(load_products(), load_products(use_columnar=False))
+        pd.testing.assert_frame_equal(load_purchases(), load_purchases(use_columnar=False))
+        self.assertFalse(load_purchases()['Amount'].to_numpy().flags.writeable)
+
+        projected = load_purchases(columns=['PersonID', 'Amount'])
+        self.assertEqual(projected.columns.tolist(), ['PersonID', 'Amount'])
+
+        self.append_purchase('1,Paine Alba,1')
+        self.assertEqual(len(load_purchases()), len(load_purchases(use_columnar=False)))
+
+    def test_snapshot_from_columnar_store(self):
+        expected = self.client.get('/api/data/', {'personId': 1, 'topN': 10}).json()
+        call_command('convert_data', stdout=open(os.devnull, 'w'))
+        catalog_snapshot.reset_snapshot()
+        reset_cache()
+        self.assertEqual(self.client.get('/api/data/', {'personId': 1, 'topN': 10}).json(), expected)
+
+
+class SyntheticDataTests(DataDirTestCase):
+    def test_generated_files_keep_the_schema_and_feed_the_pipeline(self):
+        output_dir = os.path.join(self.data_dir, 'synthetic')
+        n_products, n_purchases = write_dataset(output_dir, 500, 300, seed_dir=self.data_dir, random_seed=1)
+
+        seed = pd.read_csv(os.path.join(self.data_dir, 'products.csv'))
+        products = pd.read_csv(os.path.join(output_dir, 'products.csv'))
+        purchases = pd.read_csv(os.path.join(output_dir, 'purchases.csv'))
+        self.assertEqual(list(products.columns), list(seed.columns))
+        self.assertEqual(list(purchases.columns), ['PersonID', 'ProductName', 'Amount'])
+        self.assertEqual((len(products), len(purchases)), (n_products, n_purchases))
+        self.assertTrue(products['ProductName'].is_unique)
+        self.assertEqual(products['ProductName'][:len(seed)].tolist(), seed['ProductName'].tolist())
+        self.assertTrue(purchases['ProductName'].isin(products['ProductName']).all())
+        self.assertFalse(purchases.duplicated(['PersonID', 'ProductName']).any())
+        self.assertEqual(purchases['PersonID'].nunique(), 500)
+
+        # Power law: the most popular tenth of the products covers most purchases
+        counts = purchases['ProductName'].value_counts()
+        self.assertGreater(counts.iloc[:30].sum() / len(purchases), 0.4)
+
+        # Same seed, same files
+        again = os.path.join(self.data_dir, 'again')
+        write_dataset(again, 500, 300, seed_dir=self.data_dir, random_seed=1)
+        pd.testing.assert_frame_equal(pd.read_csv(os.path.join(again, 'purchases.csv')), purchases)
+
+        with self.settings(RECOMMENDER_DATA_DIR=output_dir):
+            catalog_snapshot.reset_snapshot()
+            self.assertEqual(len(get_recommendations_for_person(int(purchases['PersonID'][0]), top_n=10)), 10)
+
+    def test_benchmark_records_every_stage(self):
+        output = os.path.join(self.data_dir, 'benchmark.json')
+        call_command(
+            'benchmark', users=200, products=150, repeat=1, people=5, requests=4, concurrency=2, startup_runs=1,
+            output=output, stdout=open(os.devnull, 'w'),
+        )
+        with open(output) as f:
+            results = json.load(f)
+        self.assertEqual(set(results['timings']), {
+            'create_user_item_matrix', 'compute_item_similarity', 'build_snapshot', 'recommend_products_for_user',
+            'recommend_similarity_products', 'get_recommendations_for_person',
+        })
+        self.assertEqual(set(results['views']), {'data_api', 'purchase_details_api', 'generate_recipe'})
+        self.assertEqual(results['dataset']['users'], 200)
+        self.assertTrue(all(view['errors'] == 0 for view in results['views'].values()))
+        self.assertEqual(set(results['startup']), {
+            'startup_lazy', 'first_request_lazy', 'startup_blocking', 'first_request_blocking',
+        })
+
+
+class GenerateCatalogsTests(DataDirTestCase):
+    def test_writes_chunks_and_resumes(self):
+        output_dir = os.path.join(self.data_dir, 'catalogs')
+        call_command('generate_catalogs', output_dir, chunk_size=25, workers=1, stdout=open(os.devnull, 'w'))
+        os.remove(os.path.join(output_dir, 'catalogs-00001.jsonl'))
+        call_command('generate_catalogs', output_dir, chunk_size=25, workers=1, stdout=open(os.devnull, 'w'))
+
+        lines = []
+        for filename in sorted(os.listdir(output_dir)):
+            if filename.endswith('.jsonl'):
+                with open(os.path.join(output_dir, filename)) as f:
+                    lines.extend(json.loads(line) for line in f)
+        self.assertEqual(len(lines), len(catalog_snapshot.get_snapshot().user_item_matrix.person_ids))
+        self.assertEqual(lines[0]['personId'], 1)
+
+    def test_model_is_rebuilt_for_another_format_or_engine(self):
+        from .management.commands.generate_catalogs import Command as GenerateCatalogs
+
+        call_command('recommender_model', 'build', stdout=io.StringIO())
+        command = GenerateCatalogs(stdout=io.StringIO())
+        command.ensure_model()
+        self.assertEqual(catalog_snapshot.current_generation()[0], 1)
+
+        with mock.patch('handleDataset.management.commands.generate_catalogs.FORMAT_VERSION', 0):
+            command.ensure_model()
+        self.assertEqual(catalog_snapshot.current_generation()[0], 2)
+
+        als = {'BACKEND': 'handleDataset.services.engines.ALSEngine', 'OPTIONS': {}}
+        with self.settings(RECOMMENDER_ENGINE=als):
+            reset_engine()
+            try:
+                command.ensure_model()
+                self.assertEqual(catalog_snapshot.current_generation()[0], 3)
+                self.assertEqual(catalog_snapshot.read_model_meta()['engine'], get_engine().config())
+            finally:
+                reset_engine()
+
+    def test_parquet_needs_an_engine(self):
+        output_dir = os.path.join(self.data_dir, 'catalogs')
+        with mock.patch('importlib.util.find_spec', return_value=None):
+            with self.assertRaisesMessage(CommandError, 'pyarrow'):
+                call_command('generate_catalogs', output_dir, format='parquet', stdout=io.StringIO())
+        self.assertFalse(os.path.exists(output_dir))
+
+
+class UserItemMatrixTests(TestCase):
+    def test_sparse_matrix_matches_pivot_table(self):
+        purchases_df = load_purchases()
+        purchases_df = pd.concat([purchases_df, purchases_df.head(3).assign(Amount=7)])
+        expected = purchases_df.pivot_table(index='PersonID', columns='ProductName', values='Amount', fill_value=0)
+
+        user_item_matrix = create_user_item_matrix(purchases_df)
+        self.assertEqual(user_item_matrix.person_ids.tolist(), expected.index.tolist())
+        self.assertEqual(user_item_matrix.product_names.tolist(), expected.columns.tolist())
+        np.testing.assert_allclose(user_item_matrix.matrix.toarray(), expected.to_numpy())
+        self.assertNotIn(-1, user_item_matrix)
+
+
+class ItemScoringTests(TestCase):
+    def test_truncated_neighbours_match_dense_scoring(self):
+        user_item_matrix = create_user_item_matrix(load_purchases())
+        item_neighbours = compute_item_similarity(user_item_matrix, top_m=1000)
+        dense = user_item_matrix.matrix.toarray()
+        similarity = cosine_similarity(dense.T)
+
+        for pos, person_id in enumerate(user_item_matrix.person_ids[:20]):
+            scores = pd.Series(dense[pos] @ similarity, index=user_item_matrix.product_names)
+            scores = scores[dense[pos] == 0]
+            expected = scores.sort_values(ascending=False, kind='stable').head(15).index.tolist()
+            self.assertEqual(
+                recommend_products_for_user(person_id, user_item_matrix, item_neighbours, top_n=15), expected
+            )
+
+    def test_neighbour_lists_are_truncated(self):
+        user_item_matrix = create_user_item_matrix(load_purchases())
+        item_neighbours = compute_item_similarity(user_item_matrix, top_m=3)
+        self.assertLessEqual(item_neighbours.getnnz(axis=1).max(), 3)
+        self.assertEqual(
+            len(recommend_products_for_user(1, user_item_matrix, item_neighbours, top_n=30)), 30
+        )
+
+
+class CatalogueTests(TestCase):
+    def test_name_masks_match_isin(self):
+        products_df = load_products()
+        products_df = pd.concat([products_df, products_df.head(2)], ignore_index=True)
+        catalogue = build_catalogue(products_df)
+
+        names = ['Lapte Mega', products_df['ProductName'].iloc[1], 'Nu exista']
+        np.testing.assert_array_equal(catalogue.mask_of_names(names), products_df['ProductName'].isin(names).to_numpy())
+        self.assertEqual(len(catalogue.names), len(products_df) - 2)
+        self.assertEqual(catalogue.image_urls[0], f"/{products_df['ProductName'].iloc[0].replace(',', '').replace('/', '')}.png")
+
+    def test_subcategory_limit_matches_groupby(self):
+        products_df = load_products()
+        subcategory = products_df['Subcategory'].astype(object)
+        subcategory.iloc[::7] = np.nan
+        products_df['Subcategory'] = subcategory.astype('category')
+        catalogue = build_catalogue(products_df)
+
+        ids = np.union1d(np.flatnonzero(subcategory.isna() | (subcategory == 'Lapte')), np.arange(0, len(products_df), 3))
+        expected = products_df.iloc[ids].groupby('Subcategory').apply(
+            lambda group: group.head(1) if group.name == 'Lapte' else group
+        )['ProductName']
+        kept = ids[within_subcategory_limit(catalogue, ids)]
+        self.assertEqual(sorted(products_df['ProductName'].iloc[kept]), sorted(expected))
+
+
+class CandidatePoolTests(TestCase):
+    def test_pools_match_catalogue_masks(self):
+        products_df = load_products()
+        products_df = pd.concat([products_df, products_df.head(3)], ignore_index=True)
+        catalogue = build_catalogue(products_df)
+        pools = build_candidate_pools(catalogue, ['Scutece', 'Absorbante', 'Nu exista'])
+
+        np.testing.assert_array_equal(pools.healthy, np.flatnonzero(catalogue.healthy_index > 5))
+        np.testing.assert_array_equal(pools.special_codes, catalogue.name_codes_of(['Scutece', 'Absorbante']))
+        codes = catalogue.name_codes_of(products_df['ProductName'].iloc[[0, 5, 1]].tolist() + ['Nu exista'])
+        np.testing.assert_array_equal(pools.ids_of_codes(codes), np.flatnonzero(catalogue.mask_of_codes(codes)))
+        wanted = catalogue.category_codes_of(['Lactate', 'Igiena', 'Nu exista'])
+        np.testing.assert_array_equal(
+            pools.basic_needs_in(wanted),
+            np.flatnonzero((catalogue.basic_needs_index == 10) & np.isin(catalogue.category_codes, wanted)),
+        )
+
+        taken = NameSet(len(catalogue.names))
+        taken.add(catalogue.name_codes[pools.unhealthy[:40:3]])
+        free = ~taken.contains(catalogue.name_codes)
+        for n in (1, 6, len(catalogue)):
+            np.testing.assert_array_equal(
+                taken.first_free(pools.unhealthy, catalogue.name_codes, n), pools.unhealthy[free[pools.unhealthy]][:n]
+            )
+
+        # Category counts of the untaken products, ordered by first appearance
+        codes = catalogue.category_codes[free]
+        counts = np.bincount(codes, minlength=len(catalogue.categories))
+        first_ids = np.zeros(len(counts), dtype=np.intp)
+        first_ids[codes[::-1]] = np.flatnonzero(free)[::-1]
+        categories = np.asarray(catalogue.categories)
+        self.assertEqual(
+            categories[scoring.least_common_of_counts(counts, first_ids, 5)].tolist(),
+            pd.Series(categories[codes]).value_counts().tail(5).index.tolist(),
+        )
+
+
+class ScoringTests(TestCase):
+    def test_least_common_of_counts_follow_value_counts(self):
+        products_df = load_products()
+        for start in range(0, 60, 10):
+            frame = products_df.iloc[start:]
+            expected = frame['Category'].astype(str).value_counts().tail(5).index.tolist()
+            codes = frame['Category'].cat.codes.to_numpy()
+            codes = codes[codes >= 0]
+            counts = np.bincount(codes, minlength=len(frame['Category'].cat.categories))
+            first_ids = np.zeros(len(counts), dtype=np.intp)
+            first_ids[codes[::-1]] = np.arange(len(codes))[::-1]
+            codes = scoring.least_common_of_counts(counts, first_ids, 5)
+            self.assertEqual(frame['Category'].cat.categories[codes].tolist(), expected)
+
+    def test_batch_relevance_matches_per_user_scoring(self):
+        categories = pd.Index(['A', 'B', 'C'])
+        codes = np.array([0, 1, 2, 0, 1, 2])
+        healthy_index = np.array([2, 6, 9, 2, 6, 9])
+        discount = np.array([0, 10, 20, 0, 10, 20])
+        profiles = [(['A'], ['A', 'B'], True), (['C'], ['C'], False)]
+
+        batch = scoring.relevance_scores(
+            np.repeat([0, 1], 3), codes, healthy_index, discount,
+            top_flags=scoring.category_flags(categories, [p[0] for p in profiles]),
+            purchased_flags=scoring.category_flags(categories, [p[1] for p in profiles]),
+            healthy_users=np.array([p[2] for p in profiles]),
+        )
+        np.testing.assert_allclose(batch, [7, 10, 12, 9, 5, 11.5])
+
+
+class UserProfileTests(TestCase):
+    def test_profiles_match_get_user_preferences(self):
+        purchases_df, products_df = load_purchases(), load_products()
+        profiles = build_user_profiles(purchases_df, products_df)
+
+        self.assertEqual(sorted(profiles), sorted(purchases_df['PersonID'].unique()))
+        for person_id, profile in profiles.items():
+            avg_healthy, top_categories, purchased_categories = get_user_preferences(
+                person_id, purchases_df, products_df
+            )
+            self.assertAlmostEqual(profile.avg_healthy, avg_healthy)
+            self.assertEqual(profile.top_categories, top_categories)
+            self.assertEqual(profile.purchased_categories, purchased_categories)
+            self.assertEqual(
+                profile.purchased_products,
+                set(purchases_df.loc[purchases_df['PersonID'] == person_id, 'ProductName'])
+            )
+
+
+class PurchaseIndexTests(TestCase):
+    def merged_details(self, purchases_df, products_df, person_id):
+        merged = purchases_df.merge(products_df, on='ProductName', how='left')
+        user_data = merged[merged['PersonID'] == person_id].copy()
+        user_data['ImageURL'] = user_data['ProductName'].apply(lambda name: f"{name}.png")
+        return user_data.drop(columns=['PersonID']).to_dict(orient='records')
+
+    def assert_same_records(self, actual, expected):
+        # NaN != NaN, so compare the JSON the view would send
+        self.assertEqual(json.dumps(actual), json.dumps(expected))
+
+    def test_index_matches_merge_then_filter(self):
+        purchases_df, products_df = load_purchases(), load_products()
+        index = build_purchase_index(purchases_df, products_df)
+        for person_id in purchases_df['PersonID'].unique():
+            self.assert_same_records(index.details(person_id), self.merged_details(purchases_df, products_df, person_id))
+        self.assertEqual(index.details(-1), [])
+
+    def test_duplicate_product_rows_expand_like_a_merge(self):
+        purchases_df, products_df = load_purchases(), load_products()
+        products_df = pd.concat([products_df, products_df[products_df['ProductName'] == 'Lapte Mega'].assign(Price=1.0)])
+        index = build_purchase_index(purchases_df, products_df)
+        self.assert_same_records(index.details(1), self.merged_details(purchases_df, products_df, 1))
+
+
+class UserNeighbourTests(TestCase):
+    def setUp(self):
+        self.matrix = create_user_item_matrix(load_purchases()).matrix
+
+    def test_exact_index_matches_brute_force(self):
+        neighbours = build_user_neighbours(self.matrix, k=5, block_size=7)
+        similarity = cosine_similarity(self.matrix)
+        np.fill_diagonal(similarity, 0)
+
+        for row in range(self.matrix.shape[0]):
+            expected = np.sort(similarity[row])[::-1][:5]
+            expected = expected[expected > 0]
+            np.testing.assert_allclose(np.sort(neighbours[row].data)[::-1], expected)
+            self.assertNotIn(row, neighbours[row].indices)
+
+    def test_top_k_breaks_ties_by_column(self):
+        binary = (self.matrix > 0).astype(np.float64)
+        block = (binary @ binary.T).tocsr()
+        top = _top_k_per_row(block, 3, exclude=np.arange(block.shape[0]))
+        for row in range(block.shape[0]):
+            values = block[row].toarray().ravel()
+            values[row] = 0
+            expected = sorted((-value, col) for col, value in enumerate(values) if value > 0)[:3]
+            self.assertEqual(top[row].indices.tolist(), sorted(col for _, col in expected))
+
+    def test_row_normalization_matches_sklearn(self):
+        for matrix in (self.matrix, self.matrix.T):
+            expected = normalize(matrix.astype(np.float64), norm='l2', axis=1)
+            normalized = _normalize_rows(matrix)
+            np.testing.assert_array_equal(normalized.indptr, expected.indptr)
+            np.testing.assert_array_equal(normalized.data, expected.data)
+
+    def test_approximate_index_keeps_exact_weights(self):
+        exact = build_user_neighbours(self.matrix, k=5)
+        approximate = build_user_neighbours(self.matrix, k=5, approximate=True, max_postings=3)
+
+        self.assertTrue((approximate.getnnz(axis=1) <= 5).all())
+        for row in range(self.matrix.shape[0]):
+            self.assertLessEqual(approximate[row].data.sum(), exact[row].data.sum() + 1e-9)
+            for col, weight in zip(approximate[row].indices, approximate[row].data):
+                self.assertAlmostEqual(weight, cosine_similarity(self.matrix[row], self.matrix[col])[0, 0])
+
+
+class ViewTests(DataDirTestCase):
+    def test_recommendations(self):
+        response = self.client.get('/api/data/', {'personId': 1, 'topN': 10})
+        self.assertEqual(response.status_code, 200)
+        recommendations = response.json()['topRecommendations']
+        self.assertEqual(len(recommendations), 10)
+        self.assertEqual(set(recommendations[0]), {'name', 'price', 'discount', 'imageUrl'})
+
+    def test_batch_recommendations_match_single_requests(self):
+        response = self.client.post(
+            '/api/data/batch/', {'personIds': [1, 2, 1, 999999], 'topN': 8}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([result['personId'] for result in data['results']], [1, 2])
+        self.assertEqual(data['missingPersonIds'], [999999])
+        for result in data['results']:
+            single = self.client.get('/api/data/', {'personId': result['personId'], 'topN': 8}).json()
+            self.assertEqual(result['topRecommendations'], single['topRecommendations'])
+
+    def test_batch_chooses_people_by_their_profiles(self):
+        # A model older than the profiles: person 2 has no profile yet, 888888 is not in the model
+        snapshot = catalog_snapshot.get_snapshot()
+        profiles = {**snapshot.user_profiles, 888888: snapshot.user_profiles[1]}
+        del profiles[2]
+        stale = dataclasses.replace(snapshot, user_profiles=profiles)
+
+        body = {'personIds': [1, 2, 888888], 'topN': 8}
+        with mock.patch('handleDataset.views.get_snapshot', return_value=stale), \
+                mock.patch('handleDataset.services.snapshot.get_snapshot', return_value=stale):
+            response = self.client.post('/api/data/batch/', body, content_type='application/json')
+            streamed = self.client.post('/api/data/batch/?stream=json', body, content_type='application/json')
+            self.assertEqual(json.loads(self.streamed(streamed)), response.json())
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([result['personId'] for result in data['results']], [1, 888888])
+        self.assertEqual(data['missingPersonIds'], [2])
+        expected = get_recommendations_for_person(888888, top_n=8, snapshot=stale)
+        self.assertEqual(data['results'][1]['topRecommendations'], json.loads(json.dumps(expected)))
+
+    def test_batch_rejects_bad_body(self):
+        response = self.client.post('/api/data/batch/', {'personIds': 'x'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_purchase_details(self):
+        response = self.client.get('/api/purchase-details/', {'personId': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['purchaseDetails'][0]['ProductName'], 'Lapte Mega')
+
+    def streamed(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_streamed_responses_match_json_responses(self):
+        for url, params, key in (
+            ('/api/data/', {'personId': 1, 'topN': 10}, 'topRecommendations'),
+            ('/api/data/', {'personId': 999999, 'topN': 5}, 'topRecommendations'),
+            ('/api/purchase-details/', {'personId': 1}, 'purchaseDetails'),
+        ):
+            expected = self.client.get(url, params).json()
+
+            streamed = self.client.get(url, {**params, 'stream': 'json'})
+            self.assertEqual(streamed['Content-Type'], 'application/json')
+            self.assertEqual(json.loads(self.streamed(streamed)), expected)
+
+            streamed = self.client.get(url, {**params, 'stream': 'ndjson'})
+            self.assertEqual(streamed['Content-Type'], 'application/x-ndjson')
+            first, *items = [json.loads(line) for line in self.streamed(streamed).splitlines()]
+            self.assertEqual({**first, key: items}, expected)
+
+    def test_streamed_batch(self):
+        body = {'personIds': [1, 2, 1, 999999], 'topN': 8}
+        expected = self.client.post('/api/data/batch/', body, content_type='application/json').json()
+        streamed = self.client.post('/api/data/batch/?stream=json', body, content_type='application/json')
+        self.assertEqual(json.loads(self.streamed(streamed)), expected)
+
+        streamed = self.client.post('/api/data/batch/?stream=ndjson', body, content_type='application/json')
+        lines = [json.loads(line) for line in self.streamed(streamed).splitlines()]
+        self.assertEqual(lines[0], {'topN': 8, 'missingPersonIds': [999999]})
+        self.assertEqual(lines[1:], expected['results'])
+
+    def test_stream_encoder_matches_json(self):
+        columns = [
+            np.array([1, -2, 3], dtype=np.int64),
+            np.array([0.1, np.nan, 1e20]),
+            np.array([True, False, True]),
+            np.array(['ă"\\', None, 4.5], dtype=object),
+        ]
+        rows = [json.loads(row) for row in encode_rows(['i', 'f', 'b', 'o'], columns)]
+        expected = [dict(zip('ifbo', row)) for row in zip(*(column.tolist() for column in columns))]
+        self.assertEqual(json.dumps(rows), json.dumps(expected))
+
+    def test_unknown_stream_format(self):
+        self.assertEqual(self.client.get('/api/data/', {'personId': 1, 'stream': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/purchase-details/', {'personId': 999999, 'stream': 'json'}).status_code, 404)
@@ -1,10 +1,25 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.csrf import csrf_exempt
-from .services.data_processing import load_dataframe, process_data, get_recommendations_for_person
-import pandas as pd
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+from .services.cache import CachedRecommendations, aget_cached_recommendations, get_cached_recommendations, records_etag
+from .services import metrics
+from .services.data_processing import (
+    get_recommendations_for_people,
+    get_recommendations_for_person,
+    iter_recommendations_for_people,
+)
+from .services.ingest import ingest_purchases
+from .services.llm import get_llm_backend
+from .services.recipes import cached_chunks, caching_chunks, get_recipe_cache, recipe_events, recipe_prompt
+from .services.snapshot import get_snapshot
+from .services.streaming import encode_records, encode_rows, stream_format, streaming_response
+from .services.warmup import FAILED, PENDING, READY, readiness, start_warm_up
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 @csrf_exempt
 def DataApi(request):
@@ -20,13 +35,143 @@ def DataApi(request):
         # Convert top_n to an integer
         top_n = int(top_n)
 
-        # Call the recommendation function
-        recommendations = get_recommendations_for_person(person_id=int(person_id), top_n=top_n)
+        # ?stream=ndjson / ?stream=json: stream the list instead of one JsonResponse
+        try:
+            fmt = stream_format(request)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # ?debug=timings / ?debug=profile: compute uncached and report where the time went
+        debug = request.GET.get('debug')
+        if debug in ('timings', 'profile') and getattr(settings, 'RECOMMENDER_DEBUG_REQUESTS', settings.DEBUG):
+            return debug_response(person_id, top_n, profile=debug == 'profile')
+
+        snapshot = get_snapshot()
+        cold_start = int(person_id) not in snapshot.user_profiles
+        if cold_start:
+            # No purchase history: popularity lookup, optionally for a segment or category
+            try:
+                records = snapshot.popularity.recommendations(
+                    top_n, segment=request.GET.get('segment'), category=request.GET.get('category')
+                )
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+            result = CachedRecommendations(records=records, etag=records_etag(records))
+        else:
+            # Call the recommendation function (cached per person, topN and data version)
+            with metrics.stage('data_api'):
+                result = get_cached_recommendations(person_id=int(person_id), top_n=top_n, snapshot=snapshot)
+
+        # Let the client revalidate what it already has
+        etag = quote_etag(result.etag)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        elif fmt is not None:
+            envelope = {"personId": person_id}
+            if cold_start:
+                envelope["coldStart"] = True
+            response = streaming_response(fmt, envelope, "topRecommendations", encode_records(result.records))
+        else:
+            # Prepare the response
+            data = {
+                "personId": person_id,
+                "topRecommendations": result.records
+            }
+            if cold_start:
+                data["coldStart"] = True
+            response = JsonResponse(data, status=200)
+
+        # Return the data as JSON
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+    except Exception as e:
+        # Handle errors and return a meaningful message
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+# DataApi response with the per-stage timings (and optionally a stack sample
+# profile) of computing the recommendations
+def debug_response(person_id, top_n, profile=False):
+    profiler = metrics.get_profiler() if profile else None
+    with metrics.capture() as captured:
+        if profiler is not None:
+            with profiler:
+                records = get_recommendations_for_person(int(person_id), top_n=top_n)
+        else:
+            records = get_recommendations_for_person(int(person_id), top_n=top_n)
+
+    data = {
+        "personId": person_id,
+        "topRecommendations": records,
+        "timings": captured['timings'],
+        "sizes": captured['sizes'],
+    }
+    if profiler is not None:
+        data["profile"] = profiler.report()
+    response = JsonResponse(data, status=200)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@csrf_exempt
+def MetricsApi(request):
+    # Prometheus text exposition of the pipeline timers, sizes and model shape
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@csrf_exempt
+def ReadinessApi(request):
+    # 200 once the recommender snapshot is loaded, 503 while it is warming up
+    state = readiness()
+    if state['status'] in (PENDING, FAILED):
+        # Warm-up was left to first use or failed: let the probe (re)start it
+        start_warm_up('background')
+        state = readiness()
+
+    data = {"status": state['status'], "warmUpSeconds": state['seconds']}
+    if state['error']:
+        data["error"] = state['error']
+    response = JsonResponse(data, status=200 if state['status'] == READY else 503)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@csrf_exempt
+def BatchDataApi(request):
+    if request.method != 'POST':
+        return JsonResponse({"error": "Use POST with a JSON body"}, status=405)
+
+    try:
+        # Parse {"personIds": [...], "topN": 10}
+        try:
+            body = json.loads(request.body or b'{}')
+            if not isinstance(body['personIds'], list):
+                raise TypeError('personIds must be a list')
+            person_ids = [int(person_id) for person_id in body['personIds']]
+            top_n = int(body.get('topN', 10))
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({"error": "Body must be JSON with a personIds list of integers"}, status=400)
+
+        # ?stream=ndjson / ?stream=json: send each batch of people as it is computed
+        try:
+            fmt = stream_format(request)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        if fmt is not None:
+            return stream_batch(fmt, person_ids, top_n)
+
+        # Compute every person together over the shared model
+        recommendations = get_recommendations_for_people(person_ids, top_n=top_n)
 
         # Prepare the response
         data = {
-            "personId": person_id,
-            "topRecommendations": recommendations
+            "topN": top_n,
+            "results": [
+                {"personId": person_id, "topRecommendations": recommendations[person_id]}
+                for person_id in recommendations
+            ],
+            "missingPersonIds": [person_id for person_id in dict.fromkeys(person_ids) if person_id not in recommendations],
         }
 
         # Return the data as JSON
@@ -36,9 +181,54 @@ def DataApi(request):
         return JsonResponse({"error": str(e)}, status=500)
 
 
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-from .services.data_processing import load_dataframe, process_data
+# BatchDataApi response streamed as the recommendations are computed
+def stream_batch(fmt, person_ids, top_n):
+    snapshot = get_snapshot()
+    envelope = {
+        "topN": top_n,
+        "missingPersonIds": [
+            person_id for person_id in dict.fromkeys(person_ids) if person_id not in snapshot.user_profiles
+        ],
+    }
+    results = (
+        '{"personId":%d,"topRecommendations":[%s]}' % (person_id, ','.join(encode_records(records)))
+        for person_id, records in iter_recommendations_for_people(person_ids, top_n=top_n, snapshot=snapshot)
+    )
+    return streaming_response(fmt, envelope, "results", results)
+
+
+@csrf_exempt
+def PurchasesApi(request):
+    if request.method != 'POST':
+        return JsonResponse({"error": "Use POST with a JSON body"}, status=405)
+
+    try:
+        # Parse {"purchases": [{"personId": 1, "productName": "...", "amount": 2}, ...]}
+        try:
+            body = json.loads(request.body or b'{}')
+            if not isinstance(body['purchases'], list):
+                raise TypeError('purchases must be a list')
+            events = [
+                (int(purchase['personId']), str(purchase['productName']), float(purchase.get('amount', 1)))
+                for purchase in body['purchases']
+            ]
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse(
+                {"error": "Body must be JSON with a purchases list of {personId, productName, amount}"}, status=400
+            )
+
+        # Apply them to the shared model and append them to purchases.csv
+        try:
+            snapshot = ingest_purchases(events)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Return the data as JSON
+        return JsonResponse({"ingested": len(events), "revision": snapshot.revision}, status=200)
+    except Exception as e:
+        # Handle errors and return a meaningful message
+        return JsonResponse({"error": str(e)}, status=500)
+
 
 @csrf_exempt
 def PurchaseDetailsApi(request):
@@ -53,35 +243,31 @@ def PurchaseDetailsApi(request):
         # Convert person_id to an integer
         person_id = int(person_id)
 
-        # Load and process purchase and product data
-        purchases_df = load_dataframe('purchases.csv')
-        products_df = load_dataframe('products.csv')
-        purchases_df = process_data(purchases_df)
-        products_df = process_data(products_df)
+        # ?stream=ndjson / ?stream=json: stream the rows straight from the index columns
+        try:
+            fmt = stream_format(request)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        if fmt is not None:
+            names, columns = get_snapshot().purchase_index.columns(person_id)
+            if not len(columns[0]):
+                return JsonResponse({"error": "No data found for the given personId"}, status=404)
+            return streaming_response(fmt, {"personId": person_id}, "purchaseDetails", encode_rows(names, columns))
 
-        # Merge purchases with product details
-        merged_data = purchases_df.merge(products_df, on='ProductName', how='left')
-        user_data = merged_data[merged_data['PersonID'] == person_id]
+        # This person's purchases joined with product details (ImageURL included)
+        purchase_details = get_snapshot().purchase_index.details(person_id)
 
         # Check if data is available for the user
-        if user_data.empty:
+        if not purchase_details:
             return JsonResponse({"error": "No data found for the given personId"}, status=404)
 
-        # Add ImageURL column
-        user_data['ImageURL'] = user_data['ProductName'].apply(
-            lambda name: f"{name}.png"
-        )
-
-        # Prepare response data
-        purchase_details = user_data.drop(columns=['PersonID']).to_dict(orient='records')
-
         # Return the data as JSON
         return JsonResponse({"personId": person_id, "purchaseDetails": purchase_details}, status=200)
     except Exception as e:
         # Handle errors and return a meaningful message
         return JsonResponse({"error": str(e)}, status=500)
 
-def generate_recipe(request):
+async def generate_recipe(request):
     # Extract query parameters
     person_id = request.GET.get('personId', None)  # Get personId from the GET request
 
@@ -93,40 +279,45 @@ def generate_recipe(request):
         # Convert person_id to an integer
         person_id = int(person_id)
 
-        # Load the dataset
-        data = pd.read_csv("handleDataset/data/products.csv")
+        # Shared catalogue snapshot
+        snapshot = await asyncio.to_thread(get_snapshot)
 
         # Get recommendations for the person
-        recommendations = get_recommendations_for_person(person_id=person_id, top_n=24)
-        recommended_product_names = [item['name'] for item in recommendations]
+        result = await aget_cached_recommendations(person_id=person_id, top_n=24, snapshot=snapshot)
+        recommended_product_names = [item['name'] for item in result.records]
 
         # Log recommendations for debugging
-        print("Recommended Products:", recommended_product_names)
+        logger.debug("Recommended products: %s", recommended_product_names)
 
-        # Prepare all available food items
-        all_food_items = data['ProductName'].tolist()
+        # Reuse a recipe already generated for this (or a very similar) ingredient set
+        recipe_cache = get_recipe_cache()
+        recipe = recipe_cache.get(recommended_product_names, snapshot.catalogue_version)
 
-        # Convert lists to comma-separated strings
-        recommended_products_str = ', '.join(recommended_product_names)
-        all_food_items_str = ', '.join(all_food_items)
+        # Otherwise ask for a recipe using the recommendations and all available food items
+        if recipe is None:
+            prompt = recipe_prompt(recommended_product_names, snapshot.product_names)
+            backend = get_llm_backend()
 
-        # Load environment variables and configure generative AI
-        load_dotenv()
-        API_KEY = os.getenv("GEMINI_API_KEY")
-        genai.configure(api_key=API_KEY)
-        model = genai.GenerativeModel("gemini-1.5-flash")
+        # Stream the recipe as server-sent events when the client asks for them
+        if request.GET.get('stream') == '1' or 'text/event-stream' in request.headers.get('Accept', ''):
+            if recipe is None:
+                chunks = caching_chunks(
+                    backend.stream(prompt), recipe_cache, recommended_product_names, snapshot.catalogue_version
+                )
+            else:
+                chunks = cached_chunks(recipe)
+            response = StreamingHttpResponse(recipe_events(person_id, chunks), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
 
         # Generate the recipe
-        response = model.generate_content(
-            "Ești un bucătar foarte priceput, scopul tău este să creezi o rețetă culinară în care să utilizezi unele din următoarele ingrediente: "
-            + recommended_products_str
-            + ". Încearcă să folosești în principal ingredientele pe care ți le-am dat, dar dacă nu sunt suficiente, adaugă cu prioritate peste orice alte ingrediente comune pe cele din lista următoare: "
-            + all_food_items_str
-            + ". Este important ca rețeta să fie simplă și accesibilă pentru oricine. Nu include niciun alt text suplimentar. Tot ceea ce trebuie să returnezi este rețeta și lista de ingrediente. De asemenea, limbajul trebuie să fie simplu și să facă rețeta să pară ușoară. Inconjoara fiecare idee cu <h1>, respectiv <p>"
-        )
+        if recipe is None:
+            recipe = await backend.generate(prompt)
+            recipe_cache.set(recommended_product_names, snapshot.catalogue_version, recipe)
 
         # Return the recipe as JSON
-        return JsonResponse({"personId": person_id, "recipe": response.text}, status=200)
+        return JsonResponse({"personId": person_id, "recipe": recipe}, status=200)
     except Exception as e:
         # Handle errors and return a meaningful message
-        return JsonResponse({"error": str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({"error": str(e)}, status=500)